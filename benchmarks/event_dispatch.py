@@ -0,0 +1,115 @@
+"""
+Benchmark the crash and action event checks of the event handler.
+
+Runs synthetic debug events, mostly thread and DLL events like a target
+loading lots of DLLs and spawning lots of threads, through the crash and
+action checks done for every event: first the list lookups used before
+event filters, then the compiled event filters.
+
+    python benchmarks/event_dispatch.py --events 1000000 --exceptions 1
+"""
+import argparse
+import random
+import time
+
+from winappdbg import win32
+
+from crashdbg.handler import EventFilter
+from crashdbg.options import Options
+
+# Handler methods of the synthetic events, and how often they happen.
+EVENT_MIX = (
+    ('create_thread', 40),
+    ('exit_thread', 40),
+    ('load_dll', 15),
+    ('unload_dll', 5),
+)
+
+
+class SyntheticEvent(object):
+    """
+    Just enough of a debug event for the event checks.
+    """
+
+    def __init__(self, eventMethod, eventCode, lastChance=False):
+        self.eventMethod = eventMethod
+        self.eventCode = eventCode
+        self.lastChance = lastChance
+
+    def get_event_code(self):
+        return self.eventCode
+
+    def is_last_chance(self):
+        return self.lastChance
+
+
+def make_events(count, exceptions):
+    """
+    Build the synthetic events, with C{exceptions} percent of exceptions.
+    """
+    rnd = random.Random(0)
+    methods = []
+    for method, weight in EVENT_MIX:
+        methods.extend([method] * weight)
+    events = []
+    for index in range(count):
+        if rnd.random() * 100 < exceptions:
+            events.append(SyntheticEvent('access_violation', win32.EXCEPTION_DEBUG_EVENT,
+                                         rnd.random() < 0.5))
+        else:
+            # Debug event codes other than exceptions are all greater than 1.
+            events.append(SyntheticEvent(rnd.choice(methods), 2))
+    return events
+
+
+def is_event_in_list(event, event_list, firstchance):
+    """
+    The event check used by the event handler before event filters.
+    """
+    return \
+        ('event' in event_list) or ('exception' in event_list and
+                                    (event.get_event_code() == win32.EXCEPTION_DEBUG_EVENT and
+                                     (event.is_last_chance() or firstchance))) or \
+        (event.eventMethod in event_list)
+
+
+def run_lists(events, options):
+    start = time.time()
+    for event in events:
+        is_event_in_list(event, options.crash_events, options.firstchance)
+        options.action and is_event_in_list(event, options.action_events, options.firstchance)
+    return time.time() - start
+
+
+def run_filters(events, options):
+    crashFilter = EventFilter(options.crash_events, options.firstchance)
+    actionFilter = None
+    if options.action:
+        actionFilter = EventFilter(options.action_events, options.firstchance)
+    start = time.time()
+    for event in events:
+        crashFilter.matches(event)
+        actionFilter is not None and actionFilter.matches(event)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=1000000)
+    parser.add_argument('--exceptions', type=float, default=1.0,
+                        help='percentage of exception events')
+    args = parser.parse_args()
+
+    options = Options()
+    options.action = ['echo %pid%']
+    events = make_events(args.events, args.exceptions)
+    print("%d events, %.1f%% exceptions" % (args.events, args.exceptions))
+    baseline = run_lists(events, options)
+    print("lists     %8.2fs %10.0f events/s" % (baseline, args.events / baseline))
+    elapsed = run_filters(events, options)
+    print("filters   %8.2fs %10.0f events/s  speedup x%.2f" % (
+        elapsed, args.events / elapsed, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Benchmark the parallel report rendering.
+
+Creates a synthetic DBM crash database and renders the full report with an
+increasing number of worker processes, printing the wall time and speedup.
+
+    python benchmarks/report_jobs.py --crashes 20000 --jobs 1,2,4,8
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from winappdbg import CrashContainer
+
+from crashdbg import Options, print_crash_report
+from synthetic import make_crashes
+
+
+def run(url, jobs, verbose):
+    options = Options()
+    options.database = url
+    options.jobs = jobs
+    options.verbose = verbose
+    cc = CrashContainer(url[6:])
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = time.time()
+        print_crash_report(cc, options)
+        return time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--crashes', type=int, default=10000)
+    parser.add_argument('--jobs', default='1,2,4,8')
+    parser.add_argument('--brief', action='store_true')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='crashdbg-bench-')
+    try:
+        url = 'dbm://' + os.path.join(tmpdir, 'crashes.dbm')
+        cc = CrashContainer(url[6:])
+        for crash in make_crashes(args.crashes, signatures=args.crashes):
+            cc.add(crash)
+        del cc
+
+        baseline = None
+        print("%d crashes, %s report" % (args.crashes, 'brief' if args.brief else 'full'))
+        for jobs in [int(x) for x in args.jobs.split(',')]:
+            elapsed = run(url, jobs, not args.brief)
+            if baseline is None:
+                baseline = elapsed
+            print("jobs=%-3d %8.2fs %8.0f crashes/s  speedup x%.2f" % (
+                jobs, elapsed, args.crashes / elapsed, baseline / elapsed))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Benchmark batched SQL crash inserts.
+
+Stores synthetic crashes into a local SQLite database, first one transaction
+per crash, then with the crash batcher at several batch sizes.
+
+    python benchmarks/sql_batching.py --crashes 2000 --batch 10,100,500
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from winappdbg import CrashDictionary
+
+from crashdbg.database import CrashBatcher
+from synthetic import make_crash
+
+
+def run(url, crashes, batch_size):
+    cc = CrashDictionary(url)
+    if batch_size > 1:
+        cc = CrashBatcher(cc, batch_size, flush_ms=0)
+    start = time.time()
+    for crash in crashes:
+        cc.add(crash)
+    if batch_size > 1:
+        cc.close()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--crashes', type=int, default=2000)
+    parser.add_argument('--batch', default='10,100,500')
+    args = parser.parse_args()
+
+    crashes = [make_crash(index) for index in range(args.crashes)]
+    tmpdir = tempfile.mkdtemp(prefix='crashdbg-bench-')
+    try:
+        baseline = None
+        print("%d crashes into SQLite" % args.crashes)
+        for batch_size in [1] + [int(x) for x in args.batch.split(',')]:
+            url = 'sqlite:///' + os.path.join(tmpdir, 'crashes-%d.db' % batch_size)
+            elapsed = run(url, crashes, batch_size)
+            if baseline is None:
+                baseline = elapsed
+            print("batch=%-5d %8.2fs %8.0f crashes/s  speedup x%.2f" % (
+                batch_size, elapsed, args.crashes / elapsed, baseline / elapsed))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Synthetic crash objects for the benchmarks.
+
+The crashes are built without a debug event, filling in the same attributes
+the Crash constructor does, so they can be stored and rendered like real ones.
+"""
+import random
+import time
+
+from winappdbg import Crash, System
+
+__all__ = [
+    'make_crash',
+    'make_crashes',
+]
+
+REGISTERS = ('Eax', 'Ebx', 'Ecx', 'Edx', 'Esi', 'Edi', 'Ebp', 'Esp', 'Eip',
+             'EFlags', 'SegCs', 'SegDs', 'SegEs', 'SegFs', 'SegGs', 'SegSs')
+
+
+def make_crash(index, signatures=64, timeStamp=None):
+    """
+    Build a synthetic access violation crash.
+
+    Crashes with the same C{index % signatures} share the same signature.
+    """
+    rnd = random.Random(index)
+    bucket = index % signatures
+    pc = 0x401000 + bucket * 0x10
+
+    crash = Crash.__new__(Crash)
+    crash.timeStamp = timeStamp if timeStamp is not None else \
+        time.time() - rnd.random() * 86400
+    crash.notes = ['Config: synthetic']
+    crash.os = System.os
+    crash.arch = 'i386'
+    crash.bits = 32
+    crash.eventCode = 1         # EXCEPTION_DEBUG_EVENT
+    crash.eventName = 'Exception event'
+    crash.pid = 1000 + rnd.randint(0, 100)
+    crash.tid = 2000 + rnd.randint(0, 100)
+    crash.registers = dict((name, rnd.randint(0, 0xFFFFFFFF)) for name in REGISTERS)
+    crash.registers['Eip'] = pc
+    crash.labelPC = 'target!func_%d+0x10' % bucket
+
+    crash.commandLine = u'target.exe --synthetic'
+    crash.environment = None
+    crash.environmentData = None
+    crash.registersPeek = None
+    crash.debugString = None
+    crash.modFileName = u'C:\\target\\target.exe'
+    crash.lpBaseOfDll = 0x400000
+    crash.exceptionCode = 0xC0000005
+    crash.exceptionName = 'EXCEPTION_ACCESS_VIOLATION'
+    crash.exceptionDescription = 'Access violation'
+    crash.exceptionAddress = pc
+    crash.exceptionLabel = crash.labelPC
+    crash.firstChance = False
+    crash.faultType = 0
+    crash.faultAddress = rnd.randint(0, 0xFFFF)
+    crash.faultLabel = None
+    crash.isOurBreakpoint = False
+    crash.isSystemBreakpoint = False
+    crash.stackTrace = [(0x12FF00 + i * 0x20, 0x401000 + (bucket + i) * 0x10,
+                         'target.exe') for i in range(8)]
+    crash.stackTracePC = tuple(ra for (fp, ra, lib) in crash.stackTrace)
+    crash.stackTraceLabels = tuple('target!func_%d' % (bucket + i) for i in range(8))
+    crash.stackTracePretty = None
+    crash.stackRange = (0x120000, 0x130000)
+    crash.stackFrame = None
+    crash.stackPeek = None
+    crash.faultCode = None
+    crash.faultMem = None
+    crash.faultPeek = None
+    crash.faultDisasm = None
+    crash.memoryMap = None
+    return crash
+
+
+def make_crashes(count, signatures=64):
+    """
+    Iterate over C{count} synthetic crashes.
+    """
+    for index in range(count):
+        yield make_crash(index, signatures)
@@ -2,4 +2,5 @@ from .options import Options
 from .handler import CrashEventHandler
 from .monitor import CrashMonitor, run_crash_monitor
 from .report import open_database, print_crash_report, print_report_for_database, \
-    filter_duplicates, filter_inexistent_files
+    iter_crashes_by_time, open_databases, print_merged_report, iter_merged_crashes, \
+    print_crashes, sort_crashes_by_time
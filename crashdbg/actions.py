@@ -0,0 +1,212 @@
+"""
+Asynchronous action commands.
+
+The action commands configured in the config file run when a new crash is
+found. Running them from the event handler stops the debug loop, and the
+debugee, until every command finishes. The action executor runs them from a
+pool of worker threads instead.
+
+The variables in the commands are replaced when the crash is captured, so
+queued commands describe the crash that triggered them, even if they only
+run later. Python plugins are queued the same way, already bound to the
+crash and its variables.
+"""
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+from winappdbg import System
+
+__all__ = [
+    'ActionExecutor',
+    'ActionVariables',
+    'ACTION_MODES',
+    'ACTION_VARIABLES',
+    'replace_variables',
+    'run_action_command',
+]
+
+# How action commands are run:
+#   sync  - from the event handler, the debugee waits for them
+#   async - from a pool of worker threads
+ACTION_MODES = ('sync', 'async')
+
+# Variables replaced in the action commands, without the percent signs.
+ACTION_VARIABLES = ('COUNT', 'EXCEPTIONCODE', 'EVENTCODE', 'EXCEPTION', 'EVENT',
+                    'PC', 'SP', 'FP', 'WHERE')
+
+
+def replace_variables(text, variables):
+    """
+    Replace the C{%NAME%} variables in an action command line string.
+
+    @type  variables: dict(str S{->} str)
+    @param variables: Map of variable names, without the percent signs, to
+        their values. Only the variables found in the text are looked up.
+    """
+    for name in variables:
+        variable = '%' + name + '%'
+        if variable in text:
+            text = text.replace(variable, variables[name])
+    return text
+
+
+class ActionVariables(Mapping):
+    """
+    Read-only map of the action variables of a crash. Each value is only
+    computed the first time it's looked up, so variables like C{COUNT} that
+    need the database cost nothing unless they're used.
+
+    @type getter: callable
+    @ivar getter: Function taking a variable name and returning its value.
+    """
+
+    def __init__(self, getter, names=ACTION_VARIABLES):
+        self.getter = getter
+        self.names = names
+        self.values = dict()
+
+    def __getitem__(self, name):
+        if name not in self.names:
+            raise KeyError(name)
+        try:
+            return self.values[name]
+        except KeyError:
+            value = self.values[name] = self.getter(name)
+            return value
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
+def run_action_command(command, timeout=0):
+    """
+    Run an action command with cmd.exe and wait for it to finish.
+
+    @type  timeout: int
+    @param timeout: Milliseconds to wait before killing the command, or 0
+        to wait for as long as it takes. Only cmd.exe is killed, not the
+        processes it started.
+
+    @rtype:  bool
+    @return: C{True} if the command finished, C{False} if it was killed.
+    """
+    system = System()
+    process = system.start_process("cmd.exe /c " + command, bConsole=True)
+    if not timeout:
+        process.wait()
+        return True
+    process.wait(timeout)
+    if process.is_alive():
+        process.kill()
+        return False
+    return True
+
+
+class ActionExecutor(object):
+    """
+    Runs the action commands of each event from a pool of worker threads.
+
+    The commands of an event run one after the other, in order. The
+    commands of different events run at the same time, up to one event per
+    worker, unless C{ordered} is set. Then a single worker runs them in the
+    same order the events happened.
+
+    Events are queued without waiting. If the queue is full their commands
+    are discarded.
+
+    @type dropped: int
+    @ivar dropped: Number of events whose commands were discarded because
+        the queue was full.
+
+    @type killed: int
+    @ivar killed: Number of commands killed for running too long.
+    """
+
+    def __init__(self, workers=2, queue_size=64, timeout=0, ordered=False,
+                 logger=None, runner=run_action_command):
+        if ordered:
+            workers = 1
+        self.timeout = timeout
+        self.logger = logger
+        self.runner = runner
+        self.dropped = 0
+        self.killed = 0
+        self.queue = queue.Queue(queue_size)
+        self.lock = threading.Lock()    # protects the counters
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name='ActionExecutor-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, commands):
+        """
+        Queue the action commands of an event.
+
+        @type  commands: list of str or callable
+        @param commands: Command lines, with the variables already replaced,
+            or Python plugins bound to the crash, called without arguments.
+            The timeout doesn't apply to plugins.
+        """
+        try:
+            self.queue.put_nowait(list(commands))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            if self.logger is not None:
+                self.logger.log_text("Warning: action queue full, dropped the actions of an event")
+
+    def flush(self):
+        """
+        Wait until every queued command has run.
+        """
+        self.queue.join()
+
+    def close(self):
+        """
+        Run every queued command and stop the worker threads.
+        """
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def _run(self):
+        while 1:
+            commands = self.queue.get()
+            try:
+                if commands is None:
+                    return
+                for command in commands:
+                    self._run_command(command)
+            finally:
+                self.queue.task_done()
+
+    def _run_command(self, command):
+        try:
+            if callable(command):
+                command()
+                return
+            if self.runner(command, self.timeout):
+                return
+        except Exception:
+            if self.logger is not None:
+                self.logger.log_exc()
+            return
+        with self.lock:
+            self.killed += 1
+        if self.logger is not None:
+            self.logger.log_text("Warning: action command timed out: %s" % command)
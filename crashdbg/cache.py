@@ -0,0 +1,167 @@
+"""
+Persistent cache of rendered crash reports.
+
+Stored crashes never change, so their brief and full reports can be rendered
+once and read back on later report runs. The cache is a SQLite file next to
+the crash database, bounded in size by evicting the least recently used
+reports. It's only created next to databases the user can write to.
+"""
+import os
+import sqlite3
+import time
+
+from .database import database_filename, sidecar_filename
+
+__all__ = [
+    'REPORT_FORMAT_VERSION',
+    'ReportCache',
+]
+
+# Bump this whenever the report text format changes,
+# so reports rendered by older versions are ignored.
+REPORT_FORMAT_VERSION = 1
+
+# Default maximum size of the cached reports, in bytes.
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+# Number of changes made to the cache before committing them.
+COMMIT_BATCH_SIZE = 1000
+
+# Eviction stops when the cache gets down to this fraction of its size.
+EVICTION_RATIO = 0.9
+
+
+class ReportCache(object):
+    """
+    Rendered report text, keyed by crash key digest, timestamp and verbosity.
+
+    @type bytes: int
+    @ivar bytes: Total size of the cached reports, in bytes. Reports are
+        evicted as soon as it goes over the maximum size.
+    """
+
+    def __init__(self, filename, max_bytes=DEFAULT_CACHE_BYTES):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.touched = []
+        self.pending = 0
+        self.db = sqlite3.connect(filename)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS reports (
+                id TEXT PRIMARY KEY,
+                text BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                atime REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS reports_atime ON reports (atime);
+        """)
+        self.bytes = self.size()
+
+    @classmethod
+    def for_database(cls, url, max_bytes=DEFAULT_CACHE_BYTES):
+        """
+        Open (or create) the report cache of a database.
+
+        @rtype:  L{ReportCache} or None
+        @return: Report cache, or C{None} if the database can't have one or
+            it can't be written to.
+        """
+        filename = sidecar_filename(url, '.cache')
+        if not filename:
+            return None
+        # Don't leave files next to databases we can only read.
+        if not os.access(database_filename(url), os.W_OK):
+            return None
+        if os.path.exists(filename):
+            if not os.access(filename, os.W_OK):
+                return None
+        elif not os.access(os.path.dirname(filename) or os.curdir, os.W_OK):
+            return None
+        return cls(filename, max_bytes)
+
+    @staticmethod
+    def _id(digest, timeStamp, verbose):
+        return '%d:%s:%r:%d' % (REPORT_FORMAT_VERSION, digest, timeStamp, bool(verbose))
+
+    def get(self, digest, timeStamp, verbose):
+        """
+        Get a cached report.
+
+        @rtype:  str or None
+        @return: Report text, or C{None} on a cache miss.
+        """
+        id = self._id(digest, timeStamp, verbose)
+        row = self.db.execute("SELECT text FROM reports WHERE id = ?", (id,)).fetchone()
+        if row is None:
+            return None
+        self.touched.append(id)
+        if len(self.touched) >= COMMIT_BATCH_SIZE:
+            self._touch()
+            self.db.commit()
+        text = row[0]
+        if not isinstance(text, (bytes, type(u''))):
+            text = bytes(text)
+        return text
+
+    def put(self, digest, timeStamp, verbose, text):
+        """
+        Store a rendered report, evicting old ones if the cache gets too big.
+        """
+        id = self._id(digest, timeStamp, verbose)
+        value = sqlite3.Binary(text) if isinstance(text, bytes) else text
+        # A replaced report no longer counts.
+        row = self.db.execute("SELECT size FROM reports WHERE id = ?", (id,)).fetchone()
+        if row is not None:
+            self.bytes -= row[0]
+        self.db.execute("INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?)",
+                        (id, value, len(text), time.time()))
+        self.bytes += len(text)
+        self.pending += 1
+        if self.bytes > self.max_bytes:
+            # The reports read so far count as recently used.
+            self._touch()
+            self.evict()
+        if self.pending >= COMMIT_BATCH_SIZE:
+            self.pending = 0
+            self.db.commit()
+
+    def _touch(self):
+        now = time.time()
+        self.db.executemany("UPDATE reports SET atime = ? WHERE id = ?",
+                            [(now, id) for id in self.touched])
+        self.touched = []
+
+    def size(self):
+        """
+        Total size of the cached reports, in bytes.
+        """
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM reports").fetchone()[0]
+
+    def evict(self):
+        """
+        Drop the least recently used reports until the cache fits its size.
+        """
+        size = self.size()
+        self.bytes = size
+        if size <= self.max_bytes:
+            return
+        target = self.max_bytes * EVICTION_RATIO
+        victims = []
+        for id, length in self.db.execute("SELECT id, size FROM reports ORDER BY atime"):
+            if size <= target:
+                break
+            victims.append((id,))
+            size -= length
+        self.db.executemany("DELETE FROM reports WHERE id = ?", victims)
+        self.bytes = size
+
+    def close(self):
+        """
+        Write pending changes, evict old reports and close the cache.
+        """
+        try:
+            self._touch()
+            self.evict()
+            self.db.commit()
+        finally:
+            self.db.close()
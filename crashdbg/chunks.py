@@ -0,0 +1,247 @@
+"""
+Deduplicated storage of crash memory snapshots.
+
+Crashes of the same program share most of their memory: loaded modules,
+untouched heaps and so on. The chunk store splits each memory snapshot into
+page-sized chunks, keyed by their hash, and keeps every distinct chunk only
+once in a SQLite file next to the crash database. Crashes only keep the list
+of chunk hashes of each memory region.
+
+Chunks are reference counted, so the ones no longer used by any crash can
+be pruned after crashes are deleted.
+"""
+import copy
+import hashlib
+import sqlite3
+
+from winappdbg import CrashContainer
+
+from .database import CrashBatcher, sidecar_filename
+
+__all__ = [
+    'ChunkStore',
+    'MemoryDeduplicator',
+    'load_crash_memory',
+]
+
+# Size of the chunks memory snapshots are split into. Memory regions are
+# page aligned, so the same pages produce the same chunks in every crash.
+CHUNK_SIZE = 4096
+
+
+class ChunkStore(object):
+    """
+    Reference counted chunks of data, keyed by their SHA1 hash.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                hash TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                refs INTEGER NOT NULL
+            );
+        """)
+
+    @classmethod
+    def for_database(cls, url):
+        """
+        Open (or create) the chunk store of a database.
+
+        @rtype:  L{ChunkStore} or None
+        @return: Chunk store, or C{None} if the database can't have one.
+        """
+        filename = sidecar_filename(url, '.chunks')
+        if not filename:
+            return None
+        return cls(filename)
+
+    def close(self):
+        self.db.close()
+
+    def put(self, data):
+        """
+        Store a block of data.
+
+        Only the chunks not already in the store are written, the rest just
+        get their reference counts increased.
+
+        @rtype:  list of str
+        @return: Hashes of the chunks of the data, in order.
+        """
+        with self.db:
+            return self._put(data)
+
+    def put_many(self, blocks):
+        """
+        Store several blocks of data in a single transaction.
+
+        @rtype:  list of list of str
+        @return: Hashes of the chunks of each block, as returned by L{put}.
+        """
+        with self.db:
+            return [self._put(data) for data in blocks]
+
+    def _put(self, data):
+        hashes = []
+        chunks = dict()
+        for offset in range(0, len(data), CHUNK_SIZE):
+            chunk = data[offset:offset + CHUNK_SIZE]
+            hash = hashlib.sha1(chunk).hexdigest()
+            hashes.append(hash)
+            chunks[hash] = chunk
+        self.db.executemany(
+            "INSERT OR IGNORE INTO chunks (hash, data, refs) VALUES (?, ?, 0)",
+            [(hash, sqlite3.Binary(chunk)) for hash, chunk in chunks.items()])
+        self._add_refs(hashes, 1)
+        return hashes
+
+    def get(self, hashes):
+        """
+        Read back a block of data stored with L{put}.
+
+        @raise KeyError: A chunk is missing from the store.
+        """
+        chunks = []
+        for hash in hashes:
+            row = self.db.execute("SELECT data FROM chunks WHERE hash = ?", (hash,)).fetchone()
+            if row is None:
+                raise KeyError(hash)
+            chunks.append(bytes(row[0]))
+        return b''.join(chunks)
+
+    def release(self, hashes):
+        """
+        Drop one reference to each of the given chunks.
+        Chunks are not deleted until L{prune} is called.
+        """
+        with self.db:
+            self._add_refs(hashes, -1)
+
+    def _add_refs(self, hashes, sign):
+        counts = dict()
+        for hash in hashes:
+            counts[hash] = counts.get(hash, 0) + 1
+        self.db.executemany("UPDATE chunks SET refs = refs + ? WHERE hash = ?",
+                            [(sign * count, hash) for hash, count in counts.items()])
+
+    def prune(self):
+        """
+        Delete the chunks no longer used by any crash.
+
+        @rtype:  int
+        @return: Number of chunks deleted.
+        """
+        with self.db:
+            return self.db.execute("DELETE FROM chunks WHERE refs <= 0").rowcount
+
+    def release_crash(self, crash):
+        """
+        Drop the references of a crash being deleted from the database.
+        """
+        hashes = []
+        for region in (getattr(crash, 'memoryChunks', None) or {}).values():
+            hashes.extend(region)
+        self.release(hashes)
+
+
+class MemoryDeduplicator(object):
+    """
+    Moves the memory snapshots of the crashes added to a container into a
+    chunk store.
+
+    The stored crashes get a C{memoryChunks} attribute mapping the base
+    address of each memory region to its chunk hashes, and the contents of
+    the regions are removed. Use L{load_crash_memory} to put them back. The
+    crashes given to L{add} are left as they are.
+
+    It can be used in place of the container: C{add}, C{in}, C{len} and
+    iteration are passed on to it.
+
+    @type repeatedKeys: bool
+    @ivar repeatedKeys: C{True} if the container stores crashes with the
+        same key as a crash it already has, C{False} if it ignores them.
+    """
+
+    def __init__(self, container, chunks):
+        self.container = container
+        self.chunks = chunks
+        self.repeatedKeys = _keeps_repeated_keys(container)
+
+    def __contains__(self, crash):
+        return crash in self.container
+
+    def __len__(self):
+        return len(self.container)
+
+    def __iter__(self):
+        return iter(self.container)
+
+    def add(self, crash):
+        """
+        Store the memory snapshot of a crash in chunks, then a copy of the
+        crash without it.
+
+        Crashes the container would ignore are passed on as they are, so
+        their chunks aren't referenced by a crash that is never stored. If
+        storing the crash fails the chunk references are dropped again.
+        """
+        memoryMap = getattr(crash, 'memoryMap', None)
+        if not memoryMap or (not self.repeatedKeys and crash in self.container):
+            self.container.add(crash)
+            return
+
+        # Don't touch the crash or its region objects, the crash
+        # may still be in use by the debugger thread.
+        regions = [copy.copy(mbi) for mbi in memoryMap]
+        dumped = [mbi for mbi in regions if getattr(mbi, 'content', None)]
+        blocks = self.chunks.put_many([mbi.content for mbi in dumped])
+        # Copy the attributes directly, copy.copy() would go through
+        # __getstate__ and compress the whole crash.
+        stored = object.__new__(type(crash))
+        stored.__dict__.update(crash.__dict__)
+        stored.memoryChunks = dict()
+        for mbi, hashes in zip(dumped, blocks):
+            stored.memoryChunks[mbi.BaseAddress] = hashes
+            mbi.content = None
+        stored.memoryMap = regions
+        try:
+            self.container.add(stored)
+        except Exception:
+            self.chunks.release_crash(stored)
+            raise
+
+    def close(self):
+        self.chunks.close()
+
+
+def _keeps_repeated_keys(container):
+    """
+    Determine if a container stores crashes with the key of a crash it
+    already has. DBM files never do, they keep one crash per key.
+    """
+    while isinstance(container, CrashBatcher):
+        container = container.container
+    if isinstance(container, CrashContainer):
+        return False
+    if getattr(container, 'unique', False):
+        return False
+    return getattr(container, '_allowRepeatedKeys', True)
+
+
+def load_crash_memory(crash, chunks):
+    """
+    Put back the memory snapshot of a crash stored through a
+    L{MemoryDeduplicator}. Crashes stored without one are left as they are.
+
+    @raise KeyError: A chunk is missing from the store.
+    """
+    memoryChunks = getattr(crash, 'memoryChunks', None)
+    if not memoryChunks or not getattr(crash, 'memoryMap', None):
+        return
+    for mbi in crash.memoryMap:
+        hashes = memoryChunks.get(mbi.BaseAddress)
+        if hashes is not None:
+            mbi.content = chunks.get(hashes)
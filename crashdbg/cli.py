@@ -1,11 +1,29 @@
+import multiprocessing
 import os
 import sys
+import time
+from itertools import islice
 
 import better_exceptions
 import click
-from winappdbg import System
+from winappdbg import CrashContainer, System
 
-from crashdbg import run_crash_monitor, print_report_for_database, open_database, Options
+from crashdbg import run_crash_monitor, print_report_for_database, open_database, Options, \
+    open_databases, print_merged_report, print_crashes
+from crashdbg.cache import ReportCache
+from crashdbg.chunks import ChunkStore
+from crashdbg.compression import DEFAULT_DICTIONARY_SIZE, CompressedCrash, dictionary_filename, \
+    setup_compression, train_dictionary
+from crashdbg.database import open_crash_container, sidecar_filename
+from crashdbg.export import EXPORT_FORMATS, open_exporter, export_crashes
+from crashdbg.index import CrashIndex, CrashQuery, open_crash_index, iter_query_crashes
+from crashdbg.migrate import MIGRATE_BATCH_SIZE, MigrationCheckpoint, migrate_crashes, \
+    setup_migration_compression
+from crashdbg.pagination import DEFAULT_PAGE_SIZE, Page, decode_cursor, get_page
+from crashdbg.retention import RetentionPolicy, compact_database, parse_duration, prune_crashes
+from crashdbg.sqlstore import CrashStore
+from crashdbg.summary import CrashSummary, print_crash_summary
+from crashdbg.watermark import Watermark, iter_new_crashes
 
 better_exceptions.patch_logging()
 
@@ -98,17 +116,320 @@ def run(config):
 @cli.command()
 @click.option("-v", "--verbose", help="produces a full report")
 # @click.option("-q", "--quiet", help="produces a brief report")
+@click.option("-j", "--jobs", default=1, type=click.IntRange(1), help="number of worker processes rendering the report")
+@click.option("-m", "--merge", is_flag=True, help="merge all databases into a single report sorted by time")
+@click.option("-f", "--format", "fmt", default="text", type=click.Choice(["text"] + sorted(EXPORT_FORMATS)),
+              help="output format")
+@click.option("-o", "--output", type=click.Path(dir_okay=False), help="output file for the export formats, replaced if it exists")
+@click.option("-i", "--incremental", is_flag=True, help="only report crashes added since the last incremental run")
+@click.option("--since", help="only crashes after this time (e.g. 24h, 7d, 2018-01-31)")
+@click.option("--until", help="only crashes before this time")
+@click.option("--exception-code", help="only crashes with this exception code or name")
+@click.option("--module", help="only crashes in this module")
+@click.option("--pc", help="only crashes at this address or label")
+@click.option("--event", help="only crashes for this event code or name")
+@click.option("-s", "--summary", is_flag=True, help="print crash counts per signature, exception and module")
+@click.option("--top", default=10, type=click.IntRange(1), help="number of buckets shown in the summary")
+@click.option("--cache/--no-cache", default=False, help="cache rendered reports next to the database")
+@click.option("--cache-size", default=256, type=click.IntRange(1), help="maximum size of the report cache in MB")
+@click.option("--limit", type=click.IntRange(1), help="maximum number of crashes to report")
+@click.option("--offset", type=click.IntRange(0), help="number of crashes to skip")
+@click.option("--reverse", is_flag=True, help="report the newest crashes first")
+@click.option("--cursor", help="continue after the last page, using the cursor it printed")
 @click.argument('config', nargs=-1, type=click.Path(exists=True))
-def report(verbose, config):
+def report(verbose, jobs, merge, fmt, output, incremental, since, until, exception_code, module, pc, event,
+           summary, top, cache, cache_size, limit, offset, reverse, cursor, config):
     """
     Generate crash report from crash DB
     """
     options = Options()
     options.verbose = verbose
+    options.jobs = jobs
+    try:
+        query = CrashQuery.from_strings(since, until, exception_code, module, pc, event)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    page = None
+    if limit or offset or reverse or cursor:
+        page = Page(limit or DEFAULT_PAGE_SIZE, offset or 0, reverse)
+        if cursor:
+            try:
+                page.cursor, page.reverse = decode_cursor(cursor)
+            except ValueError as e:
+                raise click.BadParameter(str(e))
+        if merge or incremental or summary:
+            raise click.UsageError("pagination can't be combined with --merge, --incremental or --summary")
+    if jobs > 1 and (merge or fmt != "text" or incremental or summary or cache or
+                     page is not None or not query.is_empty()):
+        raise click.UsageError("--jobs can't be combined with --merge, --format, --incremental,"
+                               " --summary, --cache, filters or pagination")
+    if merge:
+        if fmt != "text" or incremental or summary or not query.is_empty():
+            raise click.UsageError("--merge can't be combined with --format, --incremental, --summary or filters")
+        print_merged_report(open_databases(config), options)
+        return
+    if summary and fmt != "text":
+        raise click.UsageError("--summary can't be combined with --format")
+    exporter = None
+    if fmt != "text":
+        if not output:
+            raise click.UsageError("--output is required for --format %s" % fmt)
+        exporter = open_exporter(fmt, output)
+
+    # Watermarks are only saved once every database was reported.
+    watermarks = []
+    caches = []
+    try:
+        for filename in config:
+            cc = open_database(filename, options)
+            if cc is None:
+                continue
+            report_cache = None
+            if cache and fmt == "text" and not summary:
+                report_cache = ReportCache.for_database(options.database, cache_size * 1024 * 1024)
+            if report_cache is not None:
+                caches.append(report_cache)
+            crashes = cc
+            if incremental:
+                watermark = Watermark.for_config(filename, options.database, query)
+                watermarks.append(watermark)
+                if isinstance(cc, CrashContainer):
+                    # DBM files can't be read from a timestamp onwards, so keep an
+                    # index for them, only loading the crashes not indexed yet.
+                    crash_index = CrashIndex.for_database(options.database)
+                    crash_index.update(cc)
+                else:
+                    crash_index = open_crash_index(options.database, cc)
+                    if crash_index is not None and len(crash_index) != len(cc):
+                        crash_index = None
+                crashes = iter_new_crashes(cc, watermark, query, crash_index)
+            elif summary:
+                crash_index = open_crash_index(options.database, cc)
+                if crash_index is not None:
+                    print_crash_summary(CrashSummary.from_index(crash_index, query), top)
+                    continue
+                if not query.is_empty():
+                    crashes = (c for c in cc if query.matches(c))
+            elif page is not None:
+                crash_index = open_crash_index(options.database, cc)
+                if crash_index is not None and len(crash_index) != len(cc):
+                    crash_index = None
+                crashes, next_cursor = get_page(cc, page, crash_index, query)
+            elif not query.is_empty():
+                crashes = iter_query_crashes(cc, query, open_crash_index(options.database, cc))
+            if summary:
+                print_crash_summary(CrashSummary.from_crashes(crashes), top)
+            elif exporter is not None:
+                print("Exported %d crashes." % export_crashes(crashes, exporter))
+            elif incremental:
+                print("Found %d new crashes." % print_crashes(crashes, options, report_cache))
+            elif page is not None:
+                print_crashes(crashes, options, report_cache)
+                if next_cursor:
+                    print("Next page: --cursor %s" % next_cursor)
+            elif crashes is not cc:
+                print("Found %d matching crashes." % print_crashes(crashes, options, report_cache))
+            else:
+                crash_index = None
+                if report_cache is not None:
+                    crash_index = open_crash_index(options.database, cc)
+                    if crash_index is not None and len(crash_index) != len(cc):
+                        crash_index = None
+                print_report_for_database(cc, options, report_cache, crash_index)
+    finally:
+        if exporter is not None:
+            exporter.close()
+        for report_cache in caches:
+            report_cache.close()
+    for watermark in watermarks:
+        watermark.save()
+
+
+@cli.command()
+@click.argument('config', nargs=-1, type=click.Path(exists=True))
+def index(config):
+    """
+    Rebuild the crash index of a crash DB
+    """
+    options = Options()
     for filename in config:
-        cc = open_database(filename)
-        print_report_for_database(cc, options)
+        cc = open_database(filename, options)
+        if cc is None:
+            continue
+        if isinstance(cc, CrashStore):
+            print("Native SQLite crash stores index themselves, ignored")
+            continue
+        crash_index = CrashIndex.for_database(options.database)
+        if crash_index is None:
+            print("Warning: only DBM, crash log and SQLite databases can be indexed, ignored")
+            continue
+        try:
+            print("Indexed %d crashes." % crash_index.rebuild(cc))
+        finally:
+            crash_index.close()
+
+
+@cli.command()
+@click.option('--max-age', help='Remove crashes older than this (30d, 12h...)')
+@click.option('--max-count', type=int, help='Keep at most this many crashes')
+@click.option('--max-mb', type=int, help='Keep at most this many megabytes of crashes')
+@click.option('--keep-per-signature', type=int, help='Keep at most this many crashes per signature')
+@click.option('-n', '--dry-run', is_flag=True, help='Only count the crashes that would be removed')
+@click.argument('config', nargs=-1, type=click.Path(exists=True))
+def compact(max_age, max_count, max_mb, keep_per_signature, dry_run, config):
+    """
+    Prune old crashes and reclaim space in a crash DB
+
+    The retention policy in each config file is used, unless overridden.
+    The crash monitor must not be running on the database.
+    """
+    for filename in config:
+        print("Opening configuration file: %s" % filename)
+        options = Options().read_config_file(filename)
+        url = options.database
+        if not url:
+            print("Warning: no database configured here, ignored")
+            continue
+        policy = RetentionPolicy.from_options(options)
+        if max_age:
+            policy.max_age = parse_duration(max_age)
+        if max_count:
+            policy.max_count = max_count
+        if max_mb:
+            policy.max_bytes = max_mb * 1024 * 1024
+        if keep_per_signature:
+            policy.keep_per_signature = keep_per_signature
+        setup_compression(options)
+        cc = open_crash_container(url)
+        if not policy.is_empty():
+            crash_index = None
+            if not isinstance(cc, CrashStore):
+                crash_index = open_crash_index(url)
+            chunks = None
+            chunks_filename = sidecar_filename(url, '.chunks')
+            if chunks_filename and os.path.exists(chunks_filename):
+                chunks = ChunkStore(chunks_filename)
+            try:
+                count, gone = prune_crashes(cc, policy, crash_index, chunks, dry_run=dry_run)
+            finally:
+                if crash_index is not None:
+                    crash_index.close()
+                if chunks is not None:
+                    chunks.close()
+            if dry_run:
+                print("Would remove %d crashes." % count)
+                continue
+            print("Removed %d crashes." % count)
+        elif dry_run:
+            continue
+        # Close the database before rewriting it.
+        if hasattr(cc, 'close'):
+            cc.close()
+        del cc
+        sizes = compact_database(url)
+        if sizes is None:
+            print("Warning: only DBM, crash log and SQLite databases can be compacted")
+        else:
+            print("Compacted from %d to %d bytes." % sizes)
+
+
+@cli.command()
+@click.option('-b', '--batch-size', default=MIGRATE_BATCH_SIZE, show_default=True, type=click.IntRange(1),
+              help='Number of crashes written in each transaction')
+@click.option('-j', '--jobs', default=1, type=click.IntRange(1), help='Number of worker processes decoding crashes (crash logs and stores only)')
+@click.option('--compression', default='keep', show_default=True,
+              help='Compress the migrated crashes with this codec, "none" or "keep"')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an interrupted migration')
+@click.argument('config', type=click.Path(exists=True))
+@click.argument('url')
+def migrate(batch_size, jobs, compression, restart, config, url):
+    """
+    Copy the crashes of a crash DB into another database
+
+    Crashes are streamed in batches, and interrupted migrations are resumed
+    from the last batch written. The source database must not change until
+    the migration is complete.
+    """
+    print("Opening configuration file: %s" % config)
+    options = Options().read_config_file(config)
+    source = options.database
+    if not source:
+        raise click.UsageError("no database configured in %s" % config)
+    if source == url:
+        raise click.UsageError("the source and destination databases are the same")
+    try:
+        crash_class = setup_migration_compression(options, url, compression)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--compression')
+    checkpoint = MigrationCheckpoint.for_config(config, source, url)
+    if restart:
+        checkpoint.position = 0
+        checkpoint.after = None
+    chunks = sidecar_filename(source, '.chunks')
+    if not chunks or not os.path.exists(chunks):
+        chunks = None
+    src = open_crash_container(source, readOnly=True)
+    # DBM files only skip their own compression if every crash compresses itself.
+    dst = open_crash_container(url, binary=crash_class is CompressedCrash)
+    total = len(src)
+    if checkpoint.position:
+        print("Resuming after %d of %d crashes." % (checkpoint.position, total))
+    started = time.time()
+    progress = [started]
+
+    def on_batch(position, after):
+        checkpoint.position = position
+        checkpoint.after = after
+        checkpoint.save()
+        now = time.time()
+        if now - progress[0] >= 5:
+            progress[0] = now
+            print("Migrated %d of %d crashes (%d crashes/s)" %
+                  (position, total, (position - start) / (now - started)))
+
+    start = checkpoint.position
+    try:
+        count = migrate_crashes(src, dst, start, batch_size, jobs, crash_class,
+                                dictionary_filename(options), chunks, on_batch,
+                                checkpoint.after)
+    finally:
+        for cc in (src, dst):
+            if hasattr(cc, 'close'):
+                cc.close()
+        del src, dst, cc
+    elapsed = max(time.time() - started, 0.001)
+    checkpoint.remove()
+    print("Migrated %d crashes in %.1f seconds (%d crashes/s)." %
+          (count - start, elapsed, (count - start) / elapsed))
+
+
+@cli.command('train-dict')
+@click.option('-n', '--samples', default=1000, show_default=True, help='Number of crashes to train with')
+@click.option('--size', default=DEFAULT_DICTIONARY_SIZE // 1024, show_default=True,
+              help='Dictionary size in KB')
+@click.option('--force', is_flag=True, help='Overwrite an existing dictionary')
+@click.argument('config', type=click.Path(exists=True))
+def train_dict(samples, size, force, config):
+    """
+    Train a zstd compression dictionary from a crash DB
+    """
+    options = Options()
+    cc = open_database(config, options)
+    if cc is None:
+        return
+    filename = options.compression_dict
+    if not filename:
+        raise click.UsageError("set 'compression_dict' in the config file for this database")
+    if os.path.exists(filename) and not force:
+        raise click.UsageError("%s already exists, crashes compressed with it "
+                               "can't be read without it (use --force)" % filename)
+    try:
+        count = train_dictionary(islice(cc, samples), filename, size * 1024)
+    except (RuntimeError, ValueError) as e:
+        raise click.ClickException(str(e))
+    print("Trained %s from %d crashes." % (filename, count))
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     cli()
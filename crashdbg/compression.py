@@ -0,0 +1,207 @@
+"""
+Compressed crash storage.
+
+L{CompressedCrash} is a crash collector class that compresses its own
+pickled state, so it works the same way with any crash container. Crashes
+stored by older versions, or without compression, are plain L{Crash} objects
+and are still read as usual.
+
+Codecs are pluggable, see L{register_codec}. The zstd codec (only available
+when the C{zstandard} module is installed) can also use a shared dictionary
+trained from existing crashes, which helps a lot with many small crashes.
+"""
+import bz2
+import hashlib
+import os
+import zlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from winappdbg import Crash
+
+from .database import sidecar_filename
+
+__all__ = [
+    'CompressedCrash',
+    'register_codec',
+    'get_codec',
+    'load_dictionary',
+    'train_dictionary',
+    'dictionary_filename',
+    'setup_compression',
+]
+
+# Default size of trained dictionaries, in bytes.
+DEFAULT_DICTIONARY_SIZE = 112640
+
+
+class Codec(object):
+    """
+    Compression codec.
+
+    @type supportsDictionary: bool
+    @ivar supportsDictionary: C{True} if the codec can use a shared dictionary.
+        Then C{compress} and C{decompress} take the dictionary as an optional
+        second argument.
+    """
+
+    def __init__(self, name, compress, decompress, supportsDictionary=False):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+        self.supportsDictionary = supportsDictionary
+
+
+# Map of codec names to L{Codec} objects.
+_codecs = dict()
+
+# Map of dictionary digests to dictionary data.
+_dictionaries = dict()
+
+
+def register_codec(name, compress, decompress, supportsDictionary=False):
+    """
+    Register a compression codec.
+
+    The codec name is stored with every compressed crash, so it must never
+    change once crashes were stored with it.
+    """
+    _codecs[name] = Codec(name, compress, decompress, supportsDictionary)
+
+
+def get_codec(name):
+    """
+    Get a registered compression codec by name.
+    """
+    try:
+        return _codecs[name]
+    except KeyError:
+        raise ValueError("unknown compression codec: %s" % name)
+
+
+register_codec('zlib', zlib.compress, zlib.decompress)
+register_codec('bz2', bz2.compress, bz2.decompress)
+
+if zstandard is not None:
+
+    def _zstd_compress(data, dictionary=None):
+        if dictionary is not None:
+            dictionary = zstandard.ZstdCompressionDict(dictionary)
+        return zstandard.ZstdCompressor(dict_data=dictionary).compress(data)
+
+    def _zstd_decompress(data, dictionary=None):
+        if dictionary is not None:
+            dictionary = zstandard.ZstdCompressionDict(dictionary)
+        return zstandard.ZstdDecompressor(dict_data=dictionary).decompress(data)
+
+    register_codec('zstd', _zstd_compress, _zstd_decompress, True)
+
+
+def load_dictionary(filename):
+    """
+    Load a shared compression dictionary from a file.
+
+    @rtype:  str
+    @return: Dictionary digest, as stored in the crashes compressed with it.
+    """
+    with open(filename, 'rb') as fd:
+        data = fd.read()
+    digest = hashlib.sha1(data).hexdigest()[:16]
+    _dictionaries[digest] = data
+    return digest
+
+
+def train_dictionary(crashes, filename, size=DEFAULT_DICTIONARY_SIZE):
+    """
+    Train a zstd dictionary from a sample of crashes and save it to a file.
+
+    @rtype:  int
+    @return: Number of crashes used to train the dictionary.
+    """
+    if zstandard is None:
+        raise RuntimeError("training dictionaries requires the zstandard module")
+    samples = []
+    for c in crashes:
+        if isinstance(c, CompressedCrash):
+            samples.append(pickle.dumps(c.__dict__, pickle.HIGHEST_PROTOCOL))
+        else:
+            samples.append(pickle.dumps(c, pickle.HIGHEST_PROTOCOL))
+    if not samples:
+        raise ValueError("no crashes to train the dictionary with")
+    data = zstandard.train_dictionary(size, samples).as_bytes()
+    with open(filename, 'wb') as fd:
+        fd.write(data)
+    return len(samples)
+
+
+def dictionary_filename(options):
+    """
+    Get the filename of the shared compression dictionary for a database.
+    Defaults to a file next to the database file.
+    """
+    if options.compression_dict:
+        return options.compression_dict
+    return sidecar_filename(options.database, '.zdict')
+
+
+def setup_compression(options, compress=False):
+    """
+    Load the shared compression dictionary for a database, if there is one.
+
+    When C{compress} is C{True}, also make L{CompressedCrash} compress with
+    the configured codec and dictionary.
+    """
+    digest = None
+    filename = dictionary_filename(options)
+    if filename and os.path.exists(filename):
+        digest = load_dictionary(filename)
+    if compress:
+        codec = get_codec(options.compression)
+        CompressedCrash.codec = codec.name
+        CompressedCrash.dictionary = digest if codec.supportsDictionary else None
+
+
+class CompressedCrash(Crash):
+    """
+    Crash that compresses its state when pickled.
+
+    @type codec: str
+    @cvar codec: Name of the codec used to compress new crashes.
+
+    @type dictionary: str
+    @cvar dictionary: Digest of the shared dictionary used to compress new
+        crashes, or C{None}. It must have been loaded with L{load_dictionary}.
+    """
+
+    codec = 'zlib'
+    dictionary = None
+
+    def __getstate__(self):
+        codec = get_codec(self.codec)
+        data = pickle.dumps(self.__dict__, pickle.HIGHEST_PROTOCOL)
+        if self.dictionary is not None:
+            data = codec.compress(data, _dictionaries[self.dictionary])
+        else:
+            data = codec.compress(data)
+        return {'codec': codec.name, 'dictionary': self.dictionary, 'data': data}
+
+    def __setstate__(self, state):
+        codec = get_codec(state['codec'])
+        digest = state['dictionary']
+        if digest is not None:
+            try:
+                dictionary = _dictionaries[digest]
+            except KeyError:
+                raise ValueError("missing compression dictionary %s" % digest)
+            data = codec.decompress(state['data'], dictionary)
+        else:
+            data = codec.decompress(state['data'])
+        self.__dict__.update(pickle.loads(data))
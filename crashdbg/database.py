@@ -0,0 +1,277 @@
+import hashlib
+import numbers
+import threading
+import zlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from winappdbg import CrashContainer, CrashDictionary
+
+__all__ = [
+    'BinaryCrashContainer',
+    'CrashBatcher',
+    'DbmCrashContainer',
+    'add_crashes',
+    'database_filename',
+    'key_encoding',
+    'open_crash_container',
+    'sidecar_filename',
+    'key_digest',
+]
+
+
+class DbmCrashContainer(CrashContainer):
+    """
+    DBM crash container that reads the values of L{BinaryCrashContainer} as
+    well as the zlib compressed ones of L{CrashContainer}. New values are
+    compressed with zlib, like L{CrashContainer} does.
+    """
+
+    def unmarshall_value(self, value):
+        value = bytes(value)
+        # A zlib stream begins with "x", which is not a pickle opcode.
+        if value[:1] == b'x':
+            value = zlib.decompress(value)
+        return pickle.loads(value)
+
+    def raw_value(self, key):
+        """
+        Get the value of a crash as stored in the DBM file.
+
+        @raise KeyError: No crash with that key is in the container.
+        """
+        return self._CrashContainer__db[self.marshall_key(key)]
+
+    def add_raw_value(self, key, value):
+        """
+        Store a value read with L{raw_value} from another DBM file.
+        """
+        self._CrashContainer__db[self.marshall_key(key)] = value
+
+
+class BinaryCrashContainer(DbmCrashContainer):
+    """
+    DBM crash container for crashes that compress themselves (see
+    L{CompressedCrash}). They're pickled with the binary protocol and not
+    compressed again with zlib.
+
+    Files written by this container can only be read by a
+    L{DbmCrashContainer}, not by a plain L{CrashContainer}.
+    """
+    optimizeValues = True
+    compressValues = False
+
+
+def open_crash_container(url, duplicates=None, binary=False, readOnly=False):
+    """
+    Open the crash container for a database URL.
+
+    URLs beginning with C{dbm://} are DBM files, C{log://} are append-only
+    crash logs (see L{CrashLog}) and C{store://} are native SQLite crash
+    stores (see L{CrashStore}). Anything else is passed on to SQLAlchemy,
+    except for C{sqlite:///} files that already are crash stores. If
+    C{duplicates} is C{None} the backend default is used.
+
+    If C{binary} is C{True}, new crashes in DBM files are pickled with the
+    binary protocol and not compressed with zlib, for crashes compressed by
+    themselves (see L{BinaryCrashContainer}). Crash logs opened with
+    C{readOnly} can be read while another process writes to them.
+    """
+    kwargs = dict()
+    if duplicates is not None:
+        kwargs['allowRepeatedKeys'] = duplicates
+    if url.startswith('dbm://'):
+        if binary:
+            return BinaryCrashContainer(url[6:], **kwargs)
+        return DbmCrashContainer(url[6:], **kwargs)
+    if url.startswith('log://'):
+        from .logstore import CrashLog
+        return CrashLog(url[6:], readOnly=readOnly, **kwargs)
+    if url.startswith('store://'):
+        from .sqlstore import CrashStore
+        return CrashStore(url[8:], **kwargs)
+    if url.startswith('sqlite:///') and len(url) > 10:
+        from .sqlstore import CrashStore, is_crash_store
+        if is_crash_store(url[10:]):
+            return CrashStore(url[10:], **kwargs)
+    return CrashDictionary(url, **kwargs)
+
+
+def database_filename(url):
+    """
+    Get the name of the file (or directory) of a database.
+
+    Only DBM, crash log, crash store and SQLite databases have a database
+    file. For any other kind of database this returns C{None}.
+    """
+    if url:
+        for prefix in ('dbm://', 'log://', 'store://', 'sqlite:///'):
+            if url.startswith(prefix) and len(url) > len(prefix):
+                return url[len(prefix):]
+    return None
+
+
+def sidecar_filename(url, suffix):
+    """
+    Get the name of a file kept next to the database file, like its index.
+
+    For databases without a database file this returns C{None}.
+    """
+    filename = database_filename(url)
+    if filename:
+        return filename + suffix
+    return None
+
+
+def key_encoding(key):
+    """
+    Canonical encoding of a crash key (signature), as a byte string.
+
+    Equal keys always get the same encoding, whether they come from a live
+    crash or were loaded back from a database. Pickles can't be used for
+    this, since they encode equal keys differently depending on how their
+    strings and tuples are shared.
+    """
+    parts = []
+    _encode_key(key, parts)
+    return u''.join(parts).encode('utf-8')
+
+
+def key_digest(key):
+    """
+    Short, stable hexadecimal digest of a crash key (signature),
+    computed from its canonical encoding (see L{key_encoding}).
+    """
+    return hashlib.sha1(key_encoding(key)).hexdigest()[:16]
+
+
+def _encode_key(value, parts):
+    if isinstance(value, (tuple, list)):
+        parts.append(u'(')
+        for item in value:
+            _encode_key(item, parts)
+        parts.append(u')')
+    elif value is None or isinstance(value, bool):
+        parts.append(u'%r;' % (value,))
+    elif isinstance(value, numbers.Integral):
+        parts.append(u'i%d;' % value)
+    elif isinstance(value, float):
+        parts.append(u'f%r;' % value)
+    else:
+        if isinstance(value, bytes):
+            value = value.decode('latin-1')
+        elif not isinstance(value, type(u'')):
+            value = repr(value)
+        parts.append(u's%d:%s' % (len(value), value))
+
+
+def _add_crashes(dao, crashes, allow_duplicates):
+    for crash in crashes:
+        dao.add(crash, allow_duplicates)
+
+
+def add_crashes(container, crashes):
+    """
+    Add several crashes to a container, in a single transaction if the
+    container supports it.
+    """
+    if not crashes:
+        return
+    add_many = getattr(container, 'add_many', None)
+    if add_many is not None:
+        add_many(crashes)
+        return
+    dao = getattr(container, '_dao', None)
+    if dao is not None:
+        allow_duplicates = getattr(container, '_allowRepeatedKeys', True)
+        try:
+            dao._transactional(_add_crashes, crashes, allow_duplicates)
+            return
+        except Exception:
+            # The transaction was rolled back,
+            # try again one crash at a time.
+            pass
+    for crash in crashes:
+        container.add(crash)
+
+
+class CrashBatcher(object):
+    """
+    Groups the crashes added to a container into batches.
+
+    For SQL databases each batch is written in a single transaction, instead
+    of one transaction per crash. A batch is written when it's full, or when
+    its oldest crash has waited for C{flush_ms} milliseconds.
+
+    The batcher can be used in place of the container: C{add}, C{in} and
+    C{len} take into account the crashes waiting in the current batch.
+    Remember to call L{close} before exiting, or the last batch is lost.
+
+    The batcher holds its lock while writing into the container. A lock can
+    be given to share it with other code using the same container.
+    """
+
+    def __init__(self, container, batch_size=100, flush_ms=1000, lock=None):
+        self.container = container
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.batch = []
+        self.keys = dict()      # key -> number of crashes in the batch
+        self.lock = lock or threading.RLock()
+        self.timer = None
+
+    def __contains__(self, crash):
+        with self.lock:
+            if crash.key() in self.keys:
+                return True
+            return crash in self.container
+
+    def __len__(self):
+        with self.lock:
+            return len(self.container) + len(self.batch)
+
+    def __iter__(self):
+        self.flush()
+        return iter(self.container)
+
+    def add(self, crash):
+        """
+        Add a crash to the current batch.
+        """
+        with self.lock:
+            self.batch.append(crash)
+            key = crash.key()
+            self.keys[key] = self.keys.get(key, 0) + 1
+            if len(self.batch) >= self.batch_size:
+                self._flush()
+            elif self.timer is None and self.flush_ms > 0:
+                self.timer = threading.Timer(self.flush_ms / 1000.0, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """
+        Write the current batch into the container.
+        """
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        """
+        Write the last batch. The container itself is not closed.
+        """
+        self.flush()
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch = self.batch
+        if not batch:
+            return
+        self.batch = []
+        self.keys = dict()
+        add_crashes(self.container, batch)
@@ -0,0 +1,185 @@
+"""
+Machine readable crash exports.
+
+Crashes are streamed from the container one at a time and written with a
+buffered writer, so exporting doesn't depend on the size of the database.
+"""
+import csv
+import json
+import os
+import sqlite3
+import sys
+
+__all__ = [
+    'EXPORT_FIELDS',
+    'EXPORT_FORMATS',
+    'crash_to_record',
+    'open_exporter',
+    'export_crashes',
+]
+
+PY2 = sys.version_info[0] < 3
+
+# Size of the output buffer for the file exporters.
+EXPORT_BUFFER_SIZE = 1024 * 1024
+
+# Number of rows inserted at once by the SQLite exporter.
+SQLITE_BATCH_SIZE = 1000
+
+# Exported crash fields, in column order.
+EXPORT_FIELDS = (
+    'timestamp',
+    'event_code',
+    'event_name',
+    'exception_code',
+    'exception_name',
+    'pc',
+    'sp',
+    'fp',
+    'label_pc',
+    'notes',
+    'signature',
+)
+
+
+def _text(value):
+    """
+    Convert byte strings to unicode, leave everything else alone.
+    """
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def crash_to_record(c):
+    """
+    Extract the exported fields from a crash.
+
+    @rtype:  dict
+    @return: Dictionary mapping each of L{EXPORT_FIELDS} to its value.
+    """
+    return {
+        'timestamp': c.timeStamp,
+        'event_code': c.eventCode,
+        'event_name': _text(c.eventName),
+        'exception_code': c.exceptionCode,
+        'exception_name': _text(c.exceptionName),
+        'pc': c.pc,
+        'sp': c.sp,
+        'fp': c.fp,
+        'label_pc': _text(c.labelPC),
+        'notes': u'\n'.join([_text(note) for note in c.notes]),
+        'signature': _text(repr(c.signature)),
+    }
+
+
+def _open_output(filename):
+    """
+    Open a buffered text file for writing.
+    """
+    if PY2:
+        return open(filename, 'wb', EXPORT_BUFFER_SIZE)
+    return open(filename, 'w', EXPORT_BUFFER_SIZE, encoding='utf-8', newline='')
+
+
+class JsonLinesExporter(object):
+    """
+    Writes one JSON object per line.
+    """
+
+    def __init__(self, filename):
+        self.fd = _open_output(filename)
+
+    def write(self, record):
+        self.fd.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def close(self):
+        self.fd.close()
+
+
+class CsvExporter(object):
+    """
+    Writes a CSV file with a header row.
+    """
+
+    def __init__(self, filename):
+        self.fd = _open_output(filename)
+        self.writer = csv.writer(self.fd)
+        self.writer.writerow(EXPORT_FIELDS)
+
+    def write(self, record):
+        row = [record[field] for field in EXPORT_FIELDS]
+        if PY2:
+            row = [value.encode('utf-8') if isinstance(value, unicode) else value
+                   for value in row]
+        self.writer.writerow(row)
+
+    def close(self):
+        self.fd.close()
+
+
+class SqliteExporter(object):
+    """
+    Writes a SQLite database with a single "crashes" table, replacing the
+    file if it already exists, like the other exporters do.
+    Rows are inserted in batches inside a single transaction.
+    """
+
+    def __init__(self, filename):
+        for name in (filename, filename + '-journal'):
+            if os.path.exists(name):
+                os.remove(name)
+        self.db = sqlite3.connect(filename)
+        self.db.execute("CREATE TABLE crashes (%s)" % ", ".join(EXPORT_FIELDS))
+        self.sql = "INSERT INTO crashes VALUES (%s)" % ", ".join(["?"] * len(EXPORT_FIELDS))
+        self.rows = []
+
+    def write(self, record):
+        self.rows.append(tuple([record[field] for field in EXPORT_FIELDS]))
+        if len(self.rows) >= SQLITE_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.db.executemany(self.sql, self.rows)
+            self.rows = []
+
+    def close(self):
+        try:
+            self.flush()
+            self.db.commit()
+        finally:
+            self.db.close()
+
+
+# Map of export format names to exporter classes.
+EXPORT_FORMATS = {
+    'jsonl': JsonLinesExporter,
+    'csv': CsvExporter,
+    'sqlite': SqliteExporter,
+}
+
+
+def open_exporter(fmt, filename):
+    """
+    Create the exporter for the given format.
+    """
+    try:
+        cls = EXPORT_FORMATS[fmt]
+    except KeyError:
+        raise ValueError("unknown export format: %s" % fmt)
+    return cls(filename)
+
+
+def export_crashes(cc, exporter):
+    """
+    Export every crash in the container, in container order.
+
+    @rtype:  int
+    @return: Number of exported crashes.
+    """
+    count = 0
+    for c in cc:
+        exporter.write(crash_to_record(c))
+        count += 1
+    return count
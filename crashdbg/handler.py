@@ -1,12 +1,77 @@
+import threading
+import time
+
 from winappdbg import EventHandler, Crash, Logger, DummyCrashContainer, \
-    CrashDictionary, CrashContainer, win32, System, \
-    HexDump, Module
+    win32, HexDump, Module
 from winappdbg.win32 import SLE_ERROR, SLE_MINORERROR, SLE_WARNING
 
+from .actions import ACTION_VARIABLES, ActionExecutor, ActionVariables, replace_variables, \
+    run_action_command
+from .chunks import ChunkStore, MemoryDeduplicator
+from .compression import CompressedCrash, setup_compression
+from .database import open_crash_container, CrashBatcher
+from .index import CrashIndex
+from .labels import LabelCache, label_module, module_name
+from .plugins import load_action_plugins
+from .retention import RetentionPolicy, RetentionThread
+from .signatures import SignatureSet
+from .sqlstore import CrashStore
+from .storm import StormLimiter, StormThread
+from .writer import CrashWriter
+
 __all__ = [
     'CrashEventHandler',
+    'EventFilter',
 ]
 
+# Handler methods of the debug events that are never exceptions.
+DEBUG_EVENT_METHODS = ('create_process', 'create_thread', 'exit_process', 'exit_thread',
+                       'load_dll', 'unload_dll', 'output_string', 'rip')
+
+
+class EventFilter(object):
+    """
+    Decides if debug events match a list of events from the config file,
+    like C{crash_events} or C{action_events}.
+
+    The list may contain event handler method names, C{exception} for all
+    last chance exceptions (or all exceptions with C{firstchance}) and
+    C{event} for everything. The answer for every event that is never an
+    exception is computed beforehand, and so is the answer for each kind of
+    exception once seen, unless it depends on the exception being a last
+    chance one. Those events are a single dictionary lookup.
+
+    @type events: frozenset of str
+    @ivar events: Names in the event list.
+    """
+
+    def __init__(self, events, firstchance=False):
+        self.events = frozenset(events)
+        self.always = 'event' in self.events
+        self.exceptions = 'exception' in self.events
+        self.firstchance = firstchance
+        self.table = dict((method, self.always or method in self.events)
+                          for method in DEBUG_EVENT_METHODS)
+
+    def matches(self, event):
+        """
+        Determine if a debug event is in the event list.
+        """
+        method = event.eventMethod
+        matched = self.table.get(method)
+        if matched is not None:
+            return matched
+        if self.always or method in self.events or not self.exceptions:
+            matched = self.always or method in self.events
+        elif event.get_event_code() != win32.EXCEPTION_DEBUG_EVENT:
+            matched = False
+        elif not self.firstchance:
+            return event.is_last_chance()
+        else:
+            matched = True
+        self.table[method] = matched
+        return matched
+
 
 class CrashEventHandler(EventHandler):
     """
@@ -32,11 +97,60 @@ class CrashEventHandler(EventHandler):
         # Create the logger object.
         self.logger = Logger(options.logfile, options.verbose)
 
+        # Compress the crashes, unless disabled or using a custom collector.
+        if options.database and options.compression != 'none' \
+                and self.crashCollector is Crash:
+            setup_compression(options, compress=True)
+            self.crashCollector = CompressedCrash
+
+        # Create the lock held while using the crash container.
+        self.containerLock = threading.RLock()
+
         # Create the crash container.
         self.knownCrashes = self._new_crash_container()
 
+        # Create the secondary index of the crash container, if any.
+        self.crashIndex = self._new_crash_index()
+
+        # Create the background crash writer, if requested.
+        self.crashWriter = self._new_crash_writer()
+
+        # Load the known crash signatures into memory, if needed.
+        # This may take a while, so it's done before debugging starts.
+        self.knownSignatures = self._new_signature_set()
+
+        # Start pruning old crashes from the database, if requested.
+        self.retentionThread = self._new_retention_thread()
+
+        # Rate limit crash storms, if requested.
+        self.stormLimiter = self._new_storm_limiter()
+        self.stormThread = None
+        if self.stormLimiter is not None:
+            self.stormThread = StormThread(self.stormLimiter, self.logger)
+
+        # Compile the lists of crash and action events.
+        self.crashFilter = EventFilter(options.crash_events, options.firstchance)
+        self.actionFilter = None
+        if options.action:
+            self.actionFilter = EventFilter(options.action_events, options.firstchance)
+
+        # Load the Python plugins used as actions.
+        self.actionPlugins = load_action_plugins(options.action or ())
+
+        # Start running action commands in the background, if requested.
+        self.actionExecutor = self._new_action_executor()
+
+        # Bind the breakpoint labels to the modules they belong to.
+        self.moduleLabels = dict()  # module name -> list of (label, method name)
+        self.unboundLabels = list()  # labels without a module name
+        self._bind_labels()
+
         # Create the cache of resolved labels.
         self.labelsCache = dict()  # pid -> label -> address
+        self.moduleBreakpoints = dict()  # pid -> module base -> list of labels
+
+        # Load the labels resolved in previous runs, for each module.
+        self.labelCache = self._new_label_cache()
 
         # Create the map of target services and their process IDs.
         self.pidToServices = dict()  # pid -> set(service...)
@@ -52,17 +166,164 @@ class CrashEventHandler(EventHandler):
         if not url:
             return DummyCrashContainer(
                 allowRepeatedKeys=self.options.duplicates)
-        if url.startswith('dbm://'):
-            url = url[6:]
-            return CrashContainer(url,
-                                  allowRepeatedKeys=self.options.duplicates)
-        return CrashDictionary(url,
-                               allowRepeatedKeys=self.options.duplicates)
+        container = open_crash_container(url, self.options.duplicates,
+                                         self.options.compression != 'none')
+        if self.options.db_batch_size > 1:
+            container = CrashBatcher(container, self.options.db_batch_size,
+                                     self.options.db_flush_ms, self.containerLock)
+        if self.options.memory and self.options.memory_dedup:
+            container = MemoryDeduplicator(container, ChunkStore.for_database(url))
+        return container
+
+    def _iter_container_layers(self):
+        """
+        Iterate the wrappers around the crash container, outermost first.
+        """
+        container = self.knownCrashes
+        while isinstance(container, (MemoryDeduplicator, CrashBatcher)):
+            yield container
+            container = container.container
+
+    def _base_container(self):
+        """
+        Get the crash container without any of its wrappers.
+        """
+        container = self.knownCrashes
+        for layer in self._iter_container_layers():
+            container = layer.container
+        return container
+
+    def _new_crash_index(self):
+        if not self.options.database or not self.options.index:
+            return None
+        if isinstance(self._base_container(), CrashStore):
+            # The crash store is its own index.
+            return None
+        return CrashIndex.for_database(self.options.database)
+
+    def _new_signature_set(self):
+        if not self.options.database or self.options.duplicates or \
+                self.options.signature_cache == 'none':
+            return None
+        return SignatureSet(self._base_container(), self.options.signature_cache,
+                            self.containerLock)
+
+    def _new_crash_writer(self):
+        if not self.options.write_behind:
+            return None
+        return CrashWriter(self.knownCrashes, self.crashIndex, self.logger,
+                           self.options.write_queue, self.options.write_policy,
+                           lock=self.containerLock)
+
+    def _new_retention_thread(self):
+        if not self.options.database:
+            return None
+        policy = RetentionPolicy.from_options(self.options)
+        if policy.is_empty() or self.options.retention_interval <= 0:
+            return None
+        chunks = None
+        for layer in self._iter_container_layers():
+            if isinstance(layer, MemoryDeduplicator):
+                chunks = layer.chunks
+        onPrune = None
+        if self.knownSignatures is not None:
+            onPrune = self.knownSignatures.discard
+        return RetentionThread(self._base_container(), policy,
+                               self.options.retention_interval, self.crashIndex,
+                               chunks, self.containerLock, self.logger, onPrune)
+
+    def _new_action_executor(self):
+        if not self.options.action or self.options.action_mode != 'async':
+            return None
+        return ActionExecutor(self.options.action_workers, self.options.action_queue,
+                              self.options.action_timeout, self.options.action_ordered,
+                              self.logger)
+
+    def _new_storm_limiter(self):
+        if self.options.storm_rate <= 0:
+            return None
+        return StormLimiter(self.options.storm_rate, self.options.storm_burst,
+                            self.options.storm_sample, self.options.storm_interval)
+
+    def _new_label_cache(self):
+        if not self.options.break_at and not self.options.stalk_at:
+            return None
+        filename = self.options.label_cache
+        if filename == 'none':
+            return LabelCache()
+        return LabelCache.for_config(self.currentConfig, filename)
+
+    def close(self):
+        """
+        Store any crashes still queued or batched for writing,
+        and close the crash index.
+        """
+        if self.stormThread is not None:
+            self.stormThread.close()
+        if self.retentionThread is not None:
+            self.retentionThread.close()
+        if self.actionExecutor is not None:
+            self.actionExecutor.close()
+        if self.labelCache is not None:
+            self.labelCache.save()
+        try:
+            try:
+                if self.crashWriter is not None:
+                    self.crashWriter.close()
+            finally:
+                for container in self._iter_container_layers():
+                    container.close()
+        finally:
+            if self.crashIndex is not None:
+                self.crashIndex.close()
+
+    def _is_known_crash(self, crash):
+        """
+        Determine if the crash is already in the database.
+        """
+        if self.knownSignatures is not None:
+            known = self.knownSignatures.check(crash.key())
+            if known is not None:
+                return known
+        if self.crashWriter is not None:
+            return crash in self.crashWriter
+        with self.containerLock:
+            return crash in self.knownCrashes
+
+    def _store_crash(self, crash):
+        """
+        Store the crash in the database, or queue it if writing in background.
+        """
+        if self.knownSignatures is not None:
+            self.knownSignatures.add(crash.key())
+        if self.crashWriter is not None:
+            self.crashWriter.add(crash)
+            return
+        with self.containerLock:
+            self.knownCrashes.add(crash)
+            if self.crashIndex is not None:
+                self.crashIndex.add(crash)
+
+    def _count_crashes(self):
+        """
+        Number of crashes in the database, including those queued for writing.
+        """
+        if self.crashWriter is not None:
+            return len(self.crashWriter)
+        with self.containerLock:
+            return len(self.knownCrashes)
 
     def _add_crash(self, event, bFullReport=None, bLogEvent=True):
         """
         Add the crash to the database.
         """
+        # Drop the event if it's part of a crash storm.
+        # It's counted and reported later along with the rest.
+        if self.stormLimiter is not None:
+            if not self.stormLimiter.check(self._get_storm_signature(event),
+                                           lambda: self._describe_storm(event)):
+                return None, False
+
         # Unless forced either way, full reports are generated for exceptions.
         if bFullReport is None:
             bFullReport = event.get_event_code() == win32.EXCEPTION_DEBUG_EVENT
@@ -73,12 +334,12 @@ class CrashEventHandler(EventHandler):
 
         # Determine if the crash was previously known.
         # If we're allowing duplicates, treat all crashes as new.
-        bNew = self.options.duplicates or crash not in self.knownCrashes
+        bNew = self.options.duplicates or not self._is_known_crash(crash)
 
         # Add the crash object to the container.
         if bNew:
             crash.fetch_extra_data(event, self.options.memory)
-            self.knownCrashes.add(crash)
+            self._store_crash(crash)
 
         # Log the crash event.
         if bLogEvent and self.logger.is_enabled():
@@ -92,27 +353,35 @@ class CrashEventHandler(EventHandler):
         # The second element is True if the crash is new, False otherwise.
         return crash, bNew
 
+    @staticmethod
+    def _get_storm_signature(event):
+        """
+        Signature of an event for the crash storm limiter.
+        Unlike crash signatures it doesn't need building the crash.
+        """
+        eventCode = event.get_event_code()
+        if eventCode == win32.EXCEPTION_DEBUG_EVENT:
+            return eventCode, event.get_exception_code(), event.get_exception_address()
+        return eventCode, event.eventMethod
+
+    @staticmethod
+    def _describe_storm(event):
+        if event.get_event_code() == win32.EXCEPTION_DEBUG_EVENT:
+            return "%s at %s" % (event.get_exception_name(),
+                                 HexDump.address(event.get_exception_address()))
+        return event.get_event_name()
+
     def _is_action_event(self, event):
         """
         Determine if this is an event we must take action on.
         """
-        return self.options.action and self._is_event_in_list(event, self.options.action_events)
+        return self.actionFilter is not None and self.actionFilter.matches(event)
 
     def _is_crash_event(self, event):
         """
         Determine if this is a crash event.
         """
-        return self._is_event_in_list(event, self.options.crash_events)
-
-    def _is_event_in_list(self, event, event_list):
-        """
-        Common implementation of _is_action_event() and _is_crash_event().
-        """
-        return \
-            ('event' in event_list) or ('exception' in event_list and
-                                        (event.get_event_code() == win32.EXCEPTION_DEBUG_EVENT and
-                                         (event.is_last_chance() or self.options.firstchance))) or \
-            (event.eventMethod in event_list)
+        return self.crashFilter.matches(event)
 
     def _action(self, event, crash=None):
         """
@@ -145,68 +414,108 @@ class CrashEventHandler(EventHandler):
 
     def _run_action_commands(self, event, crash=None):
         # Run the configured commands after finding a crash.
-        # Wait until each command completes before executing the next.
-        # To avoid waiting, use the "start" command.
+        # The variables are replaced right away, so commands
+        # run in the background still describe this crash.
+        commands = []
         for action in self.options.action:
+            plugin = self.actionPlugins.get(action)
+            if plugin is not None:
+                if not crash:
+                    crash = self.crashCollector(event)
+                commands.append(plugin.bind(crash, self._get_lazy_action_variables(crash)))
+                continue
             if '%' in action:
                 if not crash:
                     crash = self.crashCollector(event)
                 action = self._replace_action_variables(action, crash)
-            action = "cmd.exe /c " + action
-            system = System()
-            process = system.start_process(action, bConsole=True)
-            process.wait()
+            commands.append(action)
+        if self.actionExecutor is not None:
+            self.actionExecutor.submit(commands)
+            return
+
+        # Wait until each command completes before executing the next.
+        # To avoid waiting, use the "start" command.
+        for command in commands:
+            if callable(command):
+                try:
+                    command()
+                except Exception:
+                    self.logger.log_exc()
+                continue
+            if not run_action_command(command, self.options.action_timeout):
+                self.logger.log_text("Warning: action command timed out: %s" % command)
 
     def _replace_action_variables(self, action, crash):
         """
         Make the variable replacements in an action command line string.
         """
+        names = [name for name in ACTION_VARIABLES if '%' + name + '%' in action]
+        return replace_variables(action, self._get_action_variables(crash, names))
+
+    def _get_action_variables(self, crash, names=ACTION_VARIABLES):
+        """
+        Get the values of the action variables for a crash.
+
+        @type  names: list of str
+        @param names: Names of the variables, without the percent signs.
+
+        @rtype:  dict(str S{->} str)
+        @return: Map of variable names to their values.
+        """
+        return dict((name, self._get_action_variable(name, crash)) for name in names)
+
+    def _get_lazy_action_variables(self, crash):
+        """
+        Get the action variables for a crash, computed only when used.
+
+        @rtype:  L{ActionVariables}
+        @return: Map of variable names to their values.
+        """
+        return ActionVariables(lambda name: self._get_action_variable(name, crash))
+
+    def _get_action_variable(self, name, crash):
         # %COUNT% - Number of crashes currently stored in the database
-        if '%COUNT%' in action:
-            action = action.replace('%COUNT%', str(len(self.knownCrashes)))
+        if name == 'COUNT':
+            return str(self._count_crashes())
 
         # %EXCEPTIONCODE% - Exception code in hexa
-        if '%EXCEPTIONCODE%' in action:
-            exceptionCode = HexDump.address(crash.exceptionCode) if crash.exceptionCode else HexDump.address(0)
-            action = action.replace('%EXCEPTIONCODE%', exceptionCode)
+        if name == 'EXCEPTIONCODE':
+            return HexDump.address(crash.exceptionCode) if crash.exceptionCode else HexDump.address(0)
 
         # %EVENTCODE% - Event code in hexa
-        if '%EVENTCODE%' in action:
-            action = action.replace('%EVENTCODE%', HexDump.address(crash.eventCode))
+        if name == 'EVENTCODE':
+            return HexDump.address(crash.eventCode)
 
         # %EXCEPTION% - Exception name, human readable
-        if '%EXCEPTION%' in action:
-            exceptionName = crash.exceptionName if crash.exceptionName else 'Not an exception'
-            action = action.replace('%EXCEPTION%', exceptionName)
+        if name == 'EXCEPTION':
+            return crash.exceptionName if crash.exceptionName else 'Not an exception'
 
         # %EVENT% - Event name, human readable
-        if '%EVENT%' in action:
-            action = action.replace('%EVENT%', crash.eventName)
+        if name == 'EVENT':
+            return crash.eventName
 
         # %PC% - Contents of EIP, in hexa
-        if '%PC%' in action:
-            action = action.replace('%PC%', HexDump.address(crash.pc))
+        if name == 'PC':
+            return HexDump.address(crash.pc)
 
         # %SP% - Contents of ESP, in hexa
-        if '%SP%' in action:
-            action = action.replace('%SP%', HexDump.address(crash.sp))
+        if name == 'SP':
+            return HexDump.address(crash.sp)
 
         # %FP% - Contents of EBP, in hexa
-        if '%FP%' in action:
-            action = action.replace('%FP%', HexDump.address(crash.fp))
+        if name == 'FP':
+            return HexDump.address(crash.fp)
 
         # %WHERE% - Location of the event (a label or address)
-        if '%WHERE%' in action:
+        if name == 'WHERE':
             if crash.labelPC:
                 try:
-                    labelPC = str(crash.labelPC)
+                    return str(crash.labelPC)
                 except UnicodeError:
-                    labelPC = HexDump.address(crash.pc)
-            else:
-                labelPC = HexDump.address(crash.pc)
-            action = action.replace('%WHERE%', labelPC)
+                    pass
+            return HexDump.address(crash.pc)
 
-        return action
+        raise KeyError(name)
 
     def _get_location(self, event, address):
         """
@@ -226,45 +535,90 @@ class CrashEventHandler(EventHandler):
         msg = "%s (%s chance) at %s" % (what, chance, where)
         self.logger.log_event(event, msg)
 
+    def _bind_labels(self):
+        """
+        Group the break_at and stalk_at labels by the module they belong to.
+        """
+        for method, bplist in (('break_at', self.options.break_at),
+                               ('stalk_at', self.options.stalk_at)):
+            for label in bplist:
+                modName = label_module(label)
+                if modName is None:
+                    self.unboundLabels.append((label, method))
+                else:
+                    self.moduleLabels.setdefault(modName, []).append((label, method))
+
     def _set_breakpoints(self, event):
         """
         Set all breakpoints that can be set at each create process or load dll event.
+        Only the labels of the module being loaded are resolved, plus the
+        labels that don't belong to any module.
         """
-        method = event.debug.break_at
-        bplist = self.options.break_at
-        self._set_breakpoints_from_list(event, bplist, method)
-        method = event.debug.stalk_at
-        bplist = self.options.stalk_at
-        self._set_breakpoints_from_list(event, bplist, method)
+        aModule = event.get_module()
+        bplist = self.unboundLabels
+        fileName = aModule.get_filename()
+        if fileName and self.moduleLabels:
+            bplist = bplist + self.moduleLabels.get(module_name(fileName), [])
+        if bplist:
+            self._set_breakpoints_from_list(event, bplist)
 
-    def _set_breakpoints_from_list(self, event, bplist, method):
+    def _set_breakpoints_from_list(self, event, bplist):
         """
-        Set a list of breakppoints using the given method.
+        Set a list of breakppoints, given as tuples of label and the name of
+        the debug method used to set them. The labels not set yet in this
+        process are resolved all at once.
         """
         dwProcessId = event.get_pid()
         aModule = event.get_module()
-        for label in bplist:
-            if dwProcessId not in self.labelsCache:
-                self.labelsCache[dwProcessId] = dict()
-            # XXX FIXME
-            # We may have a problem here for some ambiguous labels...
-            if label not in self.labelsCache[dwProcessId]:
-                try:
-                    address = aModule.resolve_label(label)
-                except ValueError:
-                    address = None
-                except RuntimeError:
-                    address = None
-                except WindowsError:
-                    address = None
-                if address is not None:
-                    self.labelsCache[dwProcessId][label] = address
-                    try:
-                        method(dwProcessId, address)
-                    except RuntimeError:
-                        pass
-                    except WindowsError:
-                        pass
+        if dwProcessId not in self.labelsCache:
+            self.labelsCache[dwProcessId] = dict()
+            self.moduleBreakpoints[dwProcessId] = dict()
+        labels = self.labelsCache[dwProcessId]
+        # XXX FIXME
+        # We may have a problem here for some ambiguous labels...
+        pending = [(label, method) for (label, method) in bplist if label not in labels]
+        if not pending:
+            return
+
+        # Resolve the labels, and log how long it took.
+        stats = dict()
+        start = time.time()
+        addresses = self.labelCache.resolve_many(
+            aModule, [label for (label, method) in pending], stats)
+        if self.logger.is_enabled():
+            msg = "Resolved %d of %d labels in %s in %.3f seconds" \
+                  " (%d cached, %d exports, %d by the debugger)"
+            msg = msg % (len(addresses), len(pending), aModule.get_filename() or 'a module',
+                         time.time() - start, stats['cached'], stats['exports'],
+                         stats['resolved'])
+            self.logger.log_event(event, msg)
+
+        # Set the breakpoints.
+        breakpoints = self.moduleBreakpoints[dwProcessId].setdefault(aModule.get_base(), [])
+        for label, method in pending:
+            address = addresses.get(label)
+            if address is None or label in labels:
+                continue
+            labels[label] = address
+            breakpoints.append(label)
+            try:
+                getattr(event.debug, method)(dwProcessId, address)
+            except RuntimeError:
+                pass
+            except WindowsError:
+                pass
+
+    def _forget_breakpoints(self, event):
+        """
+        Forget the breakpoints of a module being unloaded, so they're set
+        again if it's loaded back, maybe at a different address.
+        """
+        dwProcessId = event.get_pid()
+        modules = self.moduleBreakpoints.get(dwProcessId)
+        if modules:
+            labels = self.labelsCache[dwProcessId]
+            for label in modules.pop(event.get_module().get_base(), ()):
+                labels.pop(label, None)
 
     def event(self, event):
         """
@@ -364,6 +718,11 @@ class CrashEventHandler(EventHandler):
                     dwProcessId = event.get_pid()
                     if dwProcessId in self.labelsCache:
                         del self.labelsCache[dwProcessId]
+                        del self.moduleBreakpoints[dwProcessId]
+
+                    # Keep the labels resolved so far in case we crash.
+                    if self.labelCache is not None:
+                        self.labelCache.save()
 
                 finally:
                     # Restart if requested.
@@ -412,11 +771,6 @@ class CrashEventHandler(EventHandler):
         """
         Handle the unload dll events.
         """
-        # XXX FIXME
-        # We should be updating the labels cache here,
-        # otherwise we might lose the breakpoints if
-        # the dll gets unloaded and then loaded again.
-
         try:
             # Log the event.
             if self.logger.is_enabled():
@@ -430,8 +784,12 @@ class CrashEventHandler(EventHandler):
                 self.logger.log_event(event, msg)
 
         finally:
-            # Process the event.
-            self._default_event_processing(event)
+            try:
+                # Process the event.
+                self._default_event_processing(event)
+            finally:
+                # Forget the breakpoints set in this module.
+                self._forget_breakpoints(event)
 
     def output_string(self, event):
         """
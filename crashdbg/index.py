@@ -0,0 +1,560 @@
+"""
+Secondary index of crash databases.
+
+The index is a small SQLite database kept next to the crash database, with
+one row per stored crash holding the searchable fields and the pickled crash
+key. Queries run against the index first, so crashes that don't match are
+never unpickled.
+"""
+import datetime
+import numbers
+import os
+import re
+import sqlite3
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from winappdbg import CrashContainer
+
+from .database import key_digest, sidecar_filename
+from .labels import module_name
+
+__all__ = [
+    'CrashIndex',
+    'CrashQuery',
+    'index_filename',
+    'open_crash_index',
+    'crash_module',
+    'parse_time',
+    'iter_query_crashes',
+    'load_indexed_crash',
+]
+
+# Relative times accepted by parse_time(), in seconds.
+TIME_UNITS = {
+    's': 1,
+    'm': 60,
+    'h': 60 * 60,
+    'd': 24 * 60 * 60,
+    'w': 7 * 24 * 60 * 60,
+}
+
+# Absolute times accepted by parse_time(), in local time.
+TIME_FORMATS = (
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d',
+)
+
+
+def index_filename(url):
+    """
+    Get the filename of the index for a database URL.
+
+    DBM, crash log and SQLite databases keep the index next to the database
+    file.
+    Other databases have no index.
+
+    @rtype:  str or None
+    @return: Index filename, or C{None} if the database can't be indexed.
+    """
+    return sidecar_filename(url, '.index')
+
+
+def crash_module(c):
+    """
+    Get the name of the module where the crash happened, from its label.
+
+    @rtype:  str or None
+    @return: Lowercase module name, or C{None} if unknown.
+    """
+    label = c.labelPC
+    if not label:
+        return None
+    module = re.split(r'[!+]', label, 1)[0]
+    return module.lower() or None
+
+
+def parse_time(value):
+    """
+    Parse a time given in the command line.
+
+    Accepts relative times back from now ("30m", "24h", "7d"), local dates
+    ("2018-01-31", "2018-01-31 12:00") and plain UNIX timestamps.
+
+    @rtype:  float
+    @return: UNIX timestamp.
+    """
+    value = value.strip()
+    match = re.match(r'^(\d+)([smhdw])$', value)
+    if match:
+        return time.time() - int(match.group(1)) * TIME_UNITS[match.group(2)]
+    for fmt in TIME_FORMATS:
+        try:
+            return time.mktime(time.strptime(value, fmt))
+        except ValueError:
+            pass
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError("invalid time: %s" % value)
+
+
+def _is_integer(value):
+    return isinstance(value, numbers.Integral)
+
+
+def _parse_integer(value):
+    """
+    Parse an integer in decimal or hexadecimal.
+    """
+    try:
+        return int(value, 0)
+    except ValueError:
+        return int(value, 16)
+
+
+class CrashQuery(object):
+    """
+    Filter for crash reports. Unset fields match everything.
+
+    @type since: float
+    @ivar since: Only crashes at or after this UNIX timestamp.
+
+    @type until: float
+    @ivar until: Only crashes at or before this UNIX timestamp.
+
+    @type exception_code: int or str
+    @ivar exception_code: Exception code, or exception name.
+
+    @type module: str
+    @ivar module: Module where the crash happened, with or without path and
+        extension.
+
+    @type pc: int or str
+    @ivar pc: Address or label of the crash.
+
+    @type event: int or str
+    @ivar event: Event code, or the beginning of the event name.
+    """
+
+    def __init__(self, since=None, until=None, exception_code=None,
+                 module=None, pc=None, event=None):
+        self.since = since
+        self.until = until
+        self.exception_code = exception_code
+        self.module = module
+        self.pc = pc
+        self.event = event
+
+    @classmethod
+    def from_strings(cls, since=None, until=None, exception_code=None,
+                     module=None, pc=None, event=None):
+        """
+        Build a query from command line arguments.
+        """
+        query = cls()
+        if since:
+            query.since = parse_time(since)
+        if until:
+            query.until = parse_time(until)
+        if exception_code:
+            try:
+                query.exception_code = _parse_integer(exception_code)
+            except ValueError:
+                query.exception_code = exception_code
+        if module:
+            query.module = module_name(module)
+        if pc:
+            try:
+                query.pc = _parse_integer(pc)
+            except ValueError:
+                query.pc = pc
+        if event:
+            try:
+                query.event = int(event, 0)
+            except ValueError:
+                query.event = event
+        return query
+
+    def is_empty(self):
+        """
+        Determine if the query matches everything.
+        """
+        return self.since is None and self.until is None and \
+            self.exception_code is None and self.module is None and \
+            self.pc is None and self.event is None
+
+    def where(self):
+        """
+        Build the SQL condition for the index table.
+
+        @rtype:  tuple(str, list)
+        @return: WHERE clause (without the keyword) and its parameters.
+        """
+        clauses = []
+        params = []
+        if self.since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(self.since)
+        if self.until is not None:
+            clauses.append("timestamp <= ?")
+            params.append(self.until)
+        if self.exception_code is not None:
+            if not _is_integer(self.exception_code):
+                clauses.append("exception_name = ? COLLATE NOCASE")
+            else:
+                clauses.append("exception_code = ?")
+            params.append(self.exception_code)
+        if self.module is not None:
+            module = module_name(self.module)
+            clauses.append("(module = ? OR module LIKE ?)")
+            params.extend([module, module + '.%'])
+        if self.pc is not None:
+            if not _is_integer(self.pc):
+                clauses.append("label_pc = ? COLLATE NOCASE")
+            else:
+                clauses.append("pc = ?")
+            params.append(self.pc)
+        if self.event is not None:
+            if not _is_integer(self.event):
+                clauses.append("event_name LIKE ?")
+                params.append(self.event + '%')
+            else:
+                clauses.append("event_code = ?")
+                params.append(self.event)
+        return " AND ".join(clauses) or "1", params
+
+    def matches(self, c):
+        """
+        Determine if a crash matches the query, without using an index.
+        """
+        if self.since is not None and c.timeStamp < self.since:
+            return False
+        if self.until is not None and c.timeStamp > self.until:
+            return False
+        if self.exception_code is not None:
+            if not _is_integer(self.exception_code):
+                if (c.exceptionName or '').lower() != self.exception_code.lower():
+                    return False
+            elif c.exceptionCode != self.exception_code:
+                return False
+        if self.module is not None:
+            wanted = module_name(self.module)
+            module = crash_module(c) or ''
+            if module != wanted and not module.startswith(wanted + '.'):
+                return False
+        if self.pc is not None:
+            if not _is_integer(self.pc):
+                if (c.labelPC or '').lower() != self.pc.lower():
+                    return False
+            elif c.pc != self.pc:
+                return False
+        if self.event is not None:
+            if not _is_integer(self.event):
+                if not (c.eventName or '').lower().startswith(self.event.lower()):
+                    return False
+            elif c.eventCode != self.event:
+                return False
+        return True
+
+
+class CrashIndex(object):
+    """
+    Secondary index of a crash database, stored in a SQLite file.
+
+    @type unique: bool
+    @ivar unique: C{True} if the indexed container keeps only one crash per
+        key (i.e. DBM databases), C{False} if keys may repeat.
+    """
+
+    # Schema of the index database.
+    schema = """
+        CREATE TABLE IF NOT EXISTS crashes (
+            id INTEGER PRIMARY KEY,
+            digest TEXT NOT NULL,
+            key BLOB NOT NULL,
+            timestamp REAL NOT NULL,
+            event_code INTEGER,
+            event_name TEXT,
+            exception_code INTEGER,
+            exception_name TEXT,
+            module TEXT,
+            pc INTEGER,
+            label_pc TEXT
+        );
+        CREATE INDEX IF NOT EXISTS crashes_timestamp ON crashes (timestamp, digest);
+        CREATE INDEX IF NOT EXISTS crashes_digest ON crashes (digest);
+        CREATE INDEX IF NOT EXISTS crashes_exception ON crashes (exception_code, timestamp);
+        CREATE INDEX IF NOT EXISTS crashes_module ON crashes (module, timestamp);
+        CREATE INDEX IF NOT EXISTS crashes_pc ON crashes (pc, timestamp);
+    """
+
+    # Columns filled in by L{_row}.
+    columns = ('digest', 'key', 'timestamp', 'event_code', 'event_name',
+               'exception_code', 'exception_name', 'module', 'pc', 'label_pc')
+
+    def __init__(self, filename, unique=False):
+        self.filename = filename
+        self.unique = unique
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.executescript(self.schema)
+
+    @classmethod
+    def for_database(cls, url):
+        """
+        Open (or create) the index of a database.
+
+        @rtype:  L{CrashIndex} or None
+        @return: Index, or C{None} if the database can't be indexed.
+        """
+        filename = index_filename(url)
+        if not filename:
+            return None
+        return cls(filename, unique=url.startswith('dbm://'))
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM crashes").fetchone()[0]
+
+    def _row(self, c, key, digest):
+        return (digest, sqlite3.Binary(pickle.dumps(key, pickle.HIGHEST_PROTOCOL)),
+                c.timeStamp, c.eventCode, c.eventName, c.exceptionCode,
+                c.exceptionName, crash_module(c), c.pc, c.labelPC)
+
+    def _insert(self, c):
+        """
+        @rtype:  int or None
+        @return: Row ID of the new entry, or C{None} if it was skipped.
+        """
+        key = c.key()
+        digest = key_digest(key)
+        # DBM containers keep the first crash stored with each key.
+        if self.unique and self.db.execute(
+                "SELECT 1 FROM crashes WHERE digest = ?", (digest,)).fetchone():
+            return None
+        return self.db.execute(
+            "INSERT INTO crashes (%s) VALUES (%s)"
+            % (', '.join(self.columns), ', '.join('?' * len(self.columns))),
+            self._row(c, key, digest)).lastrowid
+
+    def add(self, c):
+        """
+        Index a crash that was just added to the database.
+        """
+        self._insert(c)
+        self.db.commit()
+
+    def add_many(self, crashes):
+        """
+        Index several crashes that were just added to the database,
+        in a single transaction.
+        """
+        for c in crashes:
+            self._insert(c)
+        self.db.commit()
+
+    def remove_key(self, key):
+        """
+        Remove every indexed crash with the given key.
+        """
+        self.db.execute("DELETE FROM crashes WHERE digest = ?", (key_digest(key),))
+        self.db.commit()
+
+    def remove_crash(self, digest, timeStamp):
+        """
+        Remove an indexed crash, given its key digest and timestamp.
+        The change is committed by the next call to L{add} or L{commit}.
+        """
+        self.db.execute("DELETE FROM crashes WHERE digest = ? AND timestamp = ?",
+                        (digest, timeStamp))
+
+    def commit(self):
+        self.db.commit()
+
+    def rebuild(self, cc):
+        """
+        Rebuild the index from scratch from the crash container.
+
+        @rtype:  int
+        @return: Number of crashes indexed.
+        """
+        count = 0
+        self.db.execute("DELETE FROM crashes")
+        for c in cc:
+            self._insert(c)
+            count += 1
+        self.db.commit()
+        return count
+
+    def update(self, cc):
+        """
+        Bring the index of a DBM container up to date. Only the keys are
+        read from the container, and the crashes that aren't indexed yet are
+        loaded. Crashes no longer in the container are forgotten.
+
+        @rtype:  int
+        @return: Number of crashes indexed.
+        """
+        indexed = set(digest for digest, in self.db.execute("SELECT digest FROM crashes"))
+        count = 0
+        for key in cc.iterkeys():
+            digest = key_digest(key)
+            if digest in indexed:
+                indexed.discard(digest)
+                continue
+            try:
+                c = cc.get(key)
+            except KeyError:
+                continue
+            self._insert(c)
+            count += 1
+        self.db.executemany("DELETE FROM crashes WHERE digest = ?",
+                            [(digest,) for digest in indexed])
+        self.db.commit()
+        return count
+
+    def query(self, query=None):
+        """
+        Find the crashes matching a query, sorted by timestamp.
+
+        @rtype:  iterator of tuple(float, key)
+        @return: Timestamp and key of each matching crash.
+        """
+        where, params = (query or CrashQuery()).where()
+        cursor = self.db.execute(
+            "SELECT timestamp, key FROM crashes WHERE %s"
+            " ORDER BY timestamp, digest, id" % where, params)
+        for timeStamp, key in cursor:
+            yield timeStamp, pickle.loads(bytes(key))
+
+    def page(self, query=None, limit=-1, offset=0, reverse=False, after=None):
+        """
+        Find a page of the crashes matching a query, sorted by timestamp.
+
+        @type  after: tuple(float, str, int)
+        @param after: Timestamp, key digest and row ID of the last crash of
+            the previous page. Only the crashes after it are returned.
+
+        @rtype:  list of tuple(float, str, int, key)
+        @return: Timestamp, key digest, row ID and key of each crash.
+        """
+        where, params = (query or CrashQuery()).where()
+        op = '<' if reverse else '>'
+        if after is not None:
+            timeStamp, digest, id = after
+            if id is None:
+                id = (1 << 62) if reverse else -1
+            where += " AND (timestamp %s ? OR (timestamp = ? AND" \
+                     " (digest %s ? OR (digest = ? AND id %s ?))))" % (op, op, op)
+            params = params + [timeStamp, timeStamp, digest, digest, id]
+        order = 'DESC' if reverse else 'ASC'
+        cursor = self.db.execute(
+            "SELECT timestamp, digest, id, key FROM crashes WHERE %s"
+            " ORDER BY timestamp %s, digest %s, id %s LIMIT ? OFFSET ?"
+            % (where, order, order, order), params + [limit, offset])
+        return [(timeStamp, digest, id, pickle.loads(bytes(key)))
+                for timeStamp, digest, id, key in cursor]
+
+    def group_by(self, column, query=None):
+        """
+        Count the crashes matching a query grouped by an indexed column.
+
+        @type  column: str
+        @param column: One of C{"digest"}, C{"exception_code"} or C{"module"}.
+
+        @rtype:  list of tuple
+        @return: Column value, crash count, first and last timestamps, and
+            the exception (or event) name, label and address of one of them.
+        """
+        if column not in ('digest', 'exception_code', 'module'):
+            raise ValueError("cannot group by column: %s" % column)
+        where, params = (query or CrashQuery()).where()
+        return self.db.execute(
+            "SELECT %s, COUNT(*), MIN(timestamp), MAX(timestamp),"
+            " COALESCE(MAX(exception_name), MAX(event_name)), MAX(label_pc), MAX(pc)"
+            " FROM crashes WHERE %s GROUP BY %s" % (column, where, column),
+            params).fetchall()
+
+
+def open_crash_index(url, cc=None):
+    """
+    Open the existing index of a database for a report.
+    Warns if the index doesn't match the number of crashes in the container.
+
+    @rtype:  L{CrashIndex} or None
+    @return: Index, or C{None} if the database has no index.
+    """
+    from .sqlstore import CrashStore
+    if isinstance(cc, CrashStore):
+        # The crash store is its own index.
+        return cc
+    filename = index_filename(url)
+    if not filename or not os.path.exists(filename):
+        return None
+    index = CrashIndex(filename, unique=url.startswith('dbm://'))
+    if cc is not None and len(index) != len(cc):
+        print("Warning: the crash index is out of date, run 'crashdbg index' to rebuild it")
+    return index
+
+
+def iter_query_crashes(cc, query, index=None):
+    """
+    Iterate the crashes matching a query, sorted by timestamp.
+
+    With an index only the matching crashes are loaded. Without one, the
+    whole container is walked and filtered.
+    """
+    if index is cc:
+        # The crash store is its own index.
+        return cc.iter_crashes(query)
+    if index is None:
+        from .report import sort_crashes_by_time
+        crashes = (c for c in cc if query.matches(c))
+        return sort_crashes_by_time(crashes, cc if isinstance(cc, CrashContainer) else None)
+    return _iter_indexed_crashes(cc, query, index)
+
+
+def _iter_indexed_crashes(cc, query, index):
+    """
+    Load the crashes found in the index.
+    """
+    keyed = isinstance(cc, CrashContainer)
+    for timeStamp, key in index.query(query):
+        c = load_indexed_crash(cc, timeStamp, key, keyed)
+        if c is not None:
+            yield c
+
+
+def load_indexed_crash(cc, timeStamp, key, keyed=None):
+    """
+    Load the crash referenced by an index entry.
+
+    @rtype:  Crash or None
+    @return: Crash, or C{None} if it's no longer in the database.
+    """
+    if keyed is None:
+        keyed = isinstance(cc, CrashContainer)
+    if keyed:
+        try:
+            return cc.get(key)
+        except KeyError:
+            return None
+    find_crash = getattr(cc, 'find_crash', None)
+    if find_crash is not None:
+        return find_crash(key, timeStamp)
+
+    # SQL databases may repeat keys, so narrow it down by time too.
+    # Some databases drop the fractional seconds, so a whole second is loaded.
+    since = datetime.datetime.fromtimestamp(int(timeStamp))
+    until = datetime.datetime.fromtimestamp(int(timeStamp) + 1)
+    for c in cc._dao.find(signature=key, since=since, until=until):
+        if c.timeStamp == timeStamp:
+            return c
+    return None
@@ -0,0 +1,345 @@
+"""
+Persistent cache of resolved breakpoint labels.
+
+Resolving labels like C{kernel32!CreateFileW} may need loading the debug
+symbols of the module, which is slow. The cache keeps the resolved labels as
+offsets from the module base address, for each version of each module, so
+other processes loading the same module can reuse them at any base address.
+It's saved to a file, so restarted targets and later runs of the crash
+monitor don't resolve the labels again.
+
+Modules are identified by their filename, plus the size and modification
+time of the file. Only labels naming their module are cached, since other
+labels may be absolute addresses.
+
+Labels missing from the cache are resolved for each module all at once: the
+export table of the module file is read a single time and every exported
+function is found with a dictionary lookup. Only the labels that aren't
+exports are left to the debugger to resolve, one at a time.
+"""
+import json
+import mmap
+import ntpath
+import os
+import struct
+
+__all__ = [
+    'LabelCache',
+    'label_module',
+    'module_name',
+    'read_export_table',
+]
+
+# Version of the label cache file format.
+LABEL_CACHE_VERSION = 1
+
+
+def module_name(name):
+    """
+    Normalize a module name or filename the way labels name modules:
+    lowercase, without the path and the extension.
+    """
+    name = ntpath.basename(name).lower()
+    base, ext = ntpath.splitext(name)
+    if base and ext:
+        return base
+    return name
+
+
+def label_module(label):
+    """
+    Get the module a label like C{kernel32!CreateFileW} belongs to.
+
+    Labels may also give the base address of the module instead of its name,
+    like C{0x7ff00000!CreateFileW}. Those can't be told apart by name, so
+    they're treated as labels without a module.
+
+    @rtype:  str or None
+    @return: Normalized module name, or C{None} if the label doesn't name one.
+    """
+    if '!' not in label:
+        return None
+    name = label.split('!', 1)[0]
+    if _is_address(name):
+        return None
+    return module_name(name) or None
+
+
+def _is_address(text):
+    """
+    Determine if a module name may be read as a base address by the debugger.
+    Like C{HexInput.integer}, hexadecimal numbers need no prefix.
+    """
+    text = text.strip().lstrip('-')
+    for base in (0, 16):
+        try:
+            int(text, base)
+            return True
+        except ValueError:
+            pass
+    return False
+
+
+def split_export_label(label):
+    """
+    Split a label like C{kernel32!CreateFileW+0x10} into the function name
+    and the offset.
+
+    @rtype:  tuple(str, int) or None
+    @return: Function name and offset, or C{None} if the label has any other
+        form, like ordinals or decimal offsets.
+    """
+    if '!' not in label:
+        return None
+    function = label.split('!', 1)[1]
+    offset = 0
+    if '+' in function:
+        function, offset = function.rsplit('+', 1)
+        if not offset.lower().startswith('0x'):
+            return None
+        try:
+            offset = int(offset, 16)
+        except ValueError:
+            return None
+    if not function or function.startswith('#'):
+        return None
+    return function, offset
+
+
+def read_export_table(filename):
+    """
+    Read the functions exported by name from a PE file.
+    Forwarded exports are left out, since they live in another module.
+
+    Function names are lowercased, since labels are matched regardless of
+    case (the config file lowercases them).
+
+    @rtype:  dict(str S{->} int)
+    @return: Map of lowercase function names to their offsets from the
+        module base.
+
+    @raise ValueError: The file is not a valid PE file.
+    """
+    with open(filename, 'rb') as fd:
+        data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return _parse_export_table(data)
+    except struct.error:
+        raise ValueError("invalid PE file: %s" % filename)
+    finally:
+        data.close()
+
+
+def _parse_export_table(data):
+    if data[:2] != b'MZ':
+        raise ValueError("not a PE file")
+    pe, = struct.unpack_from('<I', data, 0x3C)
+    if data[pe:pe + 4] != b'PE\0\0':
+        raise ValueError("not a PE file")
+    sections, optionalSize = struct.unpack_from('<H12xH', data, pe + 6)
+    optional = pe + 24
+    magic, = struct.unpack_from('<H', data, optional)
+    if magic == 0x10b:
+        directories = optional + 96
+    elif magic == 0x20b:
+        directories = optional + 112
+    else:
+        raise ValueError("unknown PE optional header")
+    count, = struct.unpack_from('<I', data, directories - 4)
+    if not count:
+        return dict()
+    exportRVA, exportSize = struct.unpack_from('<II', data, directories)
+    if not exportRVA:
+        return dict()
+
+    # Map the section addresses to file offsets.
+    table = []
+    for i in range(sections):
+        virtualSize, virtualAddress, rawSize, rawOffset = struct.unpack_from(
+            '<IIII', data, optional + optionalSize + i * 40 + 8)
+        table.append((virtualAddress, max(virtualSize, rawSize), rawOffset))
+
+    def offset_of(rva):
+        for virtualAddress, size, rawOffset in table:
+            if virtualAddress <= rva < virtualAddress + size:
+                return rva - virtualAddress + rawOffset
+        raise ValueError("address outside of any section: 0x%x" % rva)
+
+    def string_at(rva):
+        start = offset_of(rva)
+        return data[start:data.find(b'\0', start)].decode('latin-1')
+
+    # Skip Characteristics, TimeDateStamp, the version, Name and Base.
+    (functions, names, addressOfFunctions, addressOfNames,
+     addressOfOrdinals) = struct.unpack_from('<20xIIIII', data, offset_of(exportRVA))
+    functionTable = offset_of(addressOfFunctions) if functions else 0
+    exports = dict()
+    if names:
+        nameTable = offset_of(addressOfNames)
+        ordinalTable = offset_of(addressOfOrdinals)
+        for i in range(names):
+            nameRVA, = struct.unpack_from('<I', data, nameTable + i * 4)
+            ordinal, = struct.unpack_from('<H', data, ordinalTable + i * 2)
+            if ordinal >= functions:
+                continue
+            rva, = struct.unpack_from('<I', data, functionTable + ordinal * 4)
+            if exportRVA <= rva < exportRVA + exportSize:
+                continue
+            exports[string_at(nameRVA).lower()] = rva
+    return exports
+
+
+class LabelCache(object):
+    """
+    Resolved labels of each module version, as offsets from its base address.
+
+    @type filename: str
+    @ivar filename: File the cache is saved to, or C{None} to keep it in
+        memory only.
+
+    @type modules: dict(str S{->} dict(str S{->} int))
+    @ivar modules: Map of module identities to maps of labels to offsets.
+        Labels not found in the module map to C{None}.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.modules = dict()
+        self.dirty = False
+
+    @classmethod
+    def for_config(cls, config, filename=None):
+        """
+        Load the label cache of a configuration file. By default it's kept
+        next to the configuration file.
+        """
+        if filename is None and config:
+            filename = config + '.labels'
+        cache = cls(filename)
+        cache.load()
+        return cache
+
+    def load(self):
+        """
+        Load the cache file, if it exists. Unreadable files are ignored.
+        """
+        if not self.filename or not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, 'r') as fd:
+                data = json.load(fd)
+        except ValueError:
+            return
+        if data.get('version') == LABEL_CACHE_VERSION:
+            self.modules = data.get('modules', dict())
+
+    def save(self):
+        """
+        Save the cache file, if anything was resolved since the last save.
+        """
+        if not self.filename or not self.dirty:
+            return
+        data = {
+            'version': LABEL_CACHE_VERSION,
+            'modules': self.modules,
+        }
+        tmpname = self.filename + '.tmp'
+        with open(tmpname, 'w') as fd:
+            json.dump(data, fd)
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(tmpname, self.filename)
+        self.dirty = False
+
+    @staticmethod
+    def module_identity(aModule):
+        """
+        Identify the version of a module by its file.
+
+        @rtype:  str or None
+        @return: Module identity, or C{None} if its file can't be found.
+        """
+        filename = aModule.get_filename()
+        if not filename:
+            return None
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        return '%s|%d|%d' % (os.path.normcase(filename), stat.st_size, int(stat.st_mtime))
+
+    def resolve_many(self, aModule, labels, stats=None):
+        """
+        Resolve several labels in a module, see the module documentation.
+
+        Labels that can't be resolved right now, because the debugger
+        failed to, are left out of the result and not cached.
+
+        @type  stats: dict(str S{->} int)
+        @param stats: If given, the number of labels found in the cache
+            (C{cached}), in the export table (C{exports}), by the debugger
+            (C{resolved}) and not found (C{missing}) are added to it.
+
+        @rtype:  dict(str S{->} int)
+        @return: Addresses of the labels found in the module.
+        """
+        if stats is None:
+            stats = dict()
+        for name in ('cached', 'exports', 'resolved', 'missing'):
+            stats.setdefault(name, 0)
+        identity = self.module_identity(aModule)
+        cached = None
+        if identity is not None:
+            cached = self.modules.setdefault(identity, dict())
+        base = aModule.get_base()
+        exports = None
+        addresses = dict()
+        for label in labels:
+            bound = label_module(label) is not None
+            if bound and not aModule.match_name(label.split('!', 1)[0]):
+                stats['missing'] += 1
+                continue
+            if bound and cached is not None and label in cached:
+                offset = cached[label]
+                stats['cached' if offset is not None else 'missing'] += 1
+                if offset is not None:
+                    addresses[label] = base + offset
+                continue
+            offset = None
+            parts = split_export_label(label) if bound else None
+            if parts is not None:
+                if exports is None:
+                    exports = self._read_exports(aModule)
+                function, extra = parts
+                function = function.lower()
+                if function in exports:
+                    offset = exports[function] + extra
+                    stats['exports'] += 1
+            if offset is None:
+                try:
+                    address = aModule.resolve_label(label)
+                except ValueError:
+                    address = None
+                except (RuntimeError, EnvironmentError):
+                    continue
+                if address is not None:
+                    offset = address - base
+                    stats['resolved'] += 1
+                else:
+                    stats['missing'] += 1
+            if bound and cached is not None:
+                cached[label] = offset
+                self.dirty = True
+            if offset is not None:
+                addresses[label] = base + offset
+        return addresses
+
+    @staticmethod
+    def _read_exports(aModule):
+        filename = aModule.get_filename()
+        if not filename:
+            return dict()
+        try:
+            return read_export_table(filename)
+        except (ValueError, EnvironmentError):
+            return dict()
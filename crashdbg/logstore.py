@@ -0,0 +1,416 @@
+"""
+Append-only crash log store, for C{log://} database URLs.
+
+The crash log is a directory of segment files, where pickled crashes are
+appended as length-prefixed records, and an index file with one fixed-width
+entry per crash: key hash, timestamp and record location. The index is
+memory-mapped, and so are the segments when reading crashes back.
+
+Crashes are never rewritten, so adding one is a single append and duplicate
+keys cost nothing. If the writer dies halfway through a record, the torn
+tail is found and truncated the next time the log is opened for writing.
+Removed crashes are only marked as such in the index, their space is
+reclaimed by L{compact_crash_log}.
+
+Only one process may write to a crash log at a time, but any number of them
+may read it while it's being written.
+"""
+import binascii
+import mmap
+import os
+import shutil
+import struct
+import zlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .database import key_digest
+
+__all__ = [
+    'CrashLog',
+    'compact_crash_log',
+]
+
+# Segment record header: payload length and CRC32.
+RECORD_HEADER = struct.Struct('<II')
+
+# Index entry: key hash, timestamp, segment number, record offset and
+# payload length.
+INDEX_ENTRY = struct.Struct('<8sdIQI')
+
+# Start a new segment when the current one would grow past this size.
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Key hash of the index entries of removed crashes.
+DELETED_HASH = b'\0' * 8
+
+INDEX_FILENAME = 'index'
+SEGMENT_FILENAME = '%08d.log'
+
+
+def _key_hash(key):
+    return binascii.unhexlify(key_digest(key))
+
+
+def _crc(data):
+    return zlib.crc32(data) & 0xffffffff
+
+
+def _slice(buf, start, end):
+    """
+    Zero-copy slice of a memory map, where supported.
+    """
+    try:
+        return memoryview(buf)[start:end]
+    except TypeError:
+        # Python 2 memory maps don't support memoryview.
+        return buf[start:end]
+
+
+class CrashLog(object):
+    """
+    Append-only crash container, see the module documentation.
+
+    Crash keys are compared by their 64 bit hash, so the crashes don't have
+    to be loaded to find out if a crash is already in the log.
+
+    @type path: str
+    @ivar path: Directory of the crash log.
+
+    @type readOnly: bool
+    @ivar readOnly: C{True} if the crash log was opened for reading only.
+    """
+
+    def __init__(self, path, allowRepeatedKeys=True, readOnly=False,
+                 segmentSize=DEFAULT_SEGMENT_SIZE):
+        self.path = path
+        self.readOnly = readOnly
+        self.segmentSize = segmentSize
+        self._allowRepeatedKeys = allowRepeatedKeys
+        self._maps = dict()         # segment -> mmap
+        self._hashes = dict()       # key hash -> list of entry numbers
+        self._count = 0             # index entries, including removed ones
+        self._live = 0              # crashes not removed
+        self._indexMap = None
+        self._indexFile = None
+        self._segmentFile = None
+        self._segment = 0           # segment being written
+        self._segmentEnd = 0        # size of the segment being written
+        if not readOnly and not os.path.isdir(path):
+            os.makedirs(path)
+        if readOnly:
+            self._open_for_reading()
+        else:
+            self._open_for_writing()
+        for i in range(self._count):
+            hash = self._entry(i)[0]
+            if hash != DELETED_HASH:
+                self._hashes.setdefault(hash, []).append(i)
+                self._live += 1
+
+    def _segment_filename(self, segment):
+        return os.path.join(self.path, SEGMENT_FILENAME % segment)
+
+    def _segment_sizes(self):
+        sizes = dict()
+        for name in os.listdir(self.path):
+            base, ext = os.path.splitext(name)
+            if ext == '.log' and base.isdigit():
+                sizes[int(base)] = os.path.getsize(os.path.join(self.path, name))
+        return sizes
+
+    def _valid_entries(self, data, sizes):
+        """
+        Count the index entries up to the first one past the end of its segment.
+        """
+        count = len(data) // INDEX_ENTRY.size
+        for i in range(count):
+            hash, timeStamp, segment, offset, length = \
+                INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size)
+            if offset + RECORD_HEADER.size + length > sizes.get(segment, -1):
+                return i
+        return count
+
+    def _open_for_reading(self):
+        filename = os.path.join(self.path, INDEX_FILENAME)
+        if not os.path.exists(filename):
+            return
+        with open(filename, 'rb') as fd:
+            data = fd.read()
+        self._count = self._valid_entries(data, self._segment_sizes())
+        self._map_index()
+
+    def _open_for_writing(self):
+        filename = os.path.join(self.path, INDEX_FILENAME)
+        if not os.path.exists(filename):
+            open(filename, 'wb').close()
+        self._indexFile = open(filename, 'r+b')
+        data = self._indexFile.read()
+        sizes = self._segment_sizes()
+        self._count = self._valid_entries(data, sizes)
+        self._indexFile.truncate(self._count * INDEX_ENTRY.size)
+        self._indexFile.seek(0, os.SEEK_END)
+
+        # Index the complete records written after the last indexed one,
+        # and truncate the incomplete ones.
+        segments = sorted(sizes) or [1]
+        start = 0
+        if self._count:
+            hash, timeStamp, segment, offset, length = \
+                INDEX_ENTRY.unpack_from(data, (self._count - 1) * INDEX_ENTRY.size)
+            segments = [s for s in segments if s >= segment]
+            start = offset + RECORD_HEADER.size + length
+        for segment in segments:
+            if self._segmentFile is not None:
+                self._segmentFile.close()
+            filename = self._segment_filename(segment)
+            if not os.path.exists(filename):
+                open(filename, 'wb').close()
+            self._segment = segment
+            self._segmentEnd = start
+            self._segmentFile = open(filename, 'r+b')
+            self._recover_segment()
+            start = 0
+        self._map_index()
+
+    def _recover_segment(self):
+        fd = self._segmentFile
+        fd.seek(self._segmentEnd)
+        while 1:
+            header = fd.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            length, crc = RECORD_HEADER.unpack(header)
+            payload = fd.read(length)
+            if len(payload) < length or _crc(payload) != crc:
+                break
+            try:
+                crash = pickle.loads(payload)
+            except Exception:
+                break
+            self._indexFile.write(INDEX_ENTRY.pack(
+                _key_hash(crash.key()), crash.timeStamp,
+                self._segment, self._segmentEnd, length))
+            self._count += 1
+            self._segmentEnd += RECORD_HEADER.size + length
+        fd.seek(self._segmentEnd)
+        fd.truncate()
+        self._indexFile.flush()
+
+    def _map_index(self):
+        if self._indexMap is not None:
+            self._indexMap.close()
+            self._indexMap = None
+        if self._count:
+            filename = os.path.join(self.path, INDEX_FILENAME)
+            with open(filename, 'rb') as fd:
+                self._indexMap = mmap.mmap(fd.fileno(), self._count * INDEX_ENTRY.size,
+                                           access=mmap.ACCESS_READ)
+
+    def _map_segment(self, segment, end):
+        mm = self._maps.get(segment)
+        if mm is None or len(mm) < end:
+            if mm is not None:
+                mm.close()
+            with open(self._segment_filename(segment), 'rb') as fd:
+                mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = mm
+        return mm
+
+    def _entry(self, i):
+        if self._indexMap is None or len(self._indexMap) < (i + 1) * INDEX_ENTRY.size:
+            self._map_index()
+        return INDEX_ENTRY.unpack_from(self._indexMap, i * INDEX_ENTRY.size)
+
+    def _load(self, i):
+        hash, timeStamp, segment, offset, length = self._entry(i)
+        start = offset + RECORD_HEADER.size
+        mm = self._map_segment(segment, start + length)
+        return pickle.loads(_slice(mm, start, start + length))
+
+    def __len__(self):
+        return self._live
+
+    def __contains__(self, crash):
+        return _key_hash(crash.key()) in self._hashes
+
+    def __iter__(self):
+        for i in range(self._count):
+            if self._entry(i)[0] != DELETED_HASH:
+                yield self._load(i)
+
+    def iter_entries(self):
+        """
+        Iterate the index entries of the crashes in the log.
+
+        @rtype:  iterator of tuple(str, float, int, int, int)
+        @return: Key hash, timestamp, segment, offset and payload length.
+        """
+        for i in range(self._count):
+            entry = self._entry(i)
+            if entry[0] != DELETED_HASH:
+                yield entry
+
+    def read_payload(self, segment, offset, length):
+        """
+        Read the pickled crash of an index entry.
+        """
+        start = offset + RECORD_HEADER.size
+        mm = self._map_segment(segment, start + length)
+        return mm[start:start + length]
+
+    def add(self, crash):
+        """
+        Append a crash to the log.
+
+        If repeated keys are not allowed, crashes already in the log are
+        silently ignored.
+        """
+        if self.readOnly:
+            raise IOError("crash log opened for reading only: %s" % self.path)
+        hash = _key_hash(crash.key())
+        if not self._allowRepeatedKeys and hash in self._hashes:
+            return
+        self.append_payload(hash, crash.timeStamp,
+                            pickle.dumps(crash, pickle.HIGHEST_PROTOCOL))
+
+    def append_payload(self, hash, timeStamp, payload):
+        """
+        Append an already pickled crash to the log.
+        """
+        size = RECORD_HEADER.size + len(payload)
+        if self._segmentEnd and self._segmentEnd + size > self.segmentSize:
+            self._rollover()
+        offset = self._segmentEnd
+        self._segmentFile.write(RECORD_HEADER.pack(len(payload), _crc(payload)))
+        self._segmentFile.write(payload)
+        self._segmentFile.flush()
+        self._indexFile.write(INDEX_ENTRY.pack(
+            hash, timeStamp, self._segment, offset, len(payload)))
+        self._indexFile.flush()
+        self._hashes.setdefault(hash, []).append(self._count)
+        self._count += 1
+        self._live += 1
+        self._segmentEnd += size
+
+    def remove(self, entries):
+        """
+        Remove crashes from the log.
+
+        Only the index entries with the same key hashes are looked at, so
+        removing a few crashes doesn't scan the whole index.
+
+        @type  entries: iterable of tuple(str, int, int)
+        @param entries: Key hash, segment and offset of each crash to
+            remove, as returned by L{iter_entries}.
+
+        @rtype:  int
+        @return: Number of crashes removed.
+        """
+        if self.readOnly:
+            raise IOError("crash log opened for reading only: %s" % self.path)
+        locations = dict()      # key hash -> set of (segment, offset)
+        for hash, segment, offset in entries:
+            locations.setdefault(hash, set()).add((segment, offset))
+        count = 0
+        for hash, removed in locations.items():
+            kept = []
+            for i in self._hashes.get(hash, ()):
+                segment, offset = self._entry(i)[2:4]
+                if (segment, offset) not in removed:
+                    kept.append(i)
+                    continue
+                self._indexFile.seek(i * INDEX_ENTRY.size)
+                self._indexFile.write(DELETED_HASH)
+                count += 1
+            if kept:
+                self._hashes[hash] = kept
+            else:
+                self._hashes.pop(hash, None)
+        self._live -= count
+        self._indexFile.seek(0, os.SEEK_END)
+        self._indexFile.flush()
+        return count
+
+    def _rollover(self):
+        self._segmentFile.close()
+        self._segment += 1
+        self._segmentEnd = 0
+        self._segmentFile = open(self._segment_filename(self._segment), 'w+b')
+
+    def iter_key_hashes(self):
+        """
+        Iterate the distinct key hashes in the log, without loading any crash.
+        """
+        return iter(list(self._hashes))
+
+    def get(self, key):
+        """
+        Get the last crash added with the given key.
+
+        @raise KeyError: No crash with that key is in the log.
+        """
+        entries = self._hashes.get(_key_hash(key))
+        if not entries:
+            raise KeyError(key)
+        return self._load(entries[-1])
+
+    def find_crash(self, key, timeStamp):
+        """
+        Get the crash with the given key and timestamp.
+
+        @rtype:  Crash or None
+        @return: Crash, or C{None} if it's not in the log.
+        """
+        for i in self._hashes.get(_key_hash(key), ()):
+            if self._entry(i)[1] == timeStamp:
+                return self._load(i)
+        return None
+
+    def close(self):
+        """
+        Close the crash log.
+        """
+        for mm in self._maps.values():
+            mm.close()
+        self._maps = dict()
+        if self._indexMap is not None:
+            self._indexMap.close()
+            self._indexMap = None
+        if self._segmentFile is not None:
+            self._segmentFile.close()
+            self._segmentFile = None
+        if self._indexFile is not None:
+            self._indexFile.close()
+            self._indexFile = None
+
+
+def compact_crash_log(path):
+    """
+    Rewrite a crash log without the space taken by removed crashes.
+    The crash log must not be in use by any other process.
+
+    @rtype:  tuple(int, int)
+    @return: Size of the segments before and after compacting, in bytes.
+    """
+    old = CrashLog(path)
+    before = sum(old._segment_sizes().values())
+    temp = path + '.compact'
+    if os.path.exists(temp):
+        shutil.rmtree(temp)
+    new = CrashLog(temp, segmentSize=old.segmentSize)
+    try:
+        for hash, timeStamp, segment, offset, length in old.iter_entries():
+            new.append_payload(hash, timeStamp, old.read_payload(segment, offset, length))
+        after = sum(new._segment_sizes().values())
+    finally:
+        new.close()
+        old.close()
+    backup = path + '.old'
+    os.rename(path, backup)
+    os.rename(temp, path)
+    shutil.rmtree(backup)
+    return before, after
@@ -0,0 +1,414 @@
+"""
+Bulk migration of crashes between databases.
+
+Crashes are streamed from the source database in batches, and each batch is
+written to the destination in a single transaction when the backend allows
+it, so only a few batches are ever kept in memory. Decoding the crashes
+(unpickling and decompressing them) can be spread over worker processes.
+
+After each batch the position in the source database is saved to a
+checkpoint file, so an interrupted migration can be resumed later. The
+source database must not change in between.
+"""
+import binascii
+import datetime
+import json
+import multiprocessing
+import os
+import shutil
+from collections import deque
+from itertools import islice
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from winappdbg import Crash, CrashContainer
+
+from .chunks import ChunkStore, load_crash_memory
+from .compression import CompressedCrash, dictionary_filename, get_codec, load_dictionary, \
+    setup_compression
+from .database import add_crashes, key_encoding, sidecar_filename
+from .logstore import CrashLog
+from .report import external_sort
+from .sqlstore import CrashStore
+
+__all__ = [
+    'MigrationCheckpoint',
+    'migrate_crashes',
+    'setup_migration_compression',
+]
+
+# Number of crashes written to the destination database at once.
+MIGRATE_BATCH_SIZE = 500
+
+# Number of rows fetched at once from SQL databases.
+SQL_PAGE_SIZE = 500
+
+# How the crashes are read from each kind of source database:
+#   key    - crash keys, the crashes are loaded with get()
+#   pickle - pickled crashes, read without unpickling them
+#   crash  - crashes, already unpickled by the container
+SOURCE_KEY = 'key'
+SOURCE_PICKLE = 'pickle'
+SOURCE_CRASH = 'crash'
+
+# Chunk store opened by each migration worker process.
+_worker_chunks = None
+
+
+class MigrationCheckpoint(object):
+    """
+    Progress of a migration, stored as a JSON file next to the configuration
+    file of the source database.
+
+    @type position: int
+    @ivar position: Number of crashes of the source database migrated so far.
+
+    @type after: bytes
+    @ivar after: Canonical encoding of the key of the last crash migrated
+        from a DBM database, or C{None}.
+    """
+
+    def __init__(self, filename, source, destination):
+        self.filename = filename
+        self.source = source
+        self.destination = destination
+        self.position = 0
+        self.after = None
+
+    @classmethod
+    def for_config(cls, config, source, destination):
+        """
+        Load the checkpoint kept next to a configuration file.
+        """
+        checkpoint = cls(config + '.migrate', source, destination)
+        checkpoint.load()
+        return checkpoint
+
+    def load(self):
+        """
+        Load the checkpoint file, if it exists.
+        A checkpoint saved for different databases is ignored.
+        """
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, 'r') as fd:
+            data = json.load(fd)
+        if data.get('source') != self.source or data.get('destination') != self.destination:
+            return
+        self.position = data.get('position', 0)
+        if data.get('after'):
+            self.after = binascii.unhexlify(data['after'])
+
+    def save(self):
+        """
+        Save the checkpoint file, replacing the old one.
+        """
+        data = {
+            'source': self.source,
+            'destination': self.destination,
+            'position': self.position,
+            'after': binascii.hexlify(self.after).decode('ascii') if self.after else None,
+        }
+        tmpname = self.filename + '.tmp'
+        with open(tmpname, 'w') as fd:
+            json.dump(data, fd)
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(tmpname, self.filename)
+
+    def remove(self):
+        """
+        Delete the checkpoint file once the migration is complete.
+        """
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+def setup_migration_compression(options, url, compression='keep'):
+    """
+    Load the compression dictionary of the source database, and choose how
+    the migrated crashes are compressed.
+
+    With C{keep}, compressed crashes stay compressed with the codec of the
+    source database. With C{none} every crash is stored uncompressed, and
+    with a codec name every crash is compressed with it.
+
+    The dictionary of the source database is only used if it can be copied
+    next to the destination database, otherwise crashes are compressed
+    without a dictionary.
+
+    @rtype:  class or None
+    @return: Crash class to convert the migrated crashes to, or C{None} to
+        keep the class of each crash.
+    """
+    setup_compression(options)
+    if compression == 'none':
+        return Crash
+    if compression == 'keep':
+        codec = get_codec(options.compression if options.compression != 'none'
+                          else CompressedCrash.codec)
+    else:
+        codec = get_codec(compression)
+    CompressedCrash.codec = codec.name
+    CompressedCrash.dictionary = None
+    if codec.supportsDictionary:
+        CompressedCrash.dictionary = _copy_dictionary(dictionary_filename(options), url)
+    if compression == 'keep':
+        return None
+    return CompressedCrash
+
+
+def _copy_dictionary(filename, url):
+    """
+    Copy a compression dictionary next to a database, unless it already has
+    a different one.
+
+    @rtype:  str or None
+    @return: Digest of the dictionary, or C{None} if it can't be used.
+    """
+    target = sidecar_filename(url, '.zdict')
+    if not filename or not target or not os.path.exists(filename):
+        return None
+    digest = load_dictionary(filename)
+    if not os.path.exists(target):
+        shutil.copyfile(filename, target)
+    elif load_dictionary(target) != digest:
+        return None
+    return digest
+
+
+def migrate_crashes(src, dst, start=0, batch_size=MIGRATE_BATCH_SIZE, jobs=1,
+                    crashClass=None, dictionary=None, chunks=None, onBatch=None,
+                    after=None):
+    """
+    Copy every crash of a container into another one.
+
+    Crashes are read in the same order every time, so a migration can be
+    resumed by skipping the crashes migrated before. The last batch of the
+    previous run may have been written without saving the checkpoint, so
+    the crashes of the first batch already in the destination are skipped.
+
+    DBM databases are migrated sorted by the canonical encoding of their
+    keys, with an external sort to keep memory bounded. They're resumed
+    after the key of the last crash migrated, rather than by position.
+
+    When C{jobs} is greater than one the pickled crashes of crash logs and
+    crash stores are decoded (decompressed and unpickled) by a pool of
+    worker processes. At most two batches per worker are in flight. Crashes
+    of DBM and SQLAlchemy databases are always loaded by this process: the
+    database itself unpickles them, so the workers would only load each
+    crash to pickle it again and send it back whole.
+
+    @type  start: int
+    @param start: Number of crashes migrated by a previous run.
+
+    @type  crashClass: class
+    @param crashClass: Class to convert the crashes to, as returned by
+        L{setup_migration_compression}, or C{None} to keep their classes.
+
+    @type  dictionary: str
+    @param dictionary: Filename of the compression dictionary of the source
+        database, if any, for the worker processes.
+
+    @type  chunks: str
+    @param chunks: Filename of the chunk store of the source database, if
+        any. Memory snapshots kept there are put back into the crashes.
+
+    @type  onBatch: callable
+    @param onBatch: Called with the number of crashes migrated so far, and
+        the key encoding of the last one for DBM databases (or C{None}),
+        after each batch is written.
+
+    @type  after: bytes
+    @param after: Key encoding of the last crash migrated by a previous run
+        from a DBM database. If given, C{start} is only used for counting.
+
+    @rtype:  int
+    @return: Number of crashes migrated, including the skipped ones.
+    """
+    mode = _source_mode(src)
+    items = _iter_source(src, mode, start, after)
+    if jobs > 1 and mode == SOURCE_PICKLE:
+        batches = _decode_parallel(mode, items, batch_size, jobs, dictionary, chunks)
+    else:
+        batches = _decode_serial(src, mode, items, batch_size, chunks)
+    position = start
+    resumed = start > 0 or after is not None
+    for batch in batches:
+        count = len(batch)
+        if mode == SOURCE_KEY and batch:
+            after = key_encoding(batch[-1].key())
+        if crashClass is not None:
+            batch = [_convert_crash(c, crashClass) for c in batch]
+        if resumed:
+            batch = [c for c in batch if not _is_migrated(dst, c)]
+            resumed = False
+        add_crashes(dst, batch)
+        position += count
+        if onBatch is not None:
+            onBatch(position, after if mode == SOURCE_KEY else None)
+    return position
+
+
+def _source_mode(cc):
+    if isinstance(cc, CrashContainer):
+        return SOURCE_KEY
+    if isinstance(cc, (CrashLog, CrashStore)):
+        return SOURCE_PICKLE
+    return SOURCE_CRASH
+
+
+def _iter_source(cc, mode, start, after=None):
+    """
+    Iterate the crashes of a container in a stable order, as keys, pickled
+    crashes or crashes depending on the mode, skipping the first ones, or
+    for DBM databases the ones up to the given key encoding.
+    """
+    if mode == SOURCE_KEY:
+        # DBM files are iterated in hash order, sort the keys to make the
+        # order the same every time. The canonical encoding of the keys is
+        # used, since it's the same for equal keys and unique otherwise.
+        records = ((key_encoding(key), key) for key in cc.iterkeys())
+        if after is not None:
+            records = (record for record in records if record[0] > after)
+            start = 0
+        return islice((key for encoding, key in external_sort(records)), start, None)
+    if isinstance(cc, CrashLog):
+        return (cc.read_payload(segment, offset, length)
+                for hash, timeStamp, segment, offset, length
+                in islice(cc.iter_entries(), start, None))
+    if isinstance(cc, CrashStore):
+        cursor = cc.db.cursor()
+        cursor.execute("SELECT data FROM crash_bodies ORDER BY id LIMIT -1 OFFSET ?", (start,))
+        return (bytes(row[0]) for row in cursor)
+    if hasattr(cc, '_dao'):
+        return _iter_sql_crashes(cc, start)
+    return islice(iter(cc), start, None)
+
+
+def _iter_sql_crashes(cc, offset):
+    """
+    Load the crashes of a SQL database one page at a time.
+    """
+    while 1:
+        found = cc._dao.find(order=1, offset=offset, limit=SQL_PAGE_SIZE)
+        if not found:
+            break
+        offset += len(found)
+        for c in found:
+            yield c
+
+
+def _iter_chunks(items, size):
+    while 1:
+        chunk = list(islice(items, size))
+        if not chunk:
+            break
+        yield chunk
+
+
+def _decode_crash(mode, item, cc, chunks):
+    if mode == SOURCE_KEY:
+        c = cc.get(item)
+    elif mode == SOURCE_PICKLE:
+        c = pickle.loads(item)
+    else:
+        c = item
+    if chunks is not None and getattr(c, 'memoryChunks', None):
+        load_crash_memory(c, chunks)
+        del c.memoryChunks
+    return c
+
+
+def _decode_serial(cc, mode, items, batch_size, chunks=None):
+    """
+    Decode the crashes in this process, one batch at a time.
+    """
+    store = None
+    if chunks:
+        store = ChunkStore(chunks)
+    try:
+        for chunk in _iter_chunks(items, batch_size):
+            yield [_decode_crash(mode, item, cc, store) for item in chunk]
+    finally:
+        if store is not None:
+            store.close()
+
+
+def _decode_parallel(mode, items, batch_size, jobs, dictionary=None, chunks=None):
+    """
+    Decode the crashes in a pool of worker processes, one batch per task.
+    Batches come back in the same order they were read.
+    """
+    pool = multiprocessing.Pool(jobs, _init_migrate_worker, (dictionary, chunks))
+    try:
+        pending = deque()
+        for chunk in _iter_chunks(items, batch_size):
+            pending.append(pool.apply_async(_decode_chunk, (mode, chunk)))
+            if len(pending) >= jobs * 2:
+                yield _restore_crashes(pending.popleft().get())
+        while pending:
+            yield _restore_crashes(pending.popleft().get())
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _init_migrate_worker(dictionary=None, chunks=None):
+    """
+    Initialize a migration worker process.
+    """
+    global _worker_chunks
+    if dictionary and os.path.exists(dictionary):
+        load_dictionary(dictionary)
+    if chunks:
+        _worker_chunks = ChunkStore(chunks)
+
+
+def _decode_chunk(mode, chunk):
+    """
+    Decode a batch of crashes in a migration worker process.
+
+    The crashes are sent back as their classes and attributes, so
+    compressed crashes aren't compressed again just to be sent back.
+    """
+    crashes = []
+    for item in chunk:
+        c = _decode_crash(mode, item, None, _worker_chunks)
+        crashes.append((c.__class__, c.__dict__))
+    return crashes
+
+
+def _restore_crashes(states):
+    return [_convert_crash(state, cls) for cls, state in states]
+
+
+def _convert_crash(c, cls):
+    """
+    Build a crash of the given class from a crash or its attributes.
+    """
+    if type(c) is cls:
+        return c
+    if not isinstance(c, dict):
+        c = c.__dict__
+    crash = cls.__new__(cls)
+    crash.__dict__.update(c)
+    return crash
+
+
+def _is_migrated(cc, c):
+    """
+    Determine if a crash is already in the destination container.
+    """
+    find_crash = getattr(cc, 'find_crash', None)
+    if find_crash is not None:
+        return find_crash(c.key(), c.timeStamp) is not None
+    if hasattr(cc, '_dao'):
+        # Some databases drop the fractional seconds, so a whole second is loaded.
+        since = datetime.datetime.fromtimestamp(int(c.timeStamp))
+        until = datetime.datetime.fromtimestamp(int(c.timeStamp) + 1)
+        return bool(cc._dao.find(signature=c.key(), since=since, until=until))
+    return c in cc
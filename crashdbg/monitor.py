@@ -41,8 +41,14 @@ except NameError:
     from winappdbg.win32 import WindowsError, SLE_ERROR, SLE_MINORERROR, SLE_WARNING
 
 # Crashdbg libs
+from .actions import ACTION_MODES
+from .compression import get_codec
+from .database import sidecar_filename
 from .handler import CrashEventHandler
 from .options import Options
+from .retention import parse_duration
+from .signatures import SIGNATURE_CACHES
+from .writer import WRITE_POLICIES
 
 
 # XXX TODO
@@ -60,8 +66,9 @@ from .options import Options
 # XXX TODO
 # * Capture stderr from the debugees?
 # * Unless the full memory snapshot was requested, the debugger could return
-#   DEBUG_CONTINUE and store the crash info in the database in background,
-#   while the debugee tries to handle the exception.
+#   DEBUG_CONTINUE and capture the crash info in background too, while the
+#   debugee tries to handle the exception. (Storing it into the database is
+#   already done in background when "write_behind" is enabled.)
 
 
 class CrashMonitor(object):
@@ -218,6 +225,39 @@ class CrashMonitor(object):
             print("  Set 'autodetach' to false to make sure debugees are killed on exit.")
             print("  Alternatively use 'attach' instead of launching new processes.")
             print()
+        # Fail about unknown write policies
+        if self.options.write_policy not in WRITE_POLICIES:
+            raise ValueError("unknown write policy: %s" % self.options.write_policy)
+
+        # Fail about unknown action modes
+        if self.options.action_mode not in ACTION_MODES:
+            raise ValueError("unknown action mode: %s" % self.options.action_mode)
+        if self.options.action_workers < 1:
+            raise ValueError("'action_workers' must be at least 1")
+
+        # Fail about crash storm limits that would drop everything
+        if self.options.storm_rate > 0 and self.options.storm_burst < 1:
+            raise ValueError("'storm_burst' must be at least 1")
+        if self.options.storm_rate > 0 and self.options.storm_interval < 1:
+            raise ValueError("'storm_interval' must be at least 1")
+
+        # Fail about unknown signature caches
+        if self.options.signature_cache not in SIGNATURE_CACHES:
+            raise ValueError("unknown signature cache: %s" % self.options.signature_cache)
+
+        # Fail about memory deduplication without a database file
+        if self.options.memory and self.options.memory_dedup and \
+                not sidecar_filename(self.options.database, '.chunks'):
+            raise ValueError("'memory_dedup' needs a DBM, crash log or SQLite database")
+
+        # Fail about invalid retention ages
+        if self.options.retention_max_age:
+            parse_duration(self.options.retention_max_age)
+
+        # Fail about unknown compression codecs
+        if self.options.compression != 'none':
+            get_codec(self.options.compression)
+
         # Warn about inconsistent use of pause and interactive
         if self.options.pause and self.options.interactive:
             print("Warning: the 'pause' option is ignored when 'interactive' is set.")
@@ -242,6 +282,9 @@ class CrashMonitor(object):
             if not self.options.autodetach:
                 self.debug.kill_all(bIgnoreExceptions=True)
 
+            # Store the crashes still queued for writing
+            self.eventHandler.close()
+
             # Log the time we finish this run
             if self.options.verbose:
                 self.logger.log_text("Crash logger stopped, %s" % time.ctime())
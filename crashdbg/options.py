@@ -38,6 +38,12 @@ class Options(object):
         self.interactive = False
         self.time_limit = 0
         self.echo = False
+        self.label_cache = None
+        self.action_mode = 'sync'
+        self.action_workers = 2
+        self.action_queue = 64
+        self.action_timeout = 0
+        self.action_ordered = False
         self.action_events = ['exception', 'output_string']
         self.crash_events = ['exception', 'output_string']
 
@@ -54,7 +60,29 @@ class Options(object):
         self.database = None
         self.duplicates = True
         self.firstchance = False
+        self.storm_rate = 0
+        self.storm_burst = 20
+        self.storm_sample = 0
+        self.storm_interval = 60
         self.memory = 0
+        self.memory_dedup = False
+        self.index = True
+        self.signature_cache = 'exact'
+        self.write_behind = False
+        self.write_queue = 64
+        self.write_policy = 'block'
+        self.db_batch_size = 1
+        self.db_flush_ms = 1000
+        self.compression = 'none'
+        self.retention_max_age = None
+        self.retention_max_count = 0
+        self.retention_max_mb = 0
+        self.retention_keep_per_signature = 0
+        self.retention_interval = 3600
+        self.compression_dict = None
+
+        # Report options
+        self.jobs = 1
 
     def read_config_file(self, config):
         """
@@ -135,8 +163,46 @@ class Options(object):
                         self.duplicates = _parse_boolean(value)
                     elif key == 'firstchance':
                         self.firstchance = _parse_boolean(value)
+                    elif key == 'storm_rate':
+                        self.storm_rate = float(value)
+                    elif key == 'storm_burst':
+                        self.storm_burst = int(value)
+                    elif key == 'storm_sample':
+                        self.storm_sample = int(value)
+                    elif key == 'storm_interval':
+                        self.storm_interval = int(value)
                     elif key == 'memory':
                         self.memory = int(value)
+                    elif key == 'memory_dedup':
+                        self.memory_dedup = _parse_boolean(value)
+                    elif key == 'index':
+                        self.index = _parse_boolean(value)
+                    elif key == 'signature_cache':
+                        self.signature_cache = value.strip().lower()
+                    elif key == 'write_behind':
+                        self.write_behind = _parse_boolean(value)
+                    elif key == 'write_queue':
+                        self.write_queue = int(value)
+                    elif key == 'write_policy':
+                        self.write_policy = value.strip().lower()
+                    elif key == 'db_batch_size':
+                        self.db_batch_size = int(value)
+                    elif key == 'db_flush_ms':
+                        self.db_flush_ms = int(value)
+                    elif key == 'retention_max_age':
+                        self.retention_max_age = value.strip()
+                    elif key == 'retention_max_count':
+                        self.retention_max_count = int(value)
+                    elif key == 'retention_max_mb':
+                        self.retention_max_mb = int(value)
+                    elif key == 'retention_keep_per_signature':
+                        self.retention_keep_per_signature = int(value)
+                    elif key == 'retention_interval':
+                        self.retention_interval = int(value)
+                    elif key == 'compression':
+                        self.compression = value.strip().lower()
+                    elif key == 'compression_dict':
+                        self.compression_dict = value
                     elif key == 'ignore_python_errors':
                         self.ignore_errors = _parse_boolean(value)
 
@@ -159,6 +225,18 @@ class Options(object):
                         self.time_limit = int(value)
                     elif key == 'echo':
                         self.echo = _parse_boolean(value)
+                    elif key == 'label_cache':
+                        self.label_cache = value
+                    elif key == 'action_mode':
+                        self.action_mode = value.strip().lower()
+                    elif key == 'action_workers':
+                        self.action_workers = int(value)
+                    elif key == 'action_queue':
+                        self.action_queue = int(value)
+                    elif key == 'action_timeout':
+                        self.action_timeout = int(value)
+                    elif key == 'action_ordered':
+                        self.action_ordered = _parse_boolean(value)
                     elif key == 'action_events':
                         self.action_events = _parse_list(value)
                     elif key == 'crash_events':
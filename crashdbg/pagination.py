@@ -0,0 +1,222 @@
+"""
+Paginated crash reports.
+
+Pages are taken from the database index when there is one, so showing the
+newest crashes only loads the crashes in the page. Cursors let a report
+resume right after the last crash of the previous page, even if crashes were
+added in the meantime.
+"""
+import base64
+import datetime
+import heapq
+import json
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from winappdbg import CrashContainer
+
+from .database import key_digest
+from .index import load_indexed_crash
+
+__all__ = [
+    'Page',
+    'encode_cursor',
+    'decode_cursor',
+    'get_page',
+]
+
+# Number of crashes per page when no limit is given.
+DEFAULT_PAGE_SIZE = 50
+
+# Number of crashes loaded at a time from SQL databases.
+SQL_BATCH_SIZE = 100
+
+
+class Page(object):
+    """
+    Which crashes to show in a report.
+
+    @type limit: int
+    @ivar limit: Maximum number of crashes.
+
+    @type offset: int
+    @ivar offset: Number of crashes to skip, after the cursor if any.
+
+    @type reverse: bool
+    @ivar reverse: C{True} to show the newest crashes first.
+
+    @type cursor: tuple(float, str, int)
+    @ivar cursor: Position of the last crash of the previous page,
+        as returned by L{decode_cursor}.
+    """
+
+    def __init__(self, limit=DEFAULT_PAGE_SIZE, offset=0, reverse=False, cursor=None):
+        self.limit = limit
+        self.offset = offset
+        self.reverse = reverse
+        self.cursor = cursor
+
+    def is_after_cursor(self, timeStamp, digest):
+        """
+        Determine if a crash comes after the cursor, in the page order.
+        """
+        if self.cursor is None:
+            return True
+        position = (timeStamp, digest)
+        if self.reverse:
+            return position < self.cursor[:2]
+        return position > self.cursor[:2]
+
+
+def encode_cursor(timeStamp, digest, id=None, reverse=False):
+    """
+    Build the opaque cursor token for the last crash of a page.
+    """
+    data = json.dumps([timeStamp, digest, id, bool(reverse)])
+    return base64.urlsafe_b64encode(data.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(token):
+    """
+    Parse a cursor token built by L{encode_cursor}.
+
+    @rtype:  tuple(tuple(float, str, int), bool)
+    @return: Cursor position, and whether it was built for a reverse listing.
+    """
+    try:
+        timeStamp, digest, id, reverse = json.loads(
+            base64.urlsafe_b64decode(str(token)).decode('ascii'))
+    except (TypeError, ValueError):
+        raise ValueError("invalid cursor: %s" % token)
+    return (timeStamp, digest, id), reverse
+
+
+def get_page(cc, page, index=None, query=None):
+    """
+    Load a page of crashes sorted by timestamp.
+
+    With an index only the crashes in the page are loaded. Without one the
+    whole container has to be walked, but only the crashes up to the end of
+    the page are kept in memory.
+
+    @rtype:  tuple(list of Crash, str)
+    @return: Crashes in the page, and the cursor token for the next page or
+        C{None} if this was the last one.
+    """
+    if index is not None:
+        return _get_indexed_page(cc, page, index, query)
+    return _get_scanned_page(cc, page, query)
+
+
+def _get_indexed_page(cc, page, index, query):
+    keyed = isinstance(cc, CrashContainer)
+    rows = index.page(query, page.limit, page.offset, page.reverse, page.cursor)
+    crashes = []
+    for timeStamp, digest, id, key in rows:
+        c = load_indexed_crash(cc, timeStamp, key, keyed)
+        if c is not None:
+            crashes.append(c)
+    next_cursor = None
+    if rows and len(rows) == page.limit:
+        timeStamp, digest, id, key = rows[-1]
+        next_cursor = encode_cursor(timeStamp, digest, id, page.reverse)
+    return crashes, next_cursor
+
+
+def _get_scanned_page(cc, page, query):
+    keyed = isinstance(cc, CrashContainer)
+    if not keyed and hasattr(cc, '_dao') and (query is None or query.is_empty()):
+        return _get_sql_page(cc, page)
+    crashes = _select_page(cc, page, query, keyed)
+    next_cursor = None
+    if crashes and len(crashes) == page.limit:
+        c = crashes[-1]
+        next_cursor = encode_cursor(c.timeStamp, key_digest(c.key()), None, page.reverse)
+    return crashes, next_cursor
+
+
+def _get_sql_page(cc, page):
+    """
+    Load a page from a SQL database, sorted by timestamp and row ID.
+
+    The database sorts by timestamp, and only the crashes from the second of
+    the cursor on are loaded. Some databases drop the fractional seconds, so
+    the crashes are sorted here too, after loading every crash in the same
+    second as the last one of the page.
+    """
+    order = -1 if page.reverse else 1
+    since = until = after = None
+    if page.cursor is not None:
+        timeStamp, digest, id = page.cursor
+        if id is None:
+            id = (1 << 62) if page.reverse else -1
+        after = (timeStamp, id)
+        if page.reverse:
+            until = datetime.datetime.fromtimestamp(int(timeStamp) + 1)
+        else:
+            since = datetime.datetime.fromtimestamp(int(timeStamp))
+    count = page.offset + page.limit
+    found = []
+    offset = 0
+    while 1:
+        batch = cc._dao.find(order=order, since=since, until=until,
+                             offset=offset, limit=SQL_BATCH_SIZE)
+        offset += len(batch)
+        for c in batch:
+            position = (c.timeStamp, c._rowid)
+            if after is None or (position < after if page.reverse else position > after):
+                found.append((position, c))
+        if len(batch) < SQL_BATCH_SIZE:
+            break
+        if len(found) >= count:
+            # Done once past the second of the last crash of the page.
+            found.sort(key=lambda item: item[0], reverse=page.reverse)
+            del found[count:]
+            if int(batch[-1].timeStamp) != int(found[-1][0][0]):
+                break
+    found.sort(key=lambda item: item[0], reverse=page.reverse)
+    crashes = [c for position, c in found[page.offset:count]]
+    next_cursor = None
+    if crashes and len(crashes) == page.limit:
+        c = crashes[-1]
+        next_cursor = encode_cursor(c.timeStamp, key_digest(c.key()), c._rowid, page.reverse)
+    return crashes, next_cursor
+
+
+def _select_page(cc, page, query, keyed):
+    """
+    Walk the container keeping only the crashes up to the end of the page.
+    """
+    records = _iter_page_records(cc, page, query, keyed)
+    count = page.offset + page.limit
+    if page.reverse:
+        records = heapq.nlargest(count, records)
+    else:
+        records = heapq.nsmallest(count, records)
+    crashes = []
+    for timeStamp, digest, index, payload in records[page.offset:]:
+        if keyed:
+            crashes.append(cc.get(payload))
+        else:
+            crashes.append(pickle.loads(payload))
+    return crashes
+
+
+def _iter_page_records(cc, page, query, keyed):
+    index = 0
+    for c in cc:
+        if query is not None and not query.matches(c):
+            continue
+        key = c.key()
+        digest = key_digest(key)
+        if not page.is_after_cursor(c.timeStamp, digest):
+            continue
+        if keyed:
+            payload = key
+        else:
+            payload = pickle.dumps(c, pickle.HIGHEST_PROTOCOL)
+        yield c.timeStamp, digest, index, payload
+        index += 1
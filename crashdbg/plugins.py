@@ -0,0 +1,164 @@
+"""
+Python action plugins.
+
+Actions of the form C{python:module.function argument} call a Python
+function in the crash monitor process, instead of starting a command. The
+function is imported once when the monitor starts, and called for each
+crash with the crash object, the action variables (C{COUNT}, C{EXCEPTION},
+C{WHERE} and so on, without the percent signs) and the argument, with its
+variables already replaced. The variables are computed the first time the
+function looks them up, so C{COUNT} is only counted by plugins using it::
+
+    def my_action(crash, variables, argument):
+        ...
+
+Functions without a module name are the built-in plugins of this module:
+
+    - C{append_jsonl filename}: append a JSON line describing the crash.
+    - C{send_socket [host:]port}: send the same JSON line to a TCP socket.
+    - C{touch_file filename}: create a file or update its timestamp.
+"""
+import functools
+import importlib
+import json
+import os
+import socket
+import threading
+
+from .actions import replace_variables
+from .database import key_digest
+
+__all__ = [
+    'ActionPlugin',
+    'load_action_plugins',
+    'append_jsonl',
+    'send_socket',
+    'touch_file',
+]
+
+# Prefix of the actions that are Python plugins.
+PLUGIN_PREFIX = 'python:'
+
+# Seconds to wait for the socket of send_socket.
+SOCKET_TIMEOUT = 5
+
+# Serializes the writes of append_jsonl from different worker threads.
+_appendLock = threading.Lock()
+
+
+class ActionPlugin(object):
+    """
+    Python function configured as an action, see the module documentation.
+    """
+
+    def __init__(self, function, argument=''):
+        self.function = function
+        self.argument = argument
+
+    @classmethod
+    def from_action(cls, action):
+        """
+        Import the function of a C{python:} action.
+
+        @rtype:  L{ActionPlugin} or None
+        @return: Plugin, or C{None} if the action is a command.
+
+        @raise ValueError: The function can't be found.
+        """
+        if not action.startswith(PLUGIN_PREFIX):
+            return None
+        parts = action[len(PLUGIN_PREFIX):].strip().split(None, 1)
+        if not parts:
+            raise ValueError("missing plugin function: %s" % action)
+        name = parts[0]
+        argument = parts[1] if len(parts) > 1 else ''
+        if '.' in name:
+            moduleName, functionName = name.rsplit('.', 1)
+            try:
+                module = importlib.import_module(moduleName)
+            except ImportError as e:
+                raise ValueError("can't import plugin %s: %s" % (name, e))
+            function = getattr(module, functionName, None)
+        else:
+            function = BUILTIN_PLUGINS.get(name)
+        if not callable(function):
+            raise ValueError("unknown plugin function: %s" % name)
+        return cls(function, argument)
+
+    def bind(self, crash, variables):
+        """
+        Prepare the call for a crash. The variables in the argument are
+        replaced now, so the call can be made later from another thread.
+
+        @rtype:  callable
+        @return: Function taking no arguments.
+        """
+        argument = replace_variables(self.argument, variables)
+        return functools.partial(self.function, crash, variables, argument)
+
+
+def load_action_plugins(actions):
+    """
+    Import the functions of the Python plugins in a list of actions.
+
+    @rtype:  dict(str S{->} L{ActionPlugin})
+    @return: Map of the C{python:} actions to their plugins.
+    """
+    plugins = dict()
+    for action in actions:
+        plugin = ActionPlugin.from_action(action)
+        if plugin is not None:
+            plugins[action] = plugin
+    return plugins
+
+
+def crash_record(crash, variables):
+    """
+    Describe a crash as a JSON line for the built-in plugins.
+    """
+    record = dict(variables)
+    record['timestamp'] = crash.timeStamp
+    record['signature'] = key_digest(crash.key())
+    return json.dumps(record, sort_keys=True) + '\n'
+
+
+def append_jsonl(crash, variables, filename):
+    """
+    Append a JSON line describing the crash to a file.
+    """
+    line = crash_record(crash, variables)
+    with _appendLock:
+        with open(filename, 'a') as fd:
+            fd.write(line)
+
+
+def send_socket(crash, variables, address):
+    """
+    Send a JSON line describing the crash to a TCP socket, by default on
+    the local host.
+    """
+    host, port = 'localhost', address.strip()
+    if ':' in port:
+        host, port = port.rsplit(':', 1)
+    sock = socket.create_connection((host, int(port)), SOCKET_TIMEOUT)
+    try:
+        sock.sendall(crash_record(crash, variables).encode('utf-8'))
+    finally:
+        sock.close()
+
+
+def touch_file(crash, variables, filename):
+    """
+    Create a file, or update its timestamp if it exists.
+    """
+    with open(filename, 'a'):
+        pass
+    os.utime(filename, None)
+
+
+# Built-in plugins, found by their name alone.
+BUILTIN_PLUGINS = {
+    'append_jsonl': append_jsonl,
+    'send_socket': send_socket,
+    'touch_file': touch_file,
+}
@@ -29,11 +29,46 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import heapq
+import multiprocessing
 import os
+import tempfile
 import time
+from collections import deque
+from multiprocessing.pool import ThreadPool
 
-from winappdbg import CrashContainer, CrashDictionary
-from .monitor import CrashMonitor
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from winappdbg import CrashContainer
+
+from .compression import dictionary_filename, load_dictionary, setup_compression
+from .database import open_crash_container, key_digest
+from .index import load_indexed_crash
+from .logstore import CrashLog
+from .options import Options
+from .sqlstore import CrashStore
+
+
+# Maximum number of sort records kept in memory before spilling a sorted run
+# to a temporary file. Keyed containers only keep (timestamp, key) pairs, so
+# this can be fairly large.
+SORT_RUN_SIZE = 50000
+
+# Maximum size in bytes of the pickled crashes kept in memory before spilling
+# a sorted run. Only used for containers that can't be indexed by crash key.
+SORT_RUN_BYTES = 64 * 1024 * 1024
+
+# Number of crashes handed to a report worker at a time.
+REPORT_CHUNK_SIZE = 64
+
+# Maximum number of databases connected to at the same time.
+MAX_OPEN_THREADS = 16
+
+# Crash container opened by each report worker process.
+_worker_container = None
 
 
 # def filter_duplicates(old_list):
@@ -56,25 +91,33 @@ from .monitor import CrashMonitor
 #     return new_list
 
 
-def open_database(filename):
+def open_database(filename, options=None):
     """
     Parse the configuration file to get the database URI.
+
+    If an options object is given, the database URI is copied into it so
+    report workers can open their own connections later.
     """
     print("Opening configuration file: %s" % filename)
-    cl = CrashMonitor(filename)
-    options = cl.parse_config()
+    config = Options().read_config_file(filename)
+    if options is not None:
+        options.database = config.database
+        options.compression_dict = dictionary_filename(config)
     # Open the database.
     try:
-        if not options.database:
+        if not config.database:
             print("Warning: no database configured here, ignored")
             return
-        elif options.database.startswith('dbm://'):
-            dbfile = options.database[6:]
-            print("Connecting to DBM database file: %s" % dbfile)
-            cc = CrashContainer(dbfile)
+        elif config.database.startswith('dbm://'):
+            print("Connecting to DBM database file: %s" % config.database[6:])
+        elif config.database.startswith('log://'):
+            print("Opening crash log: %s" % config.database[6:])
+        elif config.database.startswith('store://'):
+            print("Opening crash store: %s" % config.database[8:])
         else:
-            print("Connecting to database: %s" % options.database)
-            cc = CrashDictionary(options.database)
+            print("Connecting to database: %s" % config.database)
+        setup_compression(config)
+        cc = open_crash_container(config.database, readOnly=True)
     except Exception as e:
         print("Error connecting to the database: %s" % e)
         return
@@ -83,7 +126,27 @@ def open_database(filename):
     return cc
 
 
-def print_report_for_database(cc, options):
+def open_databases(filenames):
+    """
+    Open the databases for several configuration files concurrently.
+
+    Returns a list of (filename, crash container) tuples in the same order as
+    the filenames, skipping the ones that couldn't be opened.
+    """
+    filenames = list(filenames)
+    if not filenames:
+        return []
+    pool = ThreadPool(min(len(filenames), MAX_OPEN_THREADS))
+    try:
+        containers = pool.map(open_database, filenames)
+    finally:
+        pool.close()
+        pool.join()
+    return [(filename, cc) for (filename, cc) in zip(filenames, containers)
+            if cc is not None]
+
+
+def print_report_for_database(cc, options, cache=None, index=None):
     if cc is not None:
         count = cc.__len__()
         if not count:
@@ -91,26 +154,376 @@ def print_report_for_database(cc, options):
         else:
             print("Found %d crashes:" % count)
             print('-' * 79)
-            print_crash_report(cc, options)
-
-
-def print_crash_report(cc, options):
-    ccl = [(c.timeStamp, c) for c in cc]  # XXX may use a lot of memory
-    ccl.sort()  # XXX may be inaccurate if timestamps are repeated
-    for (timeStamp, c) in ccl:
-        local = time.localtime(timeStamp)
-        ldate = time.strftime("%x", local)
-        ltime = time.strftime("%X", local)
-        msecs = (c.timeStamp % 1) * 1000
-        msg = '%s %s.%04d' % (ldate, ltime, msecs)
-        print(msg)
-        if options.verbose:
-            report = c.fullReport()
+            print_crash_report(cc, options, cache, index)
+
+
+def print_merged_report(sources, options):
+    """
+    Print the crashes of several databases as a single listing sorted by
+    timestamp. Each crash is tagged with the configuration file it came from.
+
+    @type  sources: list of tuple(str, crash container)
+    @param sources: Tags and crash containers, as returned by L{open_databases}.
+    """
+    count = sum([len(cc) for (tag, cc) in sources])
+    if not count:
+        print("No crashes to report.")
+        return
+    print("Found %d crashes in %d databases:" % (count, len(sources)))
+    print('-' * 79)
+    for tag, c in iter_merged_crashes(sources):
+        print(format_crash_report(c, options.verbose, tag))
+
+
+def iter_merged_crashes(sources):
+    """
+    Merge the crashes of several containers sorted by timestamp.
+
+    Each container is sorted with L{iter_crashes_by_time} and merged with a
+    heap, so only one crash per container is loaded at any time. Crashes with
+    the same timestamp are sorted by container, then by container order.
+
+    @rtype:  iterator of tuple(str, Crash)
+    @return: Tags and crashes.
+    """
+    iterators = [_iter_tagged_crashes(index, tag, cc)
+                 for index, (tag, cc) in enumerate(sources)]
+    for timeStamp, index, order, tag, c in heapq.merge(*iterators):
+        yield tag, c
+
+
+def _iter_tagged_crashes(index, tag, cc):
+    """
+    Produce the heap entries for L{iter_merged_crashes}.
+    """
+    order = 0
+    for c in iter_crashes_by_time(cc):
+        yield c.timeStamp, index, order, tag, c
+        order += 1
+
+
+def print_crash_report(cc, options, cache=None, index=None):
+    """
+    Print the crashes sorted by timestamp, streaming one crash at a time.
+
+    When C{options.jobs} is greater than one the reports are rendered by a
+    pool of worker processes, but still printed in timestamp order.
+
+    Otherwise, previously rendered reports are read from the L{ReportCache}
+    if one is given. If the database index is given too, crashes are sorted
+    with the index and only loaded on cache misses.
+    """
+    if options.jobs > 1:
+        _print_crash_report_parallel(cc, options)
+    elif cache is not None and index is not None:
+        keyed = isinstance(cc, CrashContainer)
+        for timeStamp, key in index.query():
+            digest = key_digest(key)
+            text = cache.get(digest, timeStamp, options.verbose)
+            if text is None:
+                c = load_indexed_crash(cc, timeStamp, key, keyed)
+                if c is None:
+                    continue
+                text = format_crash_report(c, options.verbose)
+                cache.put(digest, timeStamp, options.verbose, text)
+            print(text)
+    else:
+        print_crashes(iter_crashes_by_time(cc), options, cache)
+
+
+def print_crashes(crashes, options, cache=None):
+    """
+    Print the given crashes in the order they come.
+
+    @rtype:  int
+    @return: Number of crashes printed.
+    """
+    count = 0
+    for c in crashes:
+        print(render_crash_report(c, options.verbose, cache))
+        count += 1
+    return count
+
+
+def render_crash_report(c, verbose=False, cache=None):
+    """
+    Render a single crash, going through the report cache if given.
+    """
+    if cache is None:
+        return format_crash_report(c, verbose)
+    digest = key_digest(c.key())
+    text = cache.get(digest, c.timeStamp, verbose)
+    if text is None:
+        text = format_crash_report(c, verbose)
+        cache.put(digest, c.timeStamp, verbose, text)
+    return text
+
+
+def _print_crash_report_parallel(cc, options, run_size=SORT_RUN_SIZE,
+                                 run_bytes=SORT_RUN_BYTES):
+    """
+    Render the crash reports in a pool of worker processes.
+
+    The workers open the database themselves and only get chunks of crash
+    keys, log entries, row IDs or query offsets, so the crashes are only
+    unpickled by them. Since the timestamps are only known after that, the
+    rendered reports are then sorted like L{iter_crashes_by_time} does, and
+    printed once every crash was rendered. At most two chunks per worker
+    are in flight, to keep memory usage bounded.
+    """
+    if not options.database:
+        raise ValueError("parallel reports need the database URL")
+    pool = multiprocessing.Pool(options.jobs, _init_report_worker,
+                                (options.database, options.compression_dict))
+    try:
+        records = _iter_rendered_records(pool, cc, options)
+        for timeStamp, tiebreak, index, text in \
+                external_sort(records, run_size, run_bytes):
+            print(text)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _iter_rendered_records(pool, cc, options):
+    """
+    Hand out the chunks of L{_iter_report_chunks} to the report workers,
+    and produce the sort records of the reports they render.
+    """
+    pending = deque()
+    for chunk in _iter_report_chunks(cc):
+        pending.append(pool.apply_async(_render_chunk, (chunk, options.verbose)))
+        if len(pending) >= options.jobs * 2:
+            for record in pending.popleft().get():
+                yield record
+    while pending:
+        for record in pending.popleft().get():
+            yield record
+
+
+def _iter_report_chunks(cc):
+    """
+    Split a container into chunks of references to its crashes, without
+    loading them. Each reference comes with the position of the crash in
+    the order the container is iterated, to break timestamp ties.
+
+    @rtype:  iterator of list of tuple(int, object)
+    @return: Chunks of positions and references.
+    """
+    if isinstance(cc, CrashContainer):
+        refs = enumerate(cc.iterkeys())
+    elif isinstance(cc, CrashLog):
+        refs = ((index, (segment, offset, length))
+                for index, (hash, timeStamp, segment, offset, length)
+                in enumerate(cc.iter_entries()))
+    elif isinstance(cc, CrashStore):
+        # Crash stores are iterated by row ID.
+        refs = ((id, id) for id, timeStamp, digest, length in cc.iter_entries())
+    else:
+        # SQL databases are iterated in pages, each worker loads one.
+        for offset in range(0, len(cc), REPORT_CHUNK_SIZE):
+            yield [(offset, offset)]
+        return
+    chunk = []
+    for ref in refs:
+        chunk.append(ref)
+        if len(chunk) >= REPORT_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _init_report_worker(url, dictionary=None):
+    """
+    Initialize a report worker process.
+    """
+    global _worker_container
+    if dictionary and os.path.exists(dictionary):
+        load_dictionary(dictionary)
+    _worker_container = open_crash_container(url, readOnly=True)
+
+
+def _load_chunk(cc, chunk):
+    """
+    Load the crashes of a chunk made by L{_iter_report_chunks}.
+
+    @rtype:  iterator of tuple(int, Crash)
+    @return: Positions and crashes.
+    """
+    for index, ref in chunk:
+        if isinstance(cc, CrashContainer):
+            try:
+                yield index, cc.get(ref)
+            except KeyError:
+                continue
+        elif isinstance(cc, CrashLog):
+            yield index, pickle.loads(bytes(cc.read_payload(*ref)))
+        elif isinstance(cc, CrashStore):
+            c = cc._load(ref)
+            if c is not None:
+                yield index, c
+        else:
+            found = cc._dao.find(offset=ref, limit=REPORT_CHUNK_SIZE)
+            for position, c in enumerate(found):
+                yield index + position, c
+
+
+def _render_chunk(chunk, verbose):
+    """
+    Render a chunk of crashes in a report worker process.
+
+    @rtype:  list of tuple(float, str, int, str)
+    @return: Sort records of the rendered reports.
+    """
+    return [(c.timeStamp, key_digest(c.key()), index, format_crash_report(c, verbose))
+            for index, c in _load_chunk(_worker_container, chunk)]
+
+
+def format_crash_report(c, verbose=False, tag=None):
+    """
+    Render a single crash as printed by L{print_crash_report}.
+    If given, the tag is printed before the timestamp.
+    """
+    local = time.localtime(c.timeStamp)
+    ldate = time.strftime("%x", local)
+    ltime = time.strftime("%X", local)
+    msecs = (c.timeStamp % 1) * 1000
+    msg = '%s %s.%04d' % (ldate, ltime, msecs)
+    if tag:
+        msg = '[%s] %s' % (tag, msg)
+    if verbose:
+        report = c.fullReport()
+    else:
+        report = c.briefReport() + '\n'
+    if isinstance(report, unicode):
+        report = report.encode('UTF8')  # XXX HORRIBLE HACK!
+    return '\n'.join((msg, report, '-' * 79))
+
+
+def iter_crashes_by_time(cc, run_size=SORT_RUN_SIZE, run_bytes=SORT_RUN_BYTES):
+    """
+    Iterate the crashes in the container sorted by timestamp.
+
+    Crashes are never held in memory all at once. The container is walked once
+    to collect the sort records, which are sorted with an external merge sort
+    backed by temporary files, and then each crash is loaded again just before
+    it's yielded.
+
+    Crashes with the same timestamp are sorted by their key digest, and then
+    by the order in which they were found in the container.
+    """
+    # Containers indexed by a unique key only need to remember the key.
+    # Others (i.e. SQL databases with repeated keys) have to spill the
+    # pickled crash instead, since fetching by key is ambiguous there.
+    if isinstance(cc, CrashContainer):
+        return sort_crashes_by_time(cc, cc, run_size, run_bytes)
+    return sort_crashes_by_time(cc, None, run_size, run_bytes)
+
+
+def sort_crashes_by_time(crashes, cc=None, run_size=SORT_RUN_SIZE,
+                         run_bytes=SORT_RUN_BYTES):
+    """
+    Sort any iterable of crashes by timestamp, using bounded memory.
+
+    If C{cc} is the keyed container the crashes came from, only their keys
+    are kept and each crash is loaded again from it. Otherwise the crashes
+    are kept pickled until they're yielded.
+    """
+    keyed = cc is not None
+    for payload in _iter_sorted_payloads(crashes, keyed, run_size, run_bytes):
+        if keyed:
+            yield cc.get(payload)
         else:
-            report = c.briefReport() + '\n'
-        if isinstance(report, unicode):
-            report = report.encode('UTF8')  # XXX HORRIBLE HACK!
-        print(report)
-        print('-' * 79)
+            yield pickle.loads(payload)
+
 
+def _iter_sorted_payloads(crashes, keyed, run_size=SORT_RUN_SIZE,
+                          run_bytes=SORT_RUN_BYTES):
+    """
+    Iterate the crash keys (or pickled crashes) sorted by timestamp.
+    """
+    records = _iter_sort_records(crashes, keyed)
+    for timeStamp, tiebreak, index, payload in \
+            external_sort(records, run_size, run_bytes):
+        yield payload
 
+
+def _iter_sort_records(crashes, keyed):
+    """
+    Walk the crashes and produce the records used to sort them.
+    """
+    index = 0
+    for c in crashes:
+        key = c.key()
+        tiebreak = key_digest(key)
+        if keyed:
+            payload = key
+        else:
+            payload = pickle.dumps(c, pickle.HIGHEST_PROTOCOL)
+        yield c.timeStamp, tiebreak, index, payload
+        index += 1
+
+
+def external_sort(records, run_size=SORT_RUN_SIZE, run_bytes=SORT_RUN_BYTES):
+    """
+    Sort the records using sorted runs on temporary files when they don't fit
+    in the given limits. Yields the records in order.
+    """
+    runs = []
+    try:
+        buffer = []
+        size = 0
+        for record in records:
+            buffer.append(record)
+            payload = record[-1]
+            if isinstance(payload, bytes):
+                size += len(payload)
+            if len(buffer) >= run_size or size >= run_bytes:
+                buffer.sort()
+                runs.append(_spill_run(buffer))
+                buffer = []
+                size = 0
+        buffer.sort()
+
+        # Everything fit in memory, no need to merge.
+        if not runs:
+            for record in buffer:
+                yield record
+            return
+
+        # Merge the sorted runs plus whatever is left in memory.
+        iterators = [_read_run(fd) for fd in runs]
+        iterators.append(iter(buffer))
+        for record in heapq.merge(*iterators):
+            yield record
+
+    finally:
+        for fd in runs:
+            fd.close()
+
+
+def _spill_run(records):
+    """
+    Write a sorted run into an anonymous temporary file.
+    """
+    fd = tempfile.TemporaryFile()
+    pickler = pickle.Pickler(fd, pickle.HIGHEST_PROTOCOL)
+    for record in records:
+        pickler.dump(record)
+        pickler.clear_memo()
+    fd.seek(0)
+    return fd
+
+
+def _read_run(fd):
+    """
+    Read back a sorted run written by L{_spill_run}.
+    """
+    while 1:
+        # Each record has its own memo, like when it was written. Protocol 4
+        # memoizes objects implicitly, so a shared memo would mix them up.
+        try:
+            yield pickle.load(fd)
+        except EOFError:
+            break
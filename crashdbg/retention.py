@@ -0,0 +1,397 @@
+"""
+Crash database retention and compaction.
+
+A retention policy decides which crashes to keep: the ones younger than a
+maximum age, up to a maximum number of crashes or bytes, and only the newest
+few of each signature. Expired crashes are removed from the database in
+small batches, so a running crash monitor only has to wait for one batch at
+a time. Compacting then gives the space they took back to the filesystem.
+"""
+import binascii
+import datetime
+import gc
+import os
+import re
+import sqlite3
+import threading
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from winappdbg import CrashContainer
+
+from .database import DbmCrashContainer, database_filename, key_digest
+from .index import TIME_UNITS
+from .logstore import CrashLog, compact_crash_log
+from .sqlstore import CrashStore
+
+__all__ = [
+    'RetentionPolicy',
+    'RetentionThread',
+    'parse_duration',
+    'prune_crashes',
+    'compact_database',
+]
+
+# Number of crashes removed while holding the database lock.
+PRUNE_BATCH_SIZE = 100
+
+# Free pages released at once from crash stores by the crash monitor.
+VACUUM_PAGES = 1000
+
+# Extensions of the files used by the different DBM modules.
+DBM_EXTENSIONS = ('', '.db', '.dat', '.dir', '.bak', '.pag')
+
+
+def parse_duration(value):
+    """
+    Parse a duration like "30m", "24h" or "7d", or a number of seconds.
+
+    @rtype:  float
+    @return: Duration in seconds.
+    """
+    value = value.strip()
+    match = re.match(r'^(\d+)([smhdw])$', value)
+    if match:
+        return float(int(match.group(1)) * TIME_UNITS[match.group(2)])
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError("invalid duration: %s" % value)
+
+
+class _NoLock(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class RetentionPolicy(object):
+    """
+    Which crashes to keep in a database.
+
+    @type max_age: float
+    @ivar max_age: Maximum age of the crashes in seconds, or C{None}.
+
+    @type max_count: int
+    @ivar max_count: Maximum number of crashes, or C{None}.
+
+    @type max_bytes: int
+    @ivar max_bytes: Maximum total size of the pickled crashes, or C{None}.
+
+    @type keep_per_signature: int
+    @ivar keep_per_signature: Maximum number of crashes with the same
+        signature, or C{None}.
+    """
+
+    def __init__(self, max_age=None, max_count=None, max_bytes=None, keep_per_signature=None):
+        self.max_age = max_age
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.keep_per_signature = keep_per_signature
+
+    @classmethod
+    def from_options(cls, options):
+        """
+        Build the retention policy set in the configuration file.
+        """
+        max_age = None
+        if options.retention_max_age:
+            max_age = parse_duration(options.retention_max_age)
+        max_bytes = None
+        if options.retention_max_mb:
+            max_bytes = options.retention_max_mb * 1024 * 1024
+        return cls(max_age, options.retention_max_count or None, max_bytes,
+                   options.retention_keep_per_signature or None)
+
+    def is_empty(self):
+        """
+        Determine if the policy keeps every crash.
+        """
+        return self.max_age is None and self.max_count is None and \
+            self.max_bytes is None and self.keep_per_signature is None
+
+    def select(self, entries, now=None):
+        """
+        Decide which crashes to remove.
+
+        @type  entries: list of tuple(float, str, int, object)
+        @param entries: Timestamp, key digest, size and reference of every
+            crash in the database.
+
+        @rtype:  tuple(list, set of str)
+        @return: Entries of the crashes to remove, and key digests of the
+            crashes to keep.
+        """
+        if now is None:
+            now = time.time()
+        expired = []
+        kept = set()
+        count = 0
+        size = 0
+        full = False
+        perSignature = dict()
+        for entry in sorted(entries, key=lambda entry: entry[0], reverse=True):
+            timeStamp, digest, length, ref = entry
+            if self.max_age is not None and timeStamp < now - self.max_age:
+                expired.append(entry)
+                continue
+            if self.keep_per_signature is not None:
+                seen = perSignature.get(digest, 0)
+                if seen >= self.keep_per_signature:
+                    expired.append(entry)
+                    continue
+                perSignature[digest] = seen + 1
+            if self.max_count is not None and count >= self.max_count:
+                expired.append(entry)
+                continue
+            if self.max_bytes is not None and (full or size + length > self.max_bytes):
+                # Older crashes go too, even if they would fit.
+                full = True
+                expired.append(entry)
+                continue
+            kept.add(digest)
+            count += 1
+            size += length
+        return expired, kept
+
+
+def iter_entries(cc, lock=None, sizes=True):
+    """
+    Iterate the crashes in a container for L{RetentionPolicy.select}.
+
+    Crashes are only unpickled for DBM and SQLAlchemy databases, to read
+    their timestamps. DBM sizes are those of the stored values. Other
+    databases don't tell the size of a crash, so it's only measured, by
+    pickling the crash again, if C{sizes} is C{True}; otherwise it's 0.
+    """
+    lock = lock or _NoLock()
+    if isinstance(cc, CrashContainer):
+        with lock:
+            keys = list(cc.iterkeys())
+        for key in keys:
+            with lock:
+                try:
+                    c = cc.get(key)
+                    length = 0
+                    if isinstance(cc, DbmCrashContainer):
+                        length = len(cc.raw_value(key))
+                    elif sizes:
+                        length = len(cc.marshall_value(c, storeMemoryMap=True))
+                except KeyError:
+                    continue
+            yield c.timeStamp, key_digest(key), length, key
+    elif isinstance(cc, CrashLog):
+        with lock:
+            entries = list(cc.iter_entries())
+        for hash, timeStamp, segment, offset, length in entries:
+            yield (timeStamp, binascii.hexlify(hash).decode('ascii'), length,
+                   (hash, segment, offset))
+    elif isinstance(cc, CrashStore):
+        with lock:
+            entries = list(cc.iter_entries())
+        for id, timeStamp, digest, length in entries:
+            yield timeStamp, digest, length, id
+    elif hasattr(cc, '_dao'):
+        offset = 0
+        while 1:
+            with lock:
+                found = cc._dao.find(order=1, offset=offset, limit=PRUNE_BATCH_SIZE)
+            if not found:
+                break
+            offset += len(found)
+            for c in found:
+                key = c.key()
+                length = 0
+                if sizes:
+                    length = len(pickle.dumps(c, pickle.HIGHEST_PROTOCOL))
+                yield c.timeStamp, key_digest(key), length, (key, c._rowid)
+    else:
+        raise TypeError("can't prune this kind of database")
+
+
+def delete_entries(cc, entries, index=None, chunks=None):
+    """
+    Remove the crashes of the given entries from a container, its index and
+    its chunk store.
+    """
+    if isinstance(cc, CrashStore):
+        cc.remove_ids([ref for timeStamp, digest, length, ref in entries], chunks)
+        return
+    if isinstance(cc, CrashLog):
+        if chunks is not None:
+            for timeStamp, digest, length, (hash, segment, offset) in entries:
+                chunks.release_crash(pickle.loads(cc.read_payload(segment, offset, length)))
+        cc.remove(ref for timeStamp, digest, length, ref in entries)
+    elif isinstance(cc, CrashContainer):
+        for timeStamp, digest, length, key in entries:
+            try:
+                # Only load the crash if its memory chunks must be released.
+                if chunks is not None:
+                    chunks.release_crash(cc.get(key))
+                del cc[key]
+            except KeyError:
+                continue
+    else:
+        for timeStamp, digest, length, (key, rowid) in entries:
+            # Some databases drop the fractional seconds, so a whole second is loaded.
+            since = datetime.datetime.fromtimestamp(int(timeStamp))
+            until = datetime.datetime.fromtimestamp(int(timeStamp) + 1)
+            for c in cc._dao.find(signature=key, since=since, until=until):
+                if c._rowid == rowid:
+                    cc._dao.delete(c)
+                    if chunks is not None:
+                        chunks.release_crash(c)
+    if index is not None:
+        for timeStamp, digest, length, ref in entries:
+            index.remove_crash(digest, timeStamp)
+        index.commit()
+
+
+def prune_crashes(cc, policy, index=None, chunks=None, lock=None, dry_run=False):
+    """
+    Remove the crashes a retention policy doesn't keep.
+
+    The database is scanned first and then the crashes are removed in
+    batches. If a lock is given it's held for each batch, and for each step
+    of the scan, but never for the whole thing.
+
+    @rtype:  tuple(int, set of str)
+    @return: Number of crashes removed, and key digests of the signatures
+        that are no longer in the database.
+    """
+    lock = lock or _NoLock()
+    entries = iter_entries(cc, lock, sizes=policy.max_bytes is not None)
+    expired, kept = policy.select(list(entries))
+    gone = set(digest for timeStamp, digest, length, ref in expired) - kept
+    if dry_run:
+        return len(expired), gone
+    for start in range(0, len(expired), PRUNE_BATCH_SIZE):
+        with lock:
+            delete_entries(cc, expired[start:start + PRUNE_BATCH_SIZE], index, chunks)
+    if expired and chunks is not None:
+        with lock:
+            chunks.prune()
+    return len(expired), gone
+
+
+def compact_database(url):
+    """
+    Give the space of removed crashes back to the filesystem.
+    The database must not be open, not even by this process.
+
+    DBM files and crash logs are rewritten, SQLite files are vacuumed.
+    Other databases are left as they are.
+
+    @rtype:  tuple(int, int) or None
+    @return: Size of the database before and after compacting, in bytes,
+        or C{None} if the database can't be compacted.
+    """
+    # DBM containers are only closed when destroyed.
+    gc.collect()
+    if url.startswith('dbm://'):
+        return _compact_dbm(url[6:])
+    if url.startswith('log://'):
+        return compact_crash_log(url[6:])
+    if url.startswith('store://') or url.startswith('sqlite:///'):
+        filename = database_filename(url)
+        before = os.path.getsize(filename)
+        db = sqlite3.connect(filename)
+        try:
+            db.execute("VACUUM")
+        finally:
+            db.close()
+        return before, os.path.getsize(filename)
+    return None
+
+
+def _dbm_files(path):
+    return [path + ext for ext in DBM_EXTENSIONS if os.path.isfile(path + ext)]
+
+
+def _compact_dbm(path):
+    """
+    Copy the crashes of a DBM file into a new one, and replace it.
+    The values are copied as they are, compressed or not.
+    """
+    before = sum(os.path.getsize(filename) for filename in _dbm_files(path))
+    temp = path + '.compact'
+    for filename in _dbm_files(temp):
+        os.unlink(filename)
+    old = DbmCrashContainer(path)
+    new = DbmCrashContainer(temp)
+    for key in old.iterkeys():
+        new.add_raw_value(key, old.raw_value(key))
+    # DBM containers are only closed when destroyed.
+    del old, new
+    gc.collect()
+    for filename in _dbm_files(path):
+        os.unlink(filename)
+    for filename in _dbm_files(temp):
+        os.rename(filename, path + filename[len(temp):])
+    return before, sum(os.path.getsize(filename) for filename in _dbm_files(path))
+
+
+class RetentionThread(object):
+    """
+    Applies a retention policy to the crash database of a running monitor,
+    every few seconds, from a background thread.
+
+    Crash stores are vacuumed a little after each pruning. DBM files and
+    crash logs keep the space of the removed crashes until they're rewritten
+    with "crashdbg compact", while the monitor is down.
+
+    @type onPrune: callable
+    @ivar onPrune: Called after removing crashes with the key digests of the
+        signatures no longer in the database.
+    """
+
+    def __init__(self, container, policy, interval, index=None, chunks=None,
+                 lock=None, logger=None, onPrune=None):
+        self.container = container
+        self.policy = policy
+        self.interval = interval
+        self.index = index
+        self.chunks = chunks
+        self.lock = lock
+        self.logger = logger
+        self.onPrune = onPrune
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='RetentionThread')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.prune()
+            except Exception:
+                if self.logger is not None:
+                    self.logger.log_exc()
+
+    def prune(self):
+        """
+        Apply the retention policy now.
+        """
+        count, gone = prune_crashes(self.container, self.policy, self.index,
+                                    self.chunks, self.lock)
+        if count:
+            if isinstance(self.container, CrashStore):
+                with self.lock or _NoLock():
+                    self.container.vacuum(VACUUM_PAGES)
+            if self.onPrune is not None:
+                self.onPrune(gone)
+            if self.logger is not None:
+                self.logger.log_text("Removed %d old crashes from the database" % count)
+
+    def close(self):
+        """
+        Stop the retention thread.
+        """
+        self.stopped.set()
+        self.thread.join()
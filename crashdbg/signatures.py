@@ -0,0 +1,167 @@
+"""
+In-memory set of the crash signatures in a database.
+
+When duplicates are not allowed, every crash event has to check if the crash
+is already in the database. With big databases that lookup gets slow, so the
+event handler keeps the signatures of the known crashes in memory instead.
+They are loaded from the database when the crash monitor starts, before the
+debugger runs, and kept up to date as crashes are added.
+
+For very big databases a Bloom filter can be used instead of the exact set.
+It takes a fixed amount of memory, and crashes it has never seen are known
+to be new without touching the database. The rest still have to be looked
+up, since Bloom filters have false positives.
+"""
+import binascii
+import hashlib
+import math
+
+from winappdbg import CrashContainer
+
+from .database import key_digest
+from .logstore import CrashLog
+from .sqlstore import CrashStore
+
+__all__ = [
+    'BloomFilter',
+    'SignatureSet',
+    'SIGNATURE_CACHES',
+]
+
+# Kinds of signature caches:
+#   exact - set of every signature
+#   bloom - Bloom filter, the database is checked on a hit
+#   none  - always look up the database
+SIGNATURE_CACHES = ('exact', 'bloom', 'none')
+
+# Minimum number of signatures the Bloom filter is sized for.
+BLOOM_MIN_CAPACITY = 1 << 20
+
+# Target false positive rate of the Bloom filter.
+BLOOM_ERROR_RATE = 0.01
+
+# Number of rows fetched at once when loading SQL databases.
+SQL_PAGE_SIZE = 500
+
+
+class BloomFilter(object):
+    """
+    Bloom filter of byte strings.
+    """
+
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        bits = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.size = max(bits, 8)
+        self.hashes = max(int(round(self.size * math.log(2) / capacity)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        # Double hashing, derived from a single SHA1 digest.
+        digest = hashlib.sha1(value).hexdigest()
+        h1 = int(digest[:16], 16)
+        h2 = int(digest[16:32], 16) | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, value):
+        for bit in self._positions(value):
+            self.bits[bit >> 3] |= 1 << (bit & 7)
+
+    def __contains__(self, value):
+        for bit in self._positions(value):
+            if not self.bits[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+
+def iter_key_hashes(cc):
+    """
+    Iterate the key hashes of every crash in a container, loading as little
+    of each crash as the container allows.
+    """
+    if isinstance(cc, CrashContainer):
+        for key in cc.iterkeys():
+            yield binascii.unhexlify(key_digest(key))
+    elif isinstance(cc, CrashLog):
+        for hash in cc.iter_key_hashes():
+            yield hash
+    elif isinstance(cc, CrashStore):
+        for digest, in cc.db.execute("SELECT DISTINCT digest FROM crashes"):
+            yield binascii.unhexlify(digest)
+    elif hasattr(cc, '_dao'):
+        offset = 0
+        while 1:
+            found = cc._dao.find(offset=offset, limit=SQL_PAGE_SIZE)
+            if not found:
+                break
+            offset += len(found)
+            for c in found:
+                yield binascii.unhexlify(key_digest(c.key()))
+    else:
+        for c in cc:
+            yield binascii.unhexlify(key_digest(c.key()))
+
+
+class SignatureSet(object):
+    """
+    Signatures of the crashes in a container, see the module documentation.
+
+    The signatures are loaded when the set is created, so create it before
+    the debugger starts. If the container is written to from another thread,
+    pass the lock that thread holds while writing, so the signatures aren't
+    loaded meanwhile.
+    """
+
+    def __init__(self, container, kind='exact', lock=None):
+        if kind not in SIGNATURE_CACHES or kind == 'none':
+            raise ValueError("unknown signature cache: %s" % kind)
+        self.container = container
+        self.kind = kind
+        self.lock = lock
+        self.signatures = None
+        if lock is not None:
+            with lock:
+                self._load()
+        else:
+            self._load()
+
+    def _load(self):
+        if self.kind == 'bloom':
+            capacity = max(len(self.container) * 2, BLOOM_MIN_CAPACITY)
+            self.signatures = BloomFilter(capacity)
+        else:
+            self.signatures = set()
+        for hash in iter_key_hashes(self.container):
+            self.signatures.add(hash)
+
+    def add(self, key):
+        """
+        Remember the signature of a crash just added to the container.
+        """
+        self.signatures.add(binascii.unhexlify(key_digest(key)))
+
+    def discard(self, digests):
+        """
+        Forget the signatures of crashes removed from the container.
+        Bloom filters can't forget, so they keep checking the container.
+
+        @type  digests: set of str
+        @param digests: Key digests, as returned by L{key_digest}.
+        """
+        if self.kind == 'exact':
+            self.signatures.difference_update(
+                binascii.unhexlify(digest) for digest in digests)
+
+    def check(self, key):
+        """
+        Determine if a crash signature is known.
+
+        @rtype:  bool or None
+        @return: C{True} or C{False} if known for sure, C{None} if the
+            container has to be checked.
+        """
+        if binascii.unhexlify(key_digest(key)) in self.signatures:
+            if self.kind == 'bloom':
+                return None
+            return True
+        return False
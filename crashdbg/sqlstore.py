@@ -0,0 +1,220 @@
+"""
+Native SQLite crash store, for C{store://} database URLs.
+
+SQLAlchemy databases keep each crash as an opaque pickled blob, so any
+query has to unpickle every row. The crash store keeps the searchable crash
+metadata in indexed columns instead, the same ones as the crash index (see
+L{CrashIndex}) plus the process ID and the configuration file. The pickled
+crashes live in a separate table and are only loaded when needed.
+
+The store is its own index, so reports can filter, page and summarize the
+crashes from the metadata alone. The database runs in WAL mode, so reports
+can read it while the crash monitor is writing to it.
+"""
+import os
+import sqlite3
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .database import key_digest
+from .index import CrashIndex, CrashQuery
+
+__all__ = [
+    'CrashStore',
+    'is_crash_store',
+]
+
+
+def crash_config(c):
+    """
+    Get the configuration file a crash was found with, from its notes.
+    """
+    for note in getattr(c, 'notes', None) or ():
+        if note.startswith('Config: '):
+            return note[8:]
+    return None
+
+
+def is_crash_store(filename):
+    """
+    Determine if an existing SQLite file is a crash store, so it can be
+    opened as such with a C{sqlite:///} URL. New files are left to
+    SQLAlchemy.
+    """
+    if not os.path.exists(filename) or not os.path.getsize(filename):
+        return False
+    db = sqlite3.connect(filename)
+    try:
+        tables = set(row[0] for row in db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"))
+    finally:
+        db.close()
+    return 'crash_bodies' in tables
+
+
+class CrashStore(CrashIndex):
+    """
+    Crash container backed by a SQLite file, see the module documentation.
+    """
+
+    schema = """
+        PRAGMA auto_vacuum = INCREMENTAL;
+        PRAGMA journal_mode = WAL;
+        PRAGMA synchronous = NORMAL;
+        CREATE TABLE IF NOT EXISTS crashes (
+            id INTEGER PRIMARY KEY,
+            digest TEXT NOT NULL,
+            key BLOB NOT NULL,
+            timestamp REAL NOT NULL,
+            event_code INTEGER,
+            event_name TEXT,
+            exception_code INTEGER,
+            exception_name TEXT,
+            module TEXT,
+            pc INTEGER,
+            label_pc TEXT,
+            pid INTEGER,
+            config TEXT
+        );
+        CREATE TABLE IF NOT EXISTS crash_bodies (
+            id INTEGER PRIMARY KEY,
+            data BLOB NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS crashes_timestamp ON crashes (timestamp, digest);
+        CREATE INDEX IF NOT EXISTS crashes_digest ON crashes (digest);
+        CREATE INDEX IF NOT EXISTS crashes_exception ON crashes (exception_code, timestamp);
+        CREATE INDEX IF NOT EXISTS crashes_module ON crashes (module, timestamp);
+        CREATE INDEX IF NOT EXISTS crashes_pc ON crashes (pc, timestamp);
+        CREATE INDEX IF NOT EXISTS crashes_pid ON crashes (pid, timestamp);
+    """
+
+    columns = CrashIndex.columns + ('pid', 'config')
+
+    def __init__(self, filename, allowRepeatedKeys=True):
+        super(CrashStore, self).__init__(filename, unique=not allowRepeatedKeys)
+
+    def _row(self, c, key, digest):
+        return super(CrashStore, self)._row(c, key, digest) + \
+            (getattr(c, 'pid', None), crash_config(c))
+
+    def _insert(self, c):
+        id = super(CrashStore, self)._insert(c)
+        if id is not None:
+            self.db.execute("INSERT INTO crash_bodies (id, data) VALUES (?, ?)",
+                            (id, sqlite3.Binary(pickle.dumps(c, pickle.HIGHEST_PROTOCOL))))
+        return id
+
+    def _load(self, id):
+        row = self.db.execute("SELECT data FROM crash_bodies WHERE id = ?", (id,)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(bytes(row[0]))
+
+    def __contains__(self, crash):
+        return self.db.execute("SELECT 1 FROM crashes WHERE digest = ?",
+                               (key_digest(crash.key()),)).fetchone() is not None
+
+    def __iter__(self):
+        return self.iter_crashes(order='id')
+
+    def add_many(self, crashes):
+        """
+        Add several crashes in a single transaction.
+        """
+        with self.db:
+            for c in crashes:
+                self._insert(c)
+
+    def get(self, key):
+        """
+        Get the first crash added with the given key.
+
+        @raise KeyError: No crash with that key is in the store.
+        """
+        row = self.db.execute("SELECT id FROM crashes WHERE digest = ? ORDER BY id LIMIT 1",
+                              (key_digest(key),)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self._load(row[0])
+
+    def find_crash(self, key, timeStamp):
+        """
+        Get the crash with the given key and timestamp.
+
+        @rtype:  Crash or None
+        @return: Crash, or C{None} if it's not in the store.
+        """
+        row = self.db.execute("SELECT id FROM crashes WHERE digest = ? AND timestamp = ?",
+                              (key_digest(key), timeStamp)).fetchone()
+        if row is None:
+            return None
+        return self._load(row[0])
+
+    def iter_crashes(self, query=None, order='timestamp, digest, id'):
+        """
+        Load the crashes matching a query, sorted by timestamp.
+        """
+        where, params = (query or CrashQuery()).where()
+        cursor = self.db.cursor()
+        cursor.execute(
+            "SELECT data FROM crashes JOIN crash_bodies USING (id) WHERE %s"
+            " ORDER BY %s" % (where, order), params)
+        for row in cursor:
+            yield pickle.loads(bytes(row[0]))
+
+    def remove_key(self, key):
+        """
+        Remove every crash with the given key.
+        """
+        with self.db:
+            self.db.execute("DELETE FROM crash_bodies WHERE id IN"
+                            " (SELECT id FROM crashes WHERE digest = ?)", (key_digest(key),))
+            self.db.execute("DELETE FROM crashes WHERE digest = ?", (key_digest(key),))
+
+    def iter_entries(self):
+        """
+        Iterate the crashes in the store without loading them.
+
+        @rtype:  iterator of tuple(int, float, str, int)
+        @return: Row ID, timestamp, key digest and size of the pickled crash.
+        """
+        return iter(self.db.execute(
+            "SELECT id, timestamp, digest, LENGTH(data) FROM crashes"
+            " JOIN crash_bodies USING (id)").fetchall())
+
+    def remove_ids(self, ids, chunks=None):
+        """
+        Remove crashes given their row IDs.
+
+        @type  chunks: L{ChunkStore}
+        @param chunks: Chunk store to release the memory snapshots of the
+            removed crashes from, if any.
+        """
+        ids = [(id,) for id in ids]
+        if chunks is not None:
+            for id, in ids:
+                c = self._load(id)
+                if c is not None:
+                    chunks.release_crash(c)
+        with self.db:
+            self.db.executemany("DELETE FROM crash_bodies WHERE id = ?", ids)
+            self.db.executemany("DELETE FROM crashes WHERE id = ?", ids)
+
+    def vacuum(self, pages=None):
+        """
+        Give the space of removed crashes back to the filesystem.
+
+        Without a number of pages the whole database is rewritten, which
+        blocks writers for a while. Otherwise up to that many free pages are
+        released, which only works on databases created with this version.
+        """
+        if pages is None:
+            self.db.execute("VACUUM")
+        else:
+            self.db.execute("PRAGMA incremental_vacuum(%d)" % int(pages)).fetchall()
+
+    def rebuild(self, cc):
+        raise TypeError("the crash store is its own index")
@@ -0,0 +1,195 @@
+"""
+Rate limiting of crash storms.
+
+Some targets raise the same exception over and over, thousands of times per
+second with first chance exceptions enabled. Capturing each one (building
+the crash, fetching its extra data, logging the report and storing it)
+slows the debugee to a crawl and fills up the database with duplicates.
+
+The storm limiter keeps a token bucket for each event signature: events are
+captured while their bucket has tokens, and the bucket refills at a fixed
+rate. Events arriving faster than that are only counted, except for one of
+every so many, which is still captured as a sample. The counts are reported
+periodically as a single aggregate record per signature, from a background
+thread, so the last ones show up even if the events stop. Once the events
+slow down the bucket refills, and every event is captured again.
+
+The signature here is computed from the debug event alone, without building
+the crash: the event code, plus the exception code and address for
+exceptions. It's coarser than the crash signature, which also looks at the
+stack trace, but it costs nothing to compute.
+"""
+import threading
+import time
+
+__all__ = [
+    'StormLimiter',
+    'StormRecord',
+    'StormThread',
+]
+
+# Seconds between aggregate records of suppressed events.
+STORM_INTERVAL = 60
+
+
+class StormRecord(object):
+    """
+    Aggregate record of the events of a signature that weren't captured.
+
+    @type description: str
+    @ivar description: Human readable description of the events.
+
+    @type suppressed: int
+    @ivar suppressed: Number of events only counted.
+
+    @type sampled: int
+    @ivar sampled: Number of events captured as samples while rate limited.
+
+    @type first: float
+    @ivar first: Timestamp of the first suppressed event.
+
+    @type last: float
+    @ivar last: Timestamp of the last suppressed event.
+    """
+
+    def __init__(self, description, timestamp):
+        self.description = description
+        self.suppressed = 0
+        self.sampled = 0
+        self.first = timestamp
+        self.last = timestamp
+
+    def __str__(self):
+        return "suppressed %d occurrences of %s in %.1f seconds (%d sampled)" % (
+            self.suppressed, self.description, self.last - self.first, self.sampled)
+
+
+class StormLimiter(object):
+    """
+    Token bucket rate limiter of crash events, see the module documentation.
+    It can be flushed from another thread than the one checking the events.
+
+    @type rate: float
+    @ivar rate: Events of each signature captured per second, on average.
+
+    @type burst: int
+    @ivar burst: Events of each signature captured at once before limiting.
+
+    @type sample: int
+    @ivar sample: Capture one of every this many rate limited events, or 0
+        to capture none of them.
+
+    @type interval: int
+    @ivar interval: Seconds between aggregate records.
+    """
+
+    def __init__(self, rate, burst=20, sample=0, interval=STORM_INTERVAL):
+        self.rate = float(rate)
+        self.burst = max(burst, 1)
+        self.sample = sample
+        self.interval = interval
+        self.buckets = dict()   # signature -> [tokens, timestamp]
+        self.records = dict()   # signature -> StormRecord
+        self.lastFlush = time.time()
+        self.lock = threading.Lock()
+
+    def check(self, signature, describe, now=None):
+        """
+        Decide if an event must be captured, counting it otherwise.
+
+        @type  describe: callable
+        @param describe: Returns the description of the events for the
+            aggregate record. Only called the first time an event of this
+            signature is rate limited in each interval.
+
+        @rtype:  bool
+        @return: C{True} to capture the event, C{False} to drop it.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            return self._check(signature, describe, now)
+
+    def _check(self, signature, describe, now):
+        bucket = self.buckets.get(signature)
+        if bucket is None:
+            bucket = self.buckets[signature] = [float(self.burst), now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return True
+        record = self.records.get(signature)
+        if record is None:
+            record = self.records[signature] = StormRecord(describe(), now)
+        record.last = now
+        if self.sample and (record.suppressed + record.sampled + 1) % self.sample == 0:
+            record.sampled += 1
+            return True
+        record.suppressed += 1
+        return False
+
+    def is_due(self, now=None):
+        """
+        Determine if the aggregate records must be flushed.
+        """
+        if now is None:
+            now = time.time()
+        return now - self.lastFlush >= self.interval
+
+    def flush(self, now=None):
+        """
+        Take the aggregate records of the last interval, and forget the
+        signatures whose buckets are full again.
+
+        @rtype:  list of L{StormRecord}
+        @return: Aggregate records, oldest first.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            records = sorted(self.records.values(), key=lambda record: record.first)
+            self.records = dict()
+            for signature, (tokens, timestamp) in list(self.buckets.items()):
+                if tokens + (now - timestamp) * self.rate >= self.burst:
+                    del self.buckets[signature]
+            self.lastFlush = now
+        return records
+
+
+class StormThread(object):
+    """
+    Logs the aggregate records of a storm limiter every interval, from a
+    background thread.
+    """
+
+    def __init__(self, limiter, logger):
+        self.limiter = limiter
+        self.logger = logger
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='StormThread')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.limiter.interval):
+            try:
+                self.flush()
+            except Exception:
+                self.logger.log_exc()
+
+    def flush(self):
+        """
+        Log the aggregate records of the events dropped since the last time.
+        """
+        for record in self.limiter.flush():
+            self.logger.log_text("Crash storm: %s" % record)
+
+    def close(self):
+        """
+        Stop the thread and log the last aggregate records.
+        """
+        self.stopped.set()
+        self.thread.join()
+        self.flush()
@@ -0,0 +1,157 @@
+"""
+Crash summaries for triage.
+
+Crashes are counted per signature, exception code and faulting module in a
+single pass, without sorting or rendering any reports. When the database has
+an index the counts come straight from it and no crash is unpickled at all.
+"""
+import heapq
+import time
+
+from .database import key_digest
+from .index import crash_module
+
+__all__ = [
+    'CrashSummary',
+    'print_crash_summary',
+]
+
+
+class Bucket(object):
+    """
+    Aggregated crashes sharing the same signature, exception or module.
+    """
+    __slots__ = ('label', 'count', 'first', 'last')
+
+    def __init__(self, label, timeStamp):
+        self.label = label
+        self.count = 0
+        self.first = timeStamp
+        self.last = timeStamp
+
+    def add(self, timeStamp, count=1):
+        self.count += count
+        if timeStamp < self.first:
+            self.first = timeStamp
+        if timeStamp > self.last:
+            self.last = timeStamp
+
+
+class CrashSummary(object):
+    """
+    Crash counts per signature, exception code and faulting module.
+
+    @type total: int
+    @ivar total: Total number of crashes.
+
+    @type signatures: dict(str S{->} L{Bucket})
+    @ivar signatures: Buckets by crash key digest.
+
+    @type exceptions: dict(int S{->} L{Bucket})
+    @ivar exceptions: Buckets by exception code.
+
+    @type modules: dict(str S{->} L{Bucket})
+    @ivar modules: Buckets by faulting module.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.signatures = dict()
+        self.exceptions = dict()
+        self.modules = dict()
+
+    @staticmethod
+    def _add(buckets, key, label, timeStamp, count=1):
+        try:
+            bucket = buckets[key]
+        except KeyError:
+            bucket = buckets[key] = Bucket(label, timeStamp)
+        bucket.add(timeStamp, count)
+
+    def add(self, c):
+        """
+        Count a crash.
+        """
+        self.total += 1
+        timeStamp = c.timeStamp
+        self._add(self.signatures, key_digest(c.key()),
+                  _signature_label(c.exceptionName or c.eventName, c.labelPC, c.pc), timeStamp)
+        self._add(self.exceptions, c.exceptionCode,
+                  _exception_label(c.exceptionCode, c.exceptionName), timeStamp)
+        module = crash_module(c)
+        self._add(self.modules, module, module or '(unknown)', timeStamp)
+
+    @classmethod
+    def from_crashes(cls, crashes):
+        """
+        Summarize an iterable of crashes in a single pass.
+        """
+        summary = cls()
+        for c in crashes:
+            summary.add(c)
+        return summary
+
+    @classmethod
+    def from_index(cls, index, query=None):
+        """
+        Summarize the crashes in a L{CrashIndex} without loading them.
+        """
+        summary = cls()
+        for digest, count, first, last, name, label, pc in \
+                index.group_by('digest', query):
+            summary.total += count
+            bucket = Bucket(_signature_label(name, label, pc), first)
+            bucket.add(last, count)
+            summary.signatures[digest] = bucket
+        for code, count, first, last, name, label, pc in \
+                index.group_by('exception_code', query):
+            bucket = Bucket(_exception_label(code, name), first)
+            bucket.add(last, count)
+            summary.exceptions[code] = bucket
+        for module, count, first, last, name, label, pc in \
+                index.group_by('module', query):
+            bucket = Bucket(module or '(unknown)', first)
+            bucket.add(last, count)
+            summary.modules[module] = bucket
+        return summary
+
+    def top(self, buckets, count=10):
+        """
+        Get the buckets with the most crashes.
+        """
+        return heapq.nlargest(count, buckets.values(), key=lambda bucket: bucket.count)
+
+
+def _signature_label(name, label, pc):
+    where = label if label else ('0x%08x' % pc if pc is not None else '?')
+    return '%s at %s' % (name or 'Unknown', where)
+
+
+def _exception_label(code, name):
+    if code is None:
+        return 'Not an exception'
+    return '0x%08x %s' % (code, name or '')
+
+
+def _format_time(timeStamp):
+    return time.strftime("%x %X", time.localtime(timeStamp))
+
+
+def print_crash_summary(summary, top=10):
+    """
+    Print the top buckets of a crash summary.
+    """
+    if not summary.total:
+        print("No crashes to report.")
+        return
+    print("Found %d crashes, %d unique signatures." % (summary.total, len(summary.signatures)))
+    for title, buckets in (("signatures", summary.signatures),
+                           ("exception codes", summary.exceptions),
+                           ("modules", summary.modules)):
+        print('-' * 79)
+        print("Top %s:" % title)
+        print("%8s  %-17s  %-17s  %s" % ("count", "first seen", "last seen", title[:-1]))
+        for bucket in summary.top(buckets, top):
+            print("%8d  %-17s  %-17s  %s" % (bucket.count, _format_time(bucket.first),
+                                             _format_time(bucket.last), bucket.label))
+    print('-' * 79)
@@ -0,0 +1,239 @@
+"""
+Watermarks for incremental reports.
+
+A watermark remembers how far the previous report got in a database, so the
+next one only has to load the crashes added since then. It's stored as a JSON
+file next to the configuration file.
+
+Reports with different filters keep separate watermarks in the same file,
+since each one only moves past the crashes it actually reported.
+"""
+import binascii
+import copy
+import datetime
+import json
+import os
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from winappdbg import CrashContainer
+
+from .database import key_digest
+from .index import CrashQuery, load_indexed_crash
+from .logstore import CrashLog
+from .report import sort_crashes_by_time
+
+__all__ = [
+    'Watermark',
+    'iter_new_crashes',
+    'query_filters',
+]
+
+# Number of rows fetched at once from SQL databases.
+SQL_PAGE_SIZE = 500
+
+
+class Watermark(object):
+    """
+    Position of the last incremental report on a crash database.
+
+    @type timestamp: float
+    @ivar timestamp: Timestamp of the newest crash reported so far.
+
+    @type keys: set(str)
+    @ivar keys: Digests of the crash keys reported with that exact timestamp.
+
+    @type filters: str
+    @ivar filters: Filters of the reports this watermark is for, other than
+        the time range (see L{query_filters}).
+
+    @type others: dict(str S{->} dict)
+    @ivar others: Watermarks saved in the same file for other filters.
+    """
+
+    def __init__(self, filename, database=None, filters=''):
+        self.filename = filename
+        self.database = database
+        self.filters = filters
+        self.timestamp = None
+        self.keys = set()
+        self.others = dict()
+
+    @classmethod
+    def for_config(cls, config, database=None, query=None):
+        """
+        Load the watermark kept next to a configuration file, for the
+        reports filtered with the given query.
+        """
+        watermark = cls(config + '.watermark', database, query_filters(query))
+        watermark.load()
+        return watermark
+
+    def load(self):
+        """
+        Load the watermark file, if it exists.
+        A watermark saved for a different database is ignored.
+        """
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, 'r') as fd:
+            data = json.load(fd)
+        if self.database is not None and data.get('database') != self.database:
+            return
+        marks = data.get('marks', dict())
+        if 'timestamp' in data:
+            # Older watermark files only had one, for unfiltered reports.
+            marks.setdefault('', {'timestamp': data['timestamp'],
+                                  'keys': data.get('keys', [])})
+        mark = marks.pop(self.filters, dict())
+        self.timestamp = mark.get('timestamp')
+        self.keys = set(mark.get('keys', ()))
+        self.others = marks
+
+    def save(self):
+        """
+        Save the watermark file, replacing the old one.
+        """
+        marks = dict(self.others)
+        if self.timestamp is not None:
+            marks[self.filters] = {
+                'timestamp': self.timestamp,
+                'keys': sorted(self.keys),
+            }
+        data = {
+            'database': self.database,
+            'marks': marks,
+        }
+        tmpname = self.filename + '.tmp'
+        with open(tmpname, 'w') as fd:
+            json.dump(data, fd)
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(tmpname, self.filename)
+
+    def is_new(self, timeStamp, digest):
+        """
+        Determine if a crash comes after the watermark.
+        """
+        if self.timestamp is None or timeStamp > self.timestamp:
+            return True
+        return timeStamp == self.timestamp and digest not in self.keys
+
+    def advance(self, timeStamp, digest):
+        """
+        Move the watermark past a reported crash.
+        """
+        if self.timestamp is None or timeStamp > self.timestamp:
+            self.timestamp = timeStamp
+            self.keys = set([digest])
+        elif timeStamp == self.timestamp:
+            self.keys.add(digest)
+
+
+def query_filters(query):
+    """
+    Describe the filters of a report query other than its time range, to
+    tell apart the watermarks of differently filtered reports.
+
+    @rtype:  str
+    @return: Filters description, empty for unfiltered reports.
+    """
+    if query is None:
+        return ''
+    filters = []
+    for name in ('exception_code', 'module', 'pc', 'event'):
+        value = getattr(query, name)
+        if value is not None:
+            filters.append('%s=%s' % (name, value))
+    return ' '.join(filters)
+
+
+def iter_new_crashes(cc, watermark, query=None, index=None):
+    """
+    Iterate the crashes added after the watermark that match a query,
+    sorted by timestamp. The watermark is only advanced past the crashes
+    consumed, once the next one is requested, but it's not saved.
+
+    Crash stores, and containers with an up to date index, only load the
+    matching crashes from the watermark timestamp onwards. SQL databases
+    only fetch the rows from that timestamp onwards, and crash logs only
+    load the crashes their own index tells are new. DBM files without an
+    index have to be loaded entirely, so L{CrashIndex.update} should be
+    used to keep one for them.
+    """
+    query = copy.copy(query or CrashQuery())
+    if watermark.timestamp is not None and \
+            (query.since is None or query.since < watermark.timestamp):
+        query.since = watermark.timestamp
+    if index is cc:
+        # The crash store is its own index.
+        crashes = cc.iter_crashes(query)
+    elif index is not None:
+        crashes = _iter_new_indexed_crashes(cc, index, query, watermark)
+    elif isinstance(cc, CrashLog):
+        crashes = _iter_new_logged_crashes(cc, query, watermark)
+    else:
+        keyed = isinstance(cc, CrashContainer)
+        if hasattr(cc, '_dao'):
+            crashes = _iter_sql_crashes_since(cc, query.since)
+        else:
+            crashes = iter(cc)
+        crashes = (c for c in crashes if query.matches(c))
+        crashes = sort_crashes_by_time(crashes, cc if keyed else None)
+    for c in crashes:
+        digest = key_digest(c.key())
+        if watermark.is_new(c.timeStamp, digest):
+            yield c
+            watermark.advance(c.timeStamp, digest)
+
+
+def _iter_new_indexed_crashes(cc, index, query, watermark):
+    """
+    Load the crashes found in the index that come after the watermark.
+    """
+    keyed = isinstance(cc, CrashContainer)
+    for timeStamp, key in index.query(query):
+        if watermark.is_new(timeStamp, key_digest(key)):
+            c = load_indexed_crash(cc, timeStamp, key, keyed)
+            if c is not None:
+                yield c
+
+
+def _iter_new_logged_crashes(cc, query, watermark):
+    """
+    Load the crashes of a crash log that come after the watermark.
+    The log index has their timestamps, so older crashes aren't loaded.
+    """
+    entries = []
+    for hash, timeStamp, segment, offset, length in cc.iter_entries():
+        digest = binascii.hexlify(hash).decode('ascii')
+        if watermark.is_new(timeStamp, digest) and \
+                (query.since is None or timeStamp >= query.since) and \
+                (query.until is None or timeStamp <= query.until):
+            entries.append((timeStamp, digest, len(entries), segment, offset, length))
+    entries.sort()
+    for timeStamp, digest, order, segment, offset, length in entries:
+        c = pickle.loads(bytes(cc.read_payload(segment, offset, length)))
+        if query.matches(c):
+            yield c
+
+
+def _iter_sql_crashes_since(cc, timeStamp):
+    """
+    Load the crashes of a SQL database from the given timestamp onwards.
+    """
+    since = None
+    if timeStamp is not None:
+        # Some databases drop the fractional seconds, so round down.
+        since = datetime.datetime.fromtimestamp(int(timeStamp))
+    offset = 0
+    while 1:
+        found = cc._dao.find(since=since, order=1, offset=offset, limit=SQL_PAGE_SIZE)
+        if not found:
+            break
+        offset += len(found)
+        for c in found:
+            yield c
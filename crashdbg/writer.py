@@ -0,0 +1,154 @@
+"""
+Write-behind crash persistence.
+
+Storing a crash means pickling it and writing it into the database, which
+can take a while with big memory snapshots or remote SQL servers. The crash
+writer does that in a background thread, so the debugee only has to wait
+for the crash information to be captured.
+"""
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from .database import add_crashes
+
+__all__ = [
+    'CrashWriter',
+    'WRITE_POLICIES',
+]
+
+# What to do when the queue of crashes waiting to be written is full.
+#   block       - wait for the writer to catch up
+#   drop_oldest - discard the oldest crash in the queue
+WRITE_POLICIES = ('block', 'drop_oldest')
+
+# Maximum number of crashes written in a single batch.
+WRITE_BATCH_SIZE = 32
+
+
+class CrashWriter(object):
+    """
+    Stores crashes into a crash container from a background thread.
+
+    The writer can be used in place of the container for the operations the
+    event handler needs: C{add}, C{in} and C{len} take into account both the
+    crashes already stored and those still waiting in the queue.
+
+    Each batch of queued crashes is written into the container with
+    L{add_crashes}, in a single transaction if the container supports it.
+    The writer holds its lock while writing a batch. A lock can be given to
+    share it with other code using the same container.
+
+    @type dropped: int
+    @ivar dropped: Number of crashes discarded because the queue was full.
+    """
+
+    def __init__(self, container, index=None, logger=None, queue_size=64,
+                 policy='block', batch_size=WRITE_BATCH_SIZE, lock=None):
+        if policy not in WRITE_POLICIES:
+            raise ValueError("unknown write policy: %s" % policy)
+        self.container = container
+        self.index = index
+        self.logger = logger
+        self.policy = policy
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.queue = queue.Queue(queue_size)
+        self.lock = lock or threading.Lock()    # protects the container and index
+        self.pending = dict()            # key -> number of crashes not written yet
+        self.pendingLock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name='CrashWriter')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __contains__(self, crash):
+        with self.pendingLock:
+            if crash.key() in self.pending:
+                return True
+        with self.lock:
+            return crash in self.container
+
+    def __len__(self):
+        with self.lock:
+            count = len(self.container)
+            with self.pendingLock:
+                return count + sum(self.pending.values())
+
+    def add(self, crash):
+        """
+        Queue a crash to be stored.
+        """
+        self._mark_pending(crash.key(), 1)
+        if self.policy == 'block':
+            self.queue.put(crash)
+            return
+        while 1:
+            try:
+                self.queue.put_nowait(crash)
+                return
+            except queue.Full:
+                try:
+                    oldest = self.queue.get_nowait()
+                except queue.Empty:
+                    continue
+                self._mark_pending(oldest.key(), -1)
+                self.queue.task_done()
+                self.dropped += 1
+                if self.logger is not None:
+                    self.logger.log_text("Warning: crash queue full, dropped a crash")
+
+    def flush(self):
+        """
+        Wait until every queued crash is stored.
+        """
+        self.queue.join()
+
+    def close(self):
+        """
+        Store every queued crash and stop the writer thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def _mark_pending(self, key, delta):
+        with self.pendingLock:
+            count = self.pending.get(key, 0) + delta
+            if count > 0:
+                self.pending[key] = count
+            else:
+                self.pending.pop(key, None)
+
+    def _run(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if [crash for crash in batch if crash is None]:
+                running = False
+            try:
+                self._write([crash for crash in batch if crash is not None])
+            finally:
+                for crash in batch:
+                    self.queue.task_done()
+
+    def _write(self, batch):
+        if not batch:
+            return
+        with self.lock:
+            try:
+                add_crashes(self.container, batch)
+                if self.index is not None:
+                    self.index.add_many(batch)
+            except Exception:
+                if self.logger is not None:
+                    self.logger.log_exc()
+            finally:
+                for crash in batch:
+                    self._mark_pending(crash.key(), -1)
@@ -0,0 +1,55 @@
+"""
+Crash objects for the tests, with the attributes the stores index.
+"""
+from crashdbg.compression import CompressedCrash
+
+
+class SampleCrash(object):
+
+    def __init__(self, number, timeStamp=None):
+        label = 'module%d!function' % (number % 3)
+        self.timeStamp = 1500000000.0 + number if timeStamp is None else timeStamp
+        self.eventCode = 1
+        self.eventName = 'Exception event'
+        self.exceptionCode = 0xC0000005
+        self.exceptionName = 'EXCEPTION_ACCESS_VIOLATION'
+        self.labelPC = label
+        self.pc = 0x401000 + number
+        self.pid = 1000 + number
+        self.notes = ['Config: test.cfg']
+        self.memoryMap = None
+        # Shares the label string, like the signatures of real crashes.
+        self.signature = ('i386', self.eventCode, self.exceptionCode, label,
+                          ((label, self.pc), (label, self.pc + 16)), None)
+
+    def key(self):
+        return self.signature
+
+    def briefReport(self):
+        return '%s at %s' % (self.exceptionName, self.labelPC)
+
+    def fullReport(self):
+        return '%s\npid: %d\npc: %#x\n' % (self.briefReport(), self.pid, self.pc)
+
+
+class SampleRegion(object):
+    """
+    Memory region of a crash, with the attributes memory snapshots use.
+    """
+
+    def __init__(self, baseAddress, content):
+        self.BaseAddress = baseAddress
+        self.RegionSize = len(content)
+        self.content = content
+
+
+class SampleCompressedCrash(CompressedCrash):
+    """
+    Compressed crash with the attributes of a L{SampleCrash}.
+    """
+
+    def __init__(self, number, timeStamp=None):
+        self.__dict__.update(SampleCrash(number, timeStamp).__dict__)
+
+    def key(self):
+        return self.signature
@@ -0,0 +1,108 @@
+import threading
+import unittest
+
+from crashdbg.actions import ActionExecutor
+
+
+class SampleLogger(object):
+
+    def __init__(self):
+        self.lines = []
+
+    def log_text(self, text):
+        self.lines.append(text)
+
+    def log_exc(self):
+        self.lines.append('exception')
+
+
+class ActionExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ran = []
+        self.lock = threading.Lock()
+
+    def runner(self, command, timeout):
+        with self.lock:
+            self.ran.append(command)
+        # Commands named "slow" run for longer than the timeout.
+        return not (timeout and command.startswith('slow'))
+
+    def test_ordered(self):
+        executor = ActionExecutor(workers=4, queue_size=64, ordered=True, runner=self.runner)
+        try:
+            for i in range(20):
+                executor.submit(['first %d' % i, 'second %d' % i])
+        finally:
+            executor.close()
+        expected = []
+        for i in range(20):
+            expected.extend(['first %d' % i, 'second %d' % i])
+        self.assertEqual(self.ran, expected)
+
+    def test_commands_of_an_event_in_order(self):
+        executor = ActionExecutor(workers=4, queue_size=64, runner=self.runner)
+        try:
+            for i in range(20):
+                executor.submit(['first %d' % i, 'second %d' % i])
+        finally:
+            executor.close()
+        self.assertEqual(len(self.ran), 40)
+        for i in range(20):
+            self.assertTrue(self.ran.index('first %d' % i) < self.ran.index('second %d' % i))
+
+    def test_timeout(self):
+        logger = SampleLogger()
+        executor = ActionExecutor(workers=1, timeout=100, logger=logger, runner=self.runner)
+        try:
+            executor.submit(['slow 1', 'fast 1', 'slow 2'])
+            executor.flush()
+        finally:
+            executor.close()
+        # A killed command doesn't stop the commands after it.
+        self.assertEqual(self.ran, ['slow 1', 'fast 1', 'slow 2'])
+        self.assertEqual(executor.killed, 2)
+        self.assertEqual(len(logger.lines), 2)
+
+    def test_no_timeout(self):
+        executor = ActionExecutor(workers=1, runner=self.runner)
+        try:
+            executor.submit(['slow 1'])
+        finally:
+            executor.close()
+        self.assertEqual(executor.killed, 0)
+
+    def test_plugins(self):
+        def failing():
+            raise ValueError()
+        logger = SampleLogger()
+        executor = ActionExecutor(workers=1, logger=logger, runner=self.runner)
+        try:
+            executor.submit([lambda: self.ran.append('plugin'), failing, 'command'])
+        finally:
+            executor.close()
+        self.assertEqual(self.ran, ['plugin', 'command'])
+        self.assertEqual(logger.lines, ['exception'])
+
+    def test_queue_full(self):
+        release = threading.Event()
+        executor = ActionExecutor(workers=1, queue_size=1, runner=self.runner)
+        try:
+            started = threading.Event()
+
+            def blocking():
+                started.set()
+                release.wait()
+            executor.submit([blocking])
+            started.wait()
+            executor.submit(['queued'])
+            executor.submit(['dropped'])
+            self.assertEqual(executor.dropped, 1)
+        finally:
+            release.set()
+            executor.close()
+        self.assertEqual(self.ran, ['queued'])
+
+
+if __name__ == '__main__':
+    unittest.main()
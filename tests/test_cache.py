@@ -0,0 +1,65 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from crashdbg.cache import ReportCache
+
+# Running as root, every file can be written to.
+IS_ROOT = getattr(os, 'geteuid', lambda: -1)() == 0
+
+
+class ReportCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = os.path.join(self.directory, 'crashes.db')
+        with open(self.database, 'wb'):
+            pass
+
+    def tearDown(self):
+        os.chmod(self.directory, stat.S_IRWXU)
+        shutil.rmtree(self.directory)
+
+    def test_evict_while_running(self):
+        cache = ReportCache(os.path.join(self.directory, 'crashes.db.cache'), max_bytes=1000)
+        try:
+            for i in range(50):
+                cache.put('%016x' % i, 1500000000.0 + i, False, b'x' * 100)
+                self.assertTrue(cache.size() <= 1000)
+            self.assertEqual(cache.size(), cache.bytes)
+            # The newest reports are kept.
+            self.assertEqual(cache.get('%016x' % 49, 1500000049.0, False), b'x' * 100)
+            self.assertEqual(cache.get('%016x' % 0, 1500000000.0, False), None)
+        finally:
+            cache.close()
+
+    def test_replace(self):
+        cache = ReportCache(os.path.join(self.directory, 'crashes.db.cache'), max_bytes=1000)
+        try:
+            for i in range(50):
+                cache.put('%016x' % 1, 1500000001.0, False, b'x' * (100 + i % 2))
+            self.assertEqual(cache.bytes, 101)
+            self.assertEqual(cache.size(), cache.bytes)
+        finally:
+            cache.close()
+
+    def test_for_database(self):
+        cache = ReportCache.for_database('store://' + self.database)
+        cache.close()
+        self.assertTrue(os.path.exists(self.database + '.cache'))
+        self.assertEqual(ReportCache.for_database('mysql://localhost/crashes'), None)
+
+    @unittest.skipIf(IS_ROOT, "root can write to read-only files")
+    def test_read_only_database(self):
+        os.chmod(self.database, stat.S_IRUSR)
+        self.assertEqual(ReportCache.for_database('store://' + self.database), None)
+        os.chmod(self.database, stat.S_IRUSR | stat.S_IWUSR)
+        os.chmod(self.directory, stat.S_IRUSR | stat.S_IXUSR)
+        self.assertEqual(ReportCache.for_database('store://' + self.database), None)
+        self.assertFalse(os.path.exists(self.database + '.cache'))
+
+
+if __name__ == '__main__':
+    unittest.main()
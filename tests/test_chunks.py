@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+
+from crashdbg.chunks import CHUNK_SIZE, ChunkStore, MemoryDeduplicator, load_crash_memory
+from crashdbg.compression import CompressedCrash, register_codec
+from crashdbg.logstore import CrashLog
+from crashdbg.sqlstore import CrashStore
+
+from .crashes import SampleCrash, SampleRegion
+
+# Contents of the memory snapshots, two chunks long.
+CONTENT = b'\x90' * CHUNK_SIZE + b'\xcc' * CHUNK_SIZE
+
+
+class ListContainer(object):
+
+    def __init__(self):
+        self.crashes = []
+
+    def add(self, crash):
+        self.crashes.append(crash)
+
+
+class FailingContainer(object):
+
+    def __contains__(self, crash):
+        return False
+
+    def add(self, crash):
+        raise IOError("disk full")
+
+
+class MemoryDeduplicatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.chunks = ChunkStore(os.path.join(self.directory, 'crashes.chunks'))
+
+    def tearDown(self):
+        self.chunks.close()
+        shutil.rmtree(self.directory)
+
+    def refs(self):
+        return sorted(row[0] for row in self.chunks.db.execute("SELECT refs FROM chunks"))
+
+    def sample_crash(self, number):
+        crash = SampleCrash(number)
+        crash.memoryMap = [SampleRegion(0x10000, CONTENT), SampleRegion(0x20000, b'')]
+        return crash
+
+    def test_live_crash_untouched(self):
+        store = CrashStore(os.path.join(self.directory, 'crashes.db'))
+        try:
+            crash = self.sample_crash(1)
+            MemoryDeduplicator(store, self.chunks).add(crash)
+            self.assertEqual(crash.memoryMap[0].content, CONTENT)
+            self.assertFalse(hasattr(crash, 'memoryChunks'))
+            stored = store.get(crash.key())
+            self.assertEqual(stored.memoryMap[0].content, None)
+            load_crash_memory(stored, self.chunks)
+            self.assertEqual(stored.memoryMap[0].content, CONTENT)
+        finally:
+            store.close()
+
+    def test_ignored_duplicates(self):
+        store = CrashStore(os.path.join(self.directory, 'crashes.db'), allowRepeatedKeys=False)
+        try:
+            dedup = MemoryDeduplicator(store, self.chunks)
+            dedup.add(self.sample_crash(1))
+            dedup.add(self.sample_crash(1))
+            self.assertEqual(len(store), 1)
+            self.assertEqual(self.refs(), [1, 1])
+        finally:
+            store.close()
+
+    def test_repeated_keys(self):
+        log = CrashLog(os.path.join(self.directory, 'crashes'))
+        try:
+            dedup = MemoryDeduplicator(log, self.chunks)
+            dedup.add(self.sample_crash(1))
+            dedup.add(self.sample_crash(1))
+            self.assertEqual(len(log), 2)
+            self.assertEqual(self.refs(), [2, 2])
+        finally:
+            log.close()
+
+    def test_no_compression(self):
+        calls = []
+
+        def compress(data):
+            calls.append(len(data))
+            return zlib.compress(data)
+        register_codec('counting', compress, zlib.decompress)
+        crash = object.__new__(CompressedCrash)
+        crash.__dict__.update(self.sample_crash(1).__dict__)
+        crash.codec = 'counting'
+        container = ListContainer()
+        MemoryDeduplicator(container, self.chunks).add(crash)
+        self.assertEqual(calls, [])
+        stored, = container.crashes
+        self.assertTrue(type(stored) is CompressedCrash)
+        self.assertEqual(stored.codec, 'counting')
+        self.assertEqual(stored.memoryMap[0].content, None)
+        self.assertEqual(crash.memoryMap[0].content, CONTENT)
+
+    def test_failed_add(self):
+        dedup = MemoryDeduplicator(FailingContainer(), self.chunks)
+        self.assertRaises(IOError, dedup.add, self.sample_crash(1))
+        self.assertEqual(self.refs(), [0, 0])
+        self.assertEqual(self.chunks.prune(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from winappdbg import CrashContainer
+
+from crashdbg.compression import CompressedCrash, zstandard
+from crashdbg.database import BinaryCrashContainer, DbmCrashContainer, open_crash_container
+from crashdbg.options import Options
+from crashdbg.retention import compact_database
+
+from .crashes import SampleCompressedCrash, SampleCrash
+
+
+class CompressedCrashTest(unittest.TestCase):
+
+    def tearDown(self):
+        CompressedCrash.codec = 'zlib'
+
+    def check_round_trip(self, codec):
+        CompressedCrash.codec = codec
+        crash = SampleCompressedCrash(1)
+        crash.notes = ['x' * 10000]
+        data = pickle.dumps(crash, pickle.HIGHEST_PROTOCOL)
+        self.assertTrue(len(data) < 10000)
+        loaded = pickle.loads(data)
+        self.assertTrue(type(loaded) is SampleCompressedCrash)
+        self.assertEqual(loaded.__dict__, crash.__dict__)
+
+    def test_zlib(self):
+        self.check_round_trip('zlib')
+
+    def test_bz2(self):
+        self.check_round_trip('bz2')
+
+    @unittest.skipIf(zstandard is None, "the zstandard module is not installed")
+    def test_zstd(self):
+        self.check_round_trip('zstd')
+
+    def test_off_by_default(self):
+        self.assertEqual(Options().compression, 'none')
+
+
+class DbmCompressionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'crashes.dbm')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, cls, crash):
+        cc = cls(self.path)
+        cc.add(crash)
+        del cc
+
+    def test_mixed_values(self):
+        self.write(CrashContainer, SampleCrash(1))
+        self.write(BinaryCrashContainer, SampleCompressedCrash(2))
+        cc = open_crash_container('dbm://' + self.path)
+        self.assertTrue(isinstance(cc, DbmCrashContainer))
+        plain = SampleCrash(1)
+        compressed = SampleCompressedCrash(2)
+        # Crashes that compress themselves aren't compressed again.
+        self.assertEqual(cc.raw_value(plain.key())[:1], b'x')
+        self.assertNotEqual(cc.raw_value(compressed.key())[:1], b'x')
+        self.assertEqual(cc.get(plain.key()).__dict__, plain.__dict__)
+        self.assertEqual(cc.get(compressed.key()).__dict__, compressed.__dict__)
+        del cc
+
+        # Compacting copies the values as they are.
+        compact_database('dbm://' + self.path)
+        cc = DbmCrashContainer(self.path)
+        self.assertEqual(len(cc), 2)
+        self.assertEqual(cc.raw_value(plain.key())[:1], b'x')
+        self.assertTrue(type(cc.get(compressed.key())) is SampleCompressedCrash)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import time
+import unittest
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from crashdbg.database import CrashBatcher, add_crashes, key_digest, key_encoding
+
+from .crashes import SampleCrash
+
+
+class BatchContainer(object):
+    """
+    Container that remembers the batches of crashes written into it.
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    def __contains__(self, crash):
+        return crash.pc - 0x401000 in [number for batch in self.batches for number in batch]
+
+    def __len__(self):
+        return sum(len(batch) for batch in self.batches)
+
+    def add_many(self, crashes):
+        self.batches.append([c.pc - 0x401000 for c in crashes])
+
+
+class KeyDigestTest(unittest.TestCase):
+
+    def setUp(self):
+        label = 'kernel32!CreateFileW'
+        self.key = ('i386', 1, 0xC0000005, label,
+                    ((label, 0x401000), (label, 0x402000), ('main!f', 5)),
+                    None, 1 << 40)
+
+    def test_pickle_round_trip(self):
+        digest = key_digest(self.key)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            key = pickle.loads(pickle.dumps(self.key, protocol))
+            self.assertEqual(key_digest(key), digest)
+            self.assertEqual(key_encoding(key), key_encoding(self.key))
+
+    def test_different_keys(self):
+        other = self.key[:-1] + ((1 << 40) + 1,)
+        self.assertNotEqual(key_digest(other), key_digest(self.key))
+        self.assertNotEqual(key_digest(('a', 'bc')), key_digest(('ab', 'c')))
+        self.assertNotEqual(key_digest((None,)), key_digest(('None',)))
+
+
+
+class CrashBatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.container = BatchContainer()
+
+    def test_full_batches(self):
+        batcher = CrashBatcher(self.container, batch_size=3, flush_ms=0)
+        for i in range(7):
+            batcher.add(SampleCrash(i))
+        self.assertEqual(self.container.batches, [[0, 1, 2], [3, 4, 5]])
+        # The crash waiting in the current batch counts too.
+        self.assertEqual(len(batcher), 7)
+        self.assertIn(SampleCrash(6), batcher)
+        self.assertNotIn(SampleCrash(7), batcher)
+        batcher.close()
+        self.assertEqual(self.container.batches, [[0, 1, 2], [3, 4, 5], [6]])
+        batcher.close()
+        self.assertEqual(len(self.container.batches), 3)
+
+    def test_flush_timer(self):
+        batcher = CrashBatcher(self.container, batch_size=100, flush_ms=10)
+        batcher.add(SampleCrash(0))
+        batcher.add(SampleCrash(1))
+        deadline = time.time() + 5
+        while not self.container.batches and time.time() < deadline:
+            time.sleep(0.005)
+        self.assertEqual(self.container.batches, [[0, 1]])
+        batcher.close()
+        self.assertEqual(self.container.batches, [[0, 1]])
+
+    def test_add_one_at_a_time(self):
+        added = []
+
+        class Container(object):
+            def add(self, crash):
+                added.append(crash.pc - 0x401000)
+        add_crashes(Container(), [SampleCrash(i) for i in range(3)])
+        self.assertEqual(added, [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
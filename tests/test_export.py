@@ -0,0 +1,59 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from crashdbg.export import EXPORT_FIELDS, open_exporter
+
+# Exported record of a crash, with made up values.
+RECORD = dict((field, i) for i, field in enumerate(EXPORT_FIELDS))
+
+
+class ExporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def export(self, fmt, filename, count):
+        exporter = open_exporter(fmt, filename)
+        try:
+            for i in range(count):
+                exporter.write(RECORD)
+        finally:
+            exporter.close()
+
+    def check_replaced(self, fmt, count_rows):
+        filename = os.path.join(self.directory, 'crashes.' + fmt)
+        self.export(fmt, filename, 3)
+        self.assertEqual(count_rows(filename), 3)
+        self.export(fmt, filename, 2)
+        self.assertEqual(count_rows(filename), 2)
+
+    def test_jsonl(self):
+        def count_rows(filename):
+            with open(filename) as fd:
+                return len(fd.readlines())
+        self.check_replaced('jsonl', count_rows)
+
+    def test_csv(self):
+        def count_rows(filename):
+            with open(filename) as fd:
+                return len(fd.readlines()) - 1
+        self.check_replaced('csv', count_rows)
+
+    def test_sqlite(self):
+        def count_rows(filename):
+            db = sqlite3.connect(filename)
+            try:
+                return db.execute("SELECT COUNT(*) FROM crashes").fetchone()[0]
+            finally:
+                db.close()
+        self.check_replaced('sqlite', count_rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import itertools
+import unittest
+
+from winappdbg import win32
+
+from crashdbg.handler import DEBUG_EVENT_METHODS, CrashEventHandler, EventFilter
+from crashdbg.labels import LabelCache
+from crashdbg.options import Options
+
+
+class SampleLogger(object):
+
+    def is_enabled(self):
+        return False
+
+
+class SampleDebugEvent(object):
+
+    def __init__(self, eventMethod, eventCode, lastChance=False):
+        self.eventMethod = eventMethod
+        self.eventCode = eventCode
+        self.lastChance = lastChance
+
+    def get_event_code(self):
+        return self.eventCode
+
+    def is_last_chance(self):
+        return self.lastChance
+
+
+def is_event_in_list(event, event_list, firstchance):
+    # The event check of the handler before event filters.
+    return \
+        ('event' in event_list) or ('exception' in event_list and
+                                    (event.get_event_code() == win32.EXCEPTION_DEBUG_EVENT and
+                                     (event.is_last_chance() or firstchance))) or \
+        (event.eventMethod in event_list)
+
+
+class SampleModule(object):
+
+    def __init__(self, filename, base, labels):
+        self.filename = filename
+        self.base = base
+        self.labels = labels
+
+    def get_filename(self):
+        return self.filename
+
+    def get_base(self):
+        return self.base
+
+    def match_name(self, name):
+        return name.lower() == 'mymod'
+
+    def resolve_label(self, label):
+        return self.labels.get(label)
+
+
+class SampleDebug(object):
+
+    def __init__(self):
+        self.breakpoints = []
+
+    def break_at(self, pid, address):
+        self.breakpoints.append(('break_at', pid, address))
+
+    def stalk_at(self, pid, address):
+        self.breakpoints.append(('stalk_at', pid, address))
+
+
+class SampleEvent(object):
+
+    def __init__(self, module, debug, pid=1234):
+        self.module = module
+        self.debug = debug
+        self.pid = pid
+
+    def get_module(self):
+        return self.module
+
+    def get_pid(self):
+        return self.pid
+
+
+class LabelBindingTest(unittest.TestCase):
+
+    def setUp(self):
+        options = Options()
+        options.break_at = ['mymod!func', '0x7ff00000!func', 'other!func']
+        options.stalk_at = ['mymod+0x10']
+        self.handler = CrashEventHandler(options)
+        self.handler.logger = SampleLogger()
+        self.handler.labelCache = LabelCache()
+
+    def tearDown(self):
+        self.handler.close()
+
+    def test_bind_labels(self):
+        self.assertEqual(sorted(self.handler.moduleLabels),
+                         ['mymod', 'other'])
+        self.assertEqual(self.handler.unboundLabels,
+                         [('0x7ff00000!func', 'break_at'), ('mymod+0x10', 'stalk_at')])
+
+    def test_address_labels(self):
+        # Labels naming the module by its base address are resolved
+        # by the debugger when any module is loaded.
+        debug = SampleDebug()
+        module = SampleModule(r'C:\test\mymod.dll', 0x7ff00000, {
+            'mymod!func': 0x7ff00100,
+            '0x7ff00000!func': 0x7ff00100,
+            'mymod+0x10': 0x7ff00010,
+        })
+        self.handler._set_breakpoints(SampleEvent(module, debug))
+        self.assertEqual(sorted(debug.breakpoints), [
+            ('break_at', 1234, 0x7ff00100),
+            ('break_at', 1234, 0x7ff00100),
+            ('stalk_at', 1234, 0x7ff00010),
+        ])
+        self.assertEqual(sorted(self.handler.labelsCache[1234]),
+                         ['0x7ff00000!func', 'mymod!func', 'mymod+0x10'])
+
+    def test_other_modules(self):
+        # Labels of other modules aren't resolved at all.
+        debug = SampleDebug()
+        module = SampleModule(r'C:\test\third.dll', 0x10000000, {})
+        self.handler._set_breakpoints(SampleEvent(module, debug))
+        self.assertEqual(debug.breakpoints, [])
+        self.assertEqual(self.handler.labelsCache[1234], {})
+
+
+
+class EventFilterTest(unittest.TestCase):
+
+    def events(self):
+        events = [SampleDebugEvent(method, 2) for method in DEBUG_EVENT_METHODS]
+        for method in ('access_violation', 'breakpoint'):
+            events.append(SampleDebugEvent(method, win32.EXCEPTION_DEBUG_EVENT, True))
+            events.append(SampleDebugEvent(method, win32.EXCEPTION_DEBUG_EVENT, False))
+        events.append(SampleDebugEvent('unknown_event', 9))
+        # Every event twice, to check the cached answers too.
+        return events + list(reversed(events))
+
+    def test_same_as_lists(self):
+        names = ['event', 'exception', 'create_thread', 'load_dll', 'access_violation']
+        for length in range(len(names) + 1):
+            for event_list in itertools.combinations(names, length):
+                for firstchance in (False, True):
+                    eventFilter = EventFilter(event_list, firstchance)
+                    for event in self.events():
+                        self.assertEqual(eventFilter.matches(event),
+                                         is_event_in_list(event, event_list, firstchance),
+                                         (event_list, firstchance, event.eventMethod,
+                                          event.lastChance))
+
+
+if __name__ == '__main__':
+    unittest.main()
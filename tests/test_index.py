@@ -0,0 +1,42 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from crashdbg.index import CrashQuery
+from crashdbg.sqlstore import CrashStore
+
+from .crashes import SampleCrash
+
+
+class ModuleQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = CrashStore(os.path.join(self.directory, 'crashes.db'))
+        self.crashes = [SampleCrash(i) for i in range(6)]
+        self.store.add_many(self.crashes)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def check(self, module):
+        query = CrashQuery.from_strings(module=module)
+        found = sorted(c.pc for c in self.store.iter_crashes(query))
+        matched = sorted(c.pc for c in self.crashes if query.matches(c))
+        self.assertEqual(found, [0x401001, 0x401004])
+        self.assertEqual(matched, found)
+
+    def test_module_name(self):
+        self.check('module1')
+
+    def test_module_filename(self):
+        self.check('Module1.DLL')
+
+    def test_module_path(self):
+        self.check(r'C:\Windows\System32\module1.dll')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from crashdbg.labels import LabelCache, label_module, read_export_table
+
+# Module base address of the test module.
+BASE = 0x10000000
+
+
+def build_pe(exports, forwarders=()):
+    """
+    Build a PE32 image with a single section holding an export table.
+
+    @type  exports: list of tuple(str, int)
+    @param exports: Function names and their RVAs, sorted by name.
+
+    @type  forwarders: list of tuple(str, str)
+    @param forwarders: Function names and the functions they forward to.
+    """
+    sectionRVA, sectionOffset, sectionSize = 0x1000, 0x200, 0x400
+    image = bytearray(sectionOffset + sectionSize)
+    image[0:2] = b'MZ'
+    struct.pack_into('<I', image, 0x3C, 0x40)
+    image[0x40:0x44] = b'PE\0\0'
+    optionalSize = 96 + 16 * 8
+    struct.pack_into('<HHIIIHH', image, 0x44, 0x14C, 1, 0, 0, 0, optionalSize, 0)
+    optional = 0x58
+    struct.pack_into('<H', image, optional, 0x10B)
+    struct.pack_into('<I', image, optional + 92, 16)
+    struct.pack_into('<II', image, optional + 96, sectionRVA, sectionSize)
+    struct.pack_into('<8sIIII', image, optional + optionalSize, b'.edata',
+                     sectionSize, sectionRVA, sectionSize, sectionOffset)
+
+    names = [name for name, rva in exports] + [name for name, target in forwarders]
+    count = len(names)
+    functionsRVA = sectionRVA + 40
+    namesRVA = functionsRVA + 4 * count
+    ordinalsRVA = namesRVA + 4 * count
+    stringsRVA = ordinalsRVA + 2 * count
+
+    def put_string(rva, text):
+        text = text.encode('ascii') + b'\0'
+        start = rva - sectionRVA + sectionOffset
+        image[start:start + len(text)] = text
+        return rva + len(text)
+
+    def put(fmt, rva, *values):
+        struct.pack_into(fmt, image, rva - sectionRVA + sectionOffset, *values)
+
+    # Base is 1, unlike NumberOfFunctions, to catch misplaced fields.
+    put('<IIHHIIIIIII', sectionRVA, 0, 0, 0, 0, 0, 1, count, count,
+        functionsRVA, namesRVA, ordinalsRVA)
+    targets = [target for name, target in exports]
+    rva = stringsRVA
+    for name, target in forwarders:
+        targets.append(rva)
+        rva = put_string(rva, target)
+    for i, name in enumerate(names):
+        put('<I', functionsRVA + 4 * i, targets[i])
+        put('<I', namesRVA + 4 * i, rva)
+        put('<H', ordinalsRVA + 2 * i, i)
+        rva = put_string(rva, name)
+    return bytes(image)
+
+
+class LabelModuleTest(unittest.TestCase):
+
+    def test_module_names(self):
+        self.assertEqual(label_module('kernel32!createfilew'), 'kernel32')
+        self.assertEqual(label_module(r'c:\windows\system32\kernel32.dll!createfilew'), 'kernel32')
+        self.assertEqual(label_module('createfilew'), None)
+
+    def test_base_addresses(self):
+        self.assertEqual(label_module('0x7ff00000!createfilew'), None)
+        self.assertEqual(label_module('7ff00000!createfilew+0x10'), None)
+
+
+class SampleModule(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.resolved = []
+
+    def get_filename(self):
+        return self.filename
+
+    def get_base(self):
+        return BASE
+
+    def match_name(self, name):
+        return name.lower() == 'kernel32'
+
+    def resolve_label(self, label):
+        self.resolved.append(label)
+        return None
+
+
+class ExportTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'kernel32.dll')
+        with open(self.filename, 'wb') as fd:
+            fd.write(build_pe([('CreateFileW', 0x2000), ('ReadFile', 0x2010)],
+                              [('HeapAlloc', 'NTDLL.RtlAllocateHeap')]))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_export_table(self):
+        self.assertEqual(read_export_table(self.filename),
+                         {'createfilew': 0x2000, 'readfile': 0x2010})
+
+    def test_resolve_mixed_case_exports(self):
+        # Labels from the config file are lowercase.
+        module = SampleModule(self.filename)
+        stats = dict()
+        addresses = LabelCache().resolve_many(
+            module, ['kernel32!createfilew', 'kernel32!ReadFile+0x10', 'kernel32!heapalloc'],
+            stats)
+        self.assertEqual(addresses, {'kernel32!createfilew': BASE + 0x2000,
+                                     'kernel32!ReadFile+0x10': BASE + 0x2020})
+        self.assertEqual(stats['exports'], 2)
+        self.assertEqual(module.resolved, ['kernel32!heapalloc'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from crashdbg.logstore import INDEX_ENTRY, INDEX_FILENAME, CrashLog
+
+from .crashes import SampleCrash
+
+
+class CrashLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'crashes')
+        self.crashes = [SampleCrash(i) for i in range(5)]
+        log = CrashLog(self.path)
+        for c in self.crashes:
+            log.add(c)
+        log.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lookup_by_stored_key(self):
+        log = CrashLog(self.path, readOnly=True)
+        try:
+            for stored in list(log):
+                key = stored.key()
+                self.assertEqual(log.get(key).timeStamp, stored.timeStamp)
+                self.assertIsNotNone(log.find_crash(key, stored.timeStamp))
+                self.assertIn(stored, log)
+            for c in self.crashes:
+                self.assertIn(c, log)
+        finally:
+            log.close()
+
+    def test_recovered_index(self):
+        # Lose the last two index entries, as if the writer died before
+        # writing them. They're rebuilt from the crashes in the segment.
+        filename = os.path.join(self.path, INDEX_FILENAME)
+        with open(filename, 'r+b') as fd:
+            fd.truncate(3 * INDEX_ENTRY.size)
+        log = CrashLog(self.path)
+        try:
+            self.assertEqual(len(log), 5)
+            for c in self.crashes:
+                self.assertIn(c, log)
+                self.assertIsNotNone(log.find_crash(c.key(), c.timeStamp))
+        finally:
+            log.close()
+
+    def test_remove(self):
+        log = CrashLog(self.path)
+        try:
+            entries = list(log.iter_entries())
+            removed = log.remove((hash, segment, offset)
+                                 for hash, timeStamp, segment, offset, length in entries[1:3])
+            self.assertEqual(removed, 2)
+            self.assertEqual(len(log), 3)
+            self.assertNotIn(self.crashes[1], log)
+            self.assertIn(self.crashes[3], log)
+            self.assertEqual(log.remove([entries[1][0:1] + entries[1][2:4]]), 0)
+        finally:
+            log.close()
+        log = CrashLog(self.path, readOnly=True)
+        try:
+            self.assertEqual(sorted(c.timeStamp for c in log),
+                             [self.crashes[i].timeStamp for i in (0, 3, 4)])
+        finally:
+            log.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
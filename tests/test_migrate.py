@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from crashdbg.database import DbmCrashContainer
+from crashdbg.logstore import CrashLog
+from crashdbg.migrate import MigrationCheckpoint, migrate_crashes
+from crashdbg.sqlstore import CrashStore
+
+from .crashes import SampleCrash
+
+
+class Interrupted(Exception):
+    pass
+
+
+class MigrateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.crashes = [SampleCrash(i) for i in range(25)]
+        self.checkpoint = MigrationCheckpoint(os.path.join(self.directory, 'test.cfg.migrate'),
+                                              'source', 'destination')
+        self.dst = CrashStore(os.path.join(self.directory, 'crashes.db'))
+        self.afters = []
+
+    def tearDown(self):
+        self.dst.close()
+        shutil.rmtree(self.directory)
+
+    def on_batch(self, position, after):
+        self.afters.append(after)
+        self.checkpoint.position = position
+        self.checkpoint.after = after
+        self.checkpoint.save()
+        if position == 20:
+            raise Interrupted()
+
+    def migrate(self, src):
+        self.assertRaises(Interrupted, migrate_crashes, src, self.dst, batch_size=10,
+                          onBatch=self.on_batch)
+        self.assertEqual(len(self.dst), 20)
+        # Lose the last batch of the checkpoint, as if the migration was
+        # interrupted before saving it.
+        self.checkpoint.position = 10
+        self.checkpoint.after = self.afters[0]
+        self.checkpoint.save()
+        checkpoint = MigrationCheckpoint(self.checkpoint.filename, 'source', 'destination')
+        checkpoint.load()
+        count = migrate_crashes(src, self.dst, checkpoint.position, batch_size=10,
+                                after=checkpoint.after)
+        self.assertEqual(count, 25)
+        self.assertEqual(sorted(c.timeStamp for c in self.dst),
+                         sorted(c.timeStamp for c in self.crashes))
+
+    def test_dbm(self):
+        src = DbmCrashContainer(os.path.join(self.directory, 'source.dbm'))
+        for c in self.crashes:
+            src.add(c)
+        self.migrate(src)
+        # Resumed after the last key of the first batch.
+        self.assertTrue(self.afters[0] < self.afters[1])
+
+    def test_crash_log(self):
+        src = CrashLog(os.path.join(self.directory, 'source'))
+        try:
+            for c in self.crashes:
+                src.add(c)
+            self.migrate(src)
+            self.assertEqual(self.afters, [None, None])
+        finally:
+            src.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
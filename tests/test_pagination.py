@@ -0,0 +1,123 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from crashdbg import pagination
+from crashdbg.logstore import CrashLog
+from crashdbg.pagination import Page, decode_cursor, get_page
+from crashdbg.sqlstore import CrashStore
+
+from .crashes import SampleCrash
+
+
+def sample_crashes(count):
+    # Pairs of crashes share a timestamp, and some share the second.
+    return [SampleCrash(i, 1500000000.0 + i // 4 + (i % 2) * 0.5) for i in range(count)]
+
+
+class SampleDao(object):
+    """
+    SQLAlchemy crash DAO that sorts by the whole second only, like databases
+    that drop the fractional seconds, and counts the crashes it loads.
+    """
+
+    def __init__(self, crashes):
+        self.crashes = crashes
+        for rowid, c in enumerate(crashes):
+            c._rowid = rowid + 1
+        self.loaded = 0
+
+    def find(self, signature=None, order=0, since=None, until=None, offset=None, limit=None):
+        found = []
+        for c in self.crashes:
+            timeStamp = datetime.datetime.fromtimestamp(int(c.timeStamp))
+            if (since is None or timeStamp >= since) and (until is None or timeStamp < until):
+                found.append(c)
+        # Crashes in the same second come in no particular order.
+        found.sort(key=lambda c: -c._rowid)
+        found.sort(key=lambda c: int(c.timeStamp), reverse=order < 0)
+        found = found[offset or 0:]
+        if limit:
+            found = found[:limit]
+        self.loaded += len(found)
+        return found
+
+
+class SampleCrashDictionary(object):
+
+    def __init__(self, crashes):
+        self._dao = SampleDao(crashes)
+
+    def __len__(self):
+        return len(self._dao.crashes)
+
+    def __iter__(self):
+        return iter(self._dao.crashes)
+
+
+class PaginationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.crashes = sample_crashes(40)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def page_through(self, cc, index=None, reverse=False, limit=7):
+        numbers = []
+        page = Page(limit, reverse=reverse)
+        while 1:
+            crashes, cursor = get_page(cc, page, index)
+            numbers.extend(c.pc - 0x401000 for c in crashes)
+            if cursor is None:
+                return numbers
+            page = Page(limit)
+            page.cursor, page.reverse = decode_cursor(cursor)
+
+    def check_pages(self, cc, index=None):
+        for reverse in (False, True):
+            numbers = self.page_through(cc, index, reverse)
+            self.assertEqual(numbers, self.page_through(cc, index, reverse, limit=100))
+            self.assertEqual(sorted(numbers), list(range(40)))
+            timeStamps = [self.crashes[i].timeStamp for i in numbers]
+            self.assertEqual(timeStamps, sorted(timeStamps, reverse=reverse))
+
+    def test_crash_store(self):
+        store = CrashStore(os.path.join(self.directory, 'crashes.db'))
+        try:
+            store.add_many(reversed(self.crashes))
+            self.check_pages(store, store)
+        finally:
+            store.close()
+
+    def test_crash_log(self):
+        log = CrashLog(os.path.join(self.directory, 'crashes'))
+        try:
+            for c in reversed(self.crashes):
+                log.add(c)
+            self.check_pages(log)
+        finally:
+            log.close()
+
+    def test_sql(self):
+        batch_size = pagination.SQL_BATCH_SIZE
+        pagination.SQL_BATCH_SIZE = 5
+        try:
+            cc = SampleCrashDictionary(self.crashes)
+            self.check_pages(cc)
+            # Pages after a cursor only load from the second of the cursor on.
+            page = Page(5)
+            page.cursor = (self.crashes[30].timeStamp, None, self.crashes[30]._rowid)
+            cc._dao.loaded = 0
+            crashes, cursor = get_page(cc, page)
+            self.assertEqual([c.pc - 0x401000 for c in crashes], [29, 31, 32, 34, 33])
+            self.assertTrue(cc._dao.loaded <= 15)
+        finally:
+            pagination.SQL_BATCH_SIZE = batch_size
+
+
+if __name__ == '__main__':
+    unittest.main()
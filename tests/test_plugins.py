@@ -0,0 +1,74 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from crashdbg.actions import ActionVariables
+from crashdbg.plugins import ActionPlugin, append_jsonl, load_action_plugins
+
+from .crashes import SampleCrash
+
+
+def sample_plugin(crash, variables, argument):
+    return crash, variables, argument
+
+
+class ActionPluginTest(unittest.TestCase):
+
+    def setUp(self):
+        self.looked_up = []
+
+    def variables(self):
+        def getter(name):
+            self.looked_up.append(name)
+            return name.lower()
+        return ActionVariables(getter)
+
+    def test_parse(self):
+        self.assertIsNone(ActionPlugin.from_action('notepad.exe %WHERE%'))
+        plugin = ActionPlugin.from_action('python:append_jsonl  crashes.jsonl')
+        self.assertIs(plugin.function, append_jsonl)
+        self.assertEqual(plugin.argument, 'crashes.jsonl')
+        plugin = ActionPlugin.from_action('python:tests.test_plugins.sample_plugin')
+        self.assertIs(plugin.function, sample_plugin)
+        self.assertEqual(plugin.argument, '')
+
+    def test_parse_errors(self):
+        for action in ('python:', 'python:no_such_plugin', 'python:tests.test_plugins.nothing',
+                       'python:no_such_module.function'):
+            self.assertRaises(ValueError, ActionPlugin.from_action, action)
+
+    def test_load(self):
+        actions = ['python:touch_file x', 'calc.exe', 'python:touch_file y']
+        self.assertEqual(sorted(load_action_plugins(actions)), ['python:touch_file x', 'python:touch_file y'])
+
+    def test_bind(self):
+        crash = SampleCrash(1)
+        plugin = ActionPlugin(sample_plugin, '%PC% at %WHERE%')
+        call = plugin.bind(crash, self.variables())
+        # Only the variables in the argument are computed.
+        self.assertEqual(sorted(self.looked_up), ['PC', 'WHERE'])
+        called, variables, argument = call()
+        self.assertIs(called, crash)
+        self.assertEqual(argument, 'pc at where')
+        self.assertEqual(variables['EVENT'], 'event')
+        self.assertNotIn('COUNT', self.looked_up)
+
+    def test_append_jsonl(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'crashes.jsonl')
+            plugin = ActionPlugin(append_jsonl, filename)
+            plugin.bind(SampleCrash(1), self.variables())()
+            plugin.bind(SampleCrash(2), self.variables())()
+            with open(filename) as fd:
+                records = [json.loads(line) for line in fd]
+            self.assertEqual([record['timestamp'] for record in records], [1500000001.0, 1500000002.0])
+            self.assertEqual(records[0]['COUNT'], 'count')
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from crashdbg.database import DbmCrashContainer, key_digest, open_crash_container
+from crashdbg.logstore import CrashLog
+from crashdbg.options import Options
+from crashdbg.report import _print_crash_report_parallel, iter_crashes_by_time, \
+    iter_merged_crashes, print_crash_report, sort_crashes_by_time
+from crashdbg.sqlstore import CrashStore
+
+from .crashes import SampleCrash
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+def capture(function, *args, **kwargs):
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        function(*args, **kwargs)
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+def sample_crashes(count):
+    # Every fifth crash shares the timestamp of the one before.
+    return [SampleCrash(i, 1500000000.0 + i - (i % 5 == 4)) for i in range(count)]
+
+
+class SortTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.crashes = sample_crashes(40)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def expected(self, crashes):
+        # By timestamp, then key digest, then container order.
+        order = sorted(range(len(crashes)), key=lambda i: (
+            crashes[i].timeStamp, key_digest(crashes[i].key()), i))
+        return [crashes[i].pc for i in order]
+
+    def test_keyed(self):
+        cc = DbmCrashContainer(os.path.join(self.directory, 'crashes.dbm'))
+        for c in reversed(self.crashes):
+            cc.add(c)
+        stored = list(cc)
+        # Small sorted runs, so most of them spill to temporary files.
+        sorted_crashes = list(iter_crashes_by_time(cc, run_size=7))
+        self.assertEqual([c.pc for c in sorted_crashes], self.expected(stored))
+
+    def test_unkeyed_ties(self):
+        # The same crash three times: only the container order tells them apart.
+        crashes = self.crashes + [SampleCrash(3, self.crashes[3].timeStamp) for i in range(3)]
+        for position, c in enumerate(crashes):
+            c.notes = ['position %d' % position]
+        sorted_crashes = list(sort_crashes_by_time(iter(crashes), run_bytes=1000))
+        self.assertEqual([c.pc for c in sorted_crashes], self.expected(crashes))
+        positions = [c.notes[0] for c in sorted_crashes if c.pc == crashes[3].pc]
+        self.assertEqual(positions, ['position 3', 'position 40', 'position 41', 'position 42'])
+
+
+class MergedReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_merge(self):
+        log = CrashLog(os.path.join(self.directory, 'crashes'))
+        store = CrashStore(os.path.join(self.directory, 'crashes.db'))
+        try:
+            for i in range(0, 20, 2):
+                log.add(SampleCrash(i))
+            store.add_many([SampleCrash(i) for i in range(19, 0, -2)])
+            # Same timestamp in both databases.
+            store.add(SampleCrash(4))
+            merged = list(iter_merged_crashes([('log', log), ('store', store), ('empty', [])]))
+            self.assertEqual([(tag, c.pc - 0x401000) for tag, c in merged][3:7],
+                             [('store', 3), ('log', 4), ('store', 4), ('store', 5)])
+            self.assertEqual([c.pc - 0x401000 for tag, c in merged],
+                             sorted(list(range(20)) + [4]))
+            self.assertEqual(set(tag for tag, c in merged if c.pc % 2), set(['store']))
+        finally:
+            store.close()
+            log.close()
+
+
+@unittest.skipIf(sys.version_info[0] >= 3, "reports are rendered for Python 2")
+class ParallelReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_parallel(self, url, verbose=False):
+        options = Options()
+        options.database = url
+        options.verbose = verbose
+        cc = open_crash_container(url, readOnly=True)
+        try:
+            serial = capture(print_crash_report, cc, options)
+            options.jobs = 3
+            # Small sorted runs, so some spill to temporary files.
+            parallel = capture(_print_crash_report_parallel, cc, options, run_size=50)
+        finally:
+            if hasattr(cc, 'close'):
+                cc.close()
+        self.assertEqual(serial.count('-' * 79), 150)
+        self.assertEqual(parallel, serial)
+
+    def test_dbm(self):
+        url = 'dbm://' + os.path.join(self.directory, 'crashes.dbm')
+        cc = open_crash_container(url)
+        for c in reversed(sample_crashes(150)):
+            cc.add(c)
+        del cc
+        self.check_parallel(url)
+
+    def test_crash_log(self):
+        url = 'log://' + os.path.join(self.directory, 'crashes')
+        log = CrashLog(url[6:])
+        try:
+            for c in sample_crashes(150):
+                log.add(c)
+        finally:
+            log.close()
+        self.check_parallel(url, verbose=True)
+
+    def test_crash_store(self):
+        url = 'store://' + os.path.join(self.directory, 'crashes.db')
+        store = CrashStore(url[8:])
+        try:
+            store.add_many(reversed(sample_crashes(150)))
+        finally:
+            store.close()
+        self.check_parallel(url)
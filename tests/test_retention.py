@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from crashdbg.database import DbmCrashContainer, key_digest
+from crashdbg.logstore import CrashLog
+from crashdbg.retention import RetentionPolicy, RetentionThread, iter_entries
+
+from .crashes import SampleCrash
+
+
+class RetentionPolicyTest(unittest.TestCase):
+
+    def entries(self):
+        # Timestamp, digest, size and reference, newest last.
+        return [(100.0 + i, 'sig%d' % (i % 2), 10, i) for i in range(6)]
+
+    def removed(self, policy, now=106.0):
+        expired, kept = policy.select(self.entries(), now)
+        return sorted(ref for timeStamp, digest, length, ref in expired), kept
+
+    def test_empty(self):
+        policy = RetentionPolicy()
+        self.assertTrue(policy.is_empty())
+        self.assertEqual(self.removed(policy), ([], set(['sig0', 'sig1'])))
+
+    def test_max_age(self):
+        self.assertEqual(self.removed(RetentionPolicy(max_age=3))[0], [0, 1, 2])
+
+    def test_max_count(self):
+        self.assertEqual(self.removed(RetentionPolicy(max_count=2))[0], [0, 1, 2, 3])
+
+    def test_max_bytes(self):
+        self.assertEqual(self.removed(RetentionPolicy(max_bytes=35))[0], [0, 1, 2])
+
+    def test_keep_per_signature(self):
+        removed, kept = self.removed(RetentionPolicy(keep_per_signature=1))
+        self.assertEqual(removed, [0, 1, 2, 3])
+        self.assertEqual(kept, set(['sig0', 'sig1']))
+
+    def test_signature_gone(self):
+        removed, kept = self.removed(RetentionPolicy(max_count=1))
+        self.assertEqual(kept, set(['sig1']))
+
+
+class OnlinePruneTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.crashes = [SampleCrash(i) for i in range(6)]
+        self.lock = threading.Lock()
+        self.gone = set()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def prune(self, cc, policy):
+        thread = RetentionThread(cc, policy, 3600, lock=self.lock,
+                                 onPrune=self.gone.update)
+        try:
+            thread.prune()
+        finally:
+            thread.close()
+
+    def test_dbm(self):
+        cc = DbmCrashContainer(os.path.join(self.directory, 'crashes.dbm'))
+        for c in self.crashes:
+            cc.add(c)
+        for timeStamp, digest, length, key in iter_entries(cc):
+            self.assertEqual(length, len(cc.raw_value(key)))
+        self.prune(cc, RetentionPolicy(max_count=2))
+        self.assertEqual(sorted(c.timeStamp for c in cc),
+                         [c.timeStamp for c in self.crashes[4:]])
+        self.assertEqual(len(cc), 2)
+        self.assertEqual(self.gone, set(key_digest(c.key()) for c in self.crashes[:4]))
+
+    def test_crash_log(self):
+        log = CrashLog(os.path.join(self.directory, 'crashes'))
+        try:
+            for c in self.crashes:
+                log.add(c)
+            self.prune(log, RetentionPolicy(max_count=2))
+            self.assertEqual(sorted(c.timeStamp for c in log),
+                             [c.timeStamp for c in self.crashes[4:]])
+            self.assertEqual(len(log), 2)
+            self.assertEqual(len(self.gone), 4)
+        finally:
+            log.close()
@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from crashdbg.database import key_digest, open_crash_container
+from crashdbg.signatures import SignatureSet
+
+from .crashes import SampleCrash
+
+
+class SignatureSetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_reopened(self, url):
+        # The signatures loaded from the database must match the keys of
+        # live crashes, or known crashes would count as new after a restart.
+        cc = open_crash_container(url)
+        for i in range(5):
+            cc.add(SampleCrash(i))
+        cc.close()
+        cc = open_crash_container(url)
+        try:
+            for kind in ('exact', 'bloom'):
+                signatures = SignatureSet(cc, kind)
+                for i in range(5):
+                    self.assertNotEqual(signatures.check(SampleCrash(i).key()), False)
+                self.assertEqual(signatures.check(SampleCrash(10).key()), False)
+            signatures.add(SampleCrash(10).key())
+            self.assertNotEqual(signatures.check(SampleCrash(10).key()), False)
+        finally:
+            cc.close()
+
+    def test_crash_log(self):
+        self.check_reopened('log://' + os.path.join(self.directory, 'crashes'))
+
+    def test_crash_store(self):
+        self.check_reopened('store://' + os.path.join(self.directory, 'crashes.db'))
+
+    def test_exact_discard(self):
+        url = 'store://' + os.path.join(self.directory, 'crashes.db')
+        cc = open_crash_container(url)
+        try:
+            key = SampleCrash(1).key()
+            cc.add(SampleCrash(1))
+            signatures = SignatureSet(cc)
+            self.assertTrue(signatures.check(key))
+            cc.remove_key(key)
+            signatures.discard(set([key_digest(key)]))
+            self.assertFalse(signatures.check(key))
+        finally:
+            cc.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
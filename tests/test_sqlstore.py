@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from crashdbg.database import open_crash_container
+from crashdbg.index import load_indexed_crash
+from crashdbg.pagination import Page, get_page
+from crashdbg.sqlstore import CrashStore, is_crash_store
+
+from .crashes import SampleCrash
+
+
+class CrashStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = CrashStore(os.path.join(self.directory, 'crashes.db'))
+        self.crashes = [SampleCrash(i) for i in range(5)]
+        self.store.add_many(self.crashes)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_lookup_by_stored_key(self):
+        # The keys come back from the key column, pickled and unpickled.
+        rows = list(self.store.query())
+        self.assertEqual(len(rows), 5)
+        for timeStamp, key in rows:
+            c = self.store.find_crash(key, timeStamp)
+            self.assertIsNotNone(c)
+            self.assertEqual(c.timeStamp, timeStamp)
+            self.assertIsNotNone(load_indexed_crash(self.store, timeStamp, key))
+            self.assertEqual(self.store.get(key).key(), key)
+
+    def test_contains(self):
+        for c in self.crashes:
+            self.assertIn(c, self.store)
+        self.assertNotIn(SampleCrash(10), self.store)
+
+    def test_page(self):
+        crashes, cursor = get_page(self.store, Page(5, 0, True), self.store)
+        self.assertEqual([c.timeStamp for c in crashes],
+                         sorted((c.timeStamp for c in self.crashes), reverse=True))
+
+
+class CrashStoreUrlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'crashes.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_store_url(self):
+        cc = open_crash_container('store://' + self.filename)
+        try:
+            self.assertIsInstance(cc, CrashStore)
+        finally:
+            cc.close()
+        # Existing crash stores can still be opened as SQLite databases.
+        cc = open_crash_container('sqlite:///' + self.filename)
+        try:
+            self.assertIsInstance(cc, CrashStore)
+        finally:
+            cc.close()
+
+    def test_new_sqlite_url(self):
+        self.assertFalse(is_crash_store(self.filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import threading
+import unittest
+
+from crashdbg.storm import StormLimiter, StormThread
+
+
+class SampleLogger(object):
+
+    def __init__(self):
+        self.lines = []
+        self.logged = threading.Event()
+
+    def log_text(self, text):
+        self.lines.append(text)
+        self.logged.set()
+
+    def log_exc(self):
+        raise
+
+
+class StormThreadTest(unittest.TestCase):
+
+    def test_flush_without_events(self):
+        limiter = StormLimiter(1, burst=1, interval=0.05)
+        logger = SampleLogger()
+        thread = StormThread(limiter, logger)
+        try:
+            for i in range(10):
+                limiter.check('signature', lambda: 'access violation at 0x1234', now=100.0)
+            # No more events come, the records are logged anyway.
+            self.assertTrue(logger.logged.wait(5))
+            self.assertEqual(len(logger.lines), 1)
+            self.assertTrue('suppressed 9 occurrences of access violation' in logger.lines[0])
+        finally:
+            thread.close()
+        self.assertEqual(len(logger.lines), 1)
+
+    def test_flush_on_close(self):
+        limiter = StormLimiter(1, burst=1, interval=3600)
+        logger = SampleLogger()
+        thread = StormThread(limiter, logger)
+        limiter.check('signature', lambda: 'breakpoint', now=100.0)
+        limiter.check('signature', lambda: 'breakpoint', now=100.0)
+        thread.close()
+        self.assertEqual(len(logger.lines), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
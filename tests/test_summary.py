@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from crashdbg.database import key_digest
+from crashdbg.sqlstore import CrashStore
+from crashdbg.summary import CrashSummary
+
+from .crashes import SampleCrash
+
+
+def sample_crashes():
+    crashes = [SampleCrash(i) for i in range(9)]
+    # The same crash twice more, later on.
+    crashes.append(SampleCrash(1, 1500000100.0))
+    crashes.append(SampleCrash(1, 1500000050.0))
+    for c in crashes[6:9]:
+        c.exceptionCode = 0x80000003
+        c.exceptionName = 'EXCEPTION_BREAKPOINT'
+    crashes[8].labelPC = None
+    return crashes
+
+
+class CrashSummaryTest(unittest.TestCase):
+
+    def check_summary(self, summary):
+        self.assertEqual(summary.total, 11)
+        self.assertEqual(len(summary.signatures), 9)
+        top = summary.top(summary.signatures, 1)[0]
+        self.assertEqual(top, summary.signatures[key_digest(SampleCrash(1).key())])
+        self.assertEqual((top.count, top.first, top.last), (3, 1500000001.0, 1500000100.0))
+        self.assertEqual(top.label, 'EXCEPTION_ACCESS_VIOLATION at module1!function')
+        self.assertEqual(dict((code, bucket.count) for code, bucket in summary.exceptions.items()),
+                         {0xC0000005: 8, 0x80000003: 3})
+        self.assertEqual(dict((module, bucket.count) for module, bucket in summary.modules.items()),
+                         {'module0': 3, 'module1': 5, 'module2': 2, None: 1})
+        self.assertEqual([bucket.label for bucket in summary.top(summary.modules, 2)],
+                         ['module1', 'module0'])
+        self.assertEqual(summary.modules[None].label, '(unknown)')
+
+    def test_from_crashes(self):
+        self.check_summary(CrashSummary.from_crashes(sample_crashes()))
+
+    def test_from_index(self):
+        directory = tempfile.mkdtemp()
+        try:
+            store = CrashStore(os.path.join(directory, 'crashes.db'))
+            try:
+                store.add_many(sample_crashes())
+                self.check_summary(CrashSummary.from_index(store))
+            finally:
+                store.close()
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from crashdbg.database import DbmCrashContainer
+from crashdbg.index import CrashIndex, CrashQuery
+from crashdbg.logstore import CrashLog
+from crashdbg.sqlstore import CrashStore
+from crashdbg.watermark import Watermark, iter_new_crashes
+
+from .crashes import SampleCrash
+
+
+class WatermarkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = os.path.join(self.directory, 'test.cfg')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def report(self, cc, module=None, index=None):
+        query = CrashQuery.from_strings(module=module)
+        watermark = Watermark.for_config(self.config, 'test', query)
+        numbers = [c.pc - 0x401000 for c in iter_new_crashes(cc, watermark, query, index)]
+        watermark.save()
+        return numbers
+
+    def check_reports(self, cc, add, index=None):
+        add([SampleCrash(i) for i in range(6)])
+        self.assertEqual(self.report(cc, 'module1', index), [1, 4])
+        self.assertEqual(self.report(cc, 'module1', index), [])
+        # The crashes the filtered report skipped are still new for others.
+        self.assertEqual(self.report(cc, None, index), [0, 1, 2, 3, 4, 5])
+        self.assertEqual(self.report(cc, 'module2', index), [2, 5])
+        # Same timestamp as the newest crash reported, but another key.
+        add([SampleCrash(7, timeStamp=1500000005.0), SampleCrash(6)])
+        self.assertEqual(self.report(cc, None, index), [7, 6])
+        self.assertEqual(self.report(cc, 'module1', index), [7])
+        self.assertEqual(self.report(cc, None, index), [])
+
+    def test_crash_store(self):
+        store = CrashStore(os.path.join(self.directory, 'crashes.db'))
+        try:
+            self.check_reports(store, store.add_many, store)
+        finally:
+            store.close()
+
+    def test_crash_log(self):
+        log = CrashLog(os.path.join(self.directory, 'crashes'))
+        try:
+            self.check_reports(log, lambda crashes: [log.add(c) for c in crashes])
+        finally:
+            log.close()
+
+    def test_crash_log_index(self):
+        log = CrashLog(os.path.join(self.directory, 'crashes'))
+        index = CrashIndex(os.path.join(self.directory, 'crashes.index'))
+
+        def add(crashes):
+            for c in crashes:
+                log.add(c)
+                index.add(c)
+        try:
+            self.check_reports(log, add, index)
+        finally:
+            index.close()
+            log.close()
+
+    def test_crash_log_loads_new_crashes(self):
+        log = CrashLog(os.path.join(self.directory, 'crashes'))
+        loaded = []
+        read_payload = log.read_payload
+
+        def counting_read_payload(segment, offset, length):
+            loaded.append(offset)
+            return read_payload(segment, offset, length)
+        log.read_payload = counting_read_payload
+        try:
+            for i in range(6):
+                log.add(SampleCrash(i))
+            self.assertEqual(self.report(log), [0, 1, 2, 3, 4, 5])
+            del loaded[:]
+            log.add(SampleCrash(6))
+            self.assertEqual(self.report(log), [6])
+            self.assertEqual(len(loaded), 1)
+        finally:
+            log.close()
+
+    def test_dbm_index_update(self):
+        cc = DbmCrashContainer(os.path.join(self.directory, 'crashes.dbm'))
+        index = CrashIndex(os.path.join(self.directory, 'crashes.index'), unique=True)
+
+        def add(crashes):
+            for c in crashes:
+                cc.add(c)
+            self.assertEqual(index.update(cc), len(crashes))
+        try:
+            self.check_reports(cc, add, index)
+            self.assertEqual(index.update(cc), 0)
+            cc.remove(SampleCrash(3))
+            index.update(cc)
+            self.assertEqual(len(index), len(cc))
+        finally:
+            index.close()
+
+    def test_old_watermark_file(self):
+        with open(self.config + '.watermark', 'w') as fd:
+            json.dump({'database': 'test', 'timestamp': 1500000002.0,
+                       'keys': [], 'seen': []}, fd)
+        self.assertEqual(Watermark.for_config(self.config, 'test').timestamp, 1500000002.0)
+        query = CrashQuery.from_strings(module='module1')
+        self.assertEqual(Watermark.for_config(self.config, 'test', query).timestamp, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import threading
+import time
+import unittest
+
+from crashdbg.writer import CrashWriter
+
+from .crashes import SampleCrash
+
+
+class BatchContainer(object):
+    """
+    Container that remembers the batches of crashes written into it.
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    def __contains__(self, crash):
+        return crash.key() in [c.key() for batch in self.batches for c in batch]
+
+    def __len__(self):
+        return sum(len(batch) for batch in self.batches)
+
+    def add_many(self, crashes):
+        self.batches.append(list(crashes))
+
+    def numbers(self):
+        return [c.pc - 0x401000 for batch in self.batches for c in batch]
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.001)
+
+
+class CrashWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.container = BatchContainer()
+        self.lock = threading.Lock()
+
+    def start(self, policy, queue_size=2):
+        writer = CrashWriter(self.container, queue_size=queue_size, policy=policy, lock=self.lock)
+        # Hold the container lock, so the writer takes the first crash
+        # out of the queue and then waits to write it.
+        self.lock.acquire()
+        writer.add(SampleCrash(0))
+        wait_until(lambda: writer.queue.qsize() == 0)
+        return writer
+
+    def test_drop_oldest(self):
+        writer = self.start('drop_oldest')
+        for i in range(1, 5):
+            writer.add(SampleCrash(i))
+        self.assertEqual(writer.dropped, 2)
+        self.assertNotIn(SampleCrash(1).key(), writer.pending)
+        self.assertIn(SampleCrash(4).key(), writer.pending)
+        # The crash waiting to be written counts too.
+        self.assertEqual(sum(writer.pending.values()), 3)
+        self.lock.release()
+        self.assertEqual(len(writer), 3)
+        writer.close()
+        self.assertEqual(self.container.numbers(), [0, 3, 4])
+        self.assertEqual(len(writer), 3)
+
+    def test_block(self):
+        writer = self.start('block')
+        writer.add(SampleCrash(1))
+        writer.add(SampleCrash(2))
+        adding = threading.Thread(target=writer.add, args=(SampleCrash(3),))
+        adding.start()
+        adding.join(0.1)
+        self.assertTrue(adding.is_alive())
+        self.lock.release()
+        adding.join()
+        writer.close()
+        self.assertEqual(writer.dropped, 0)
+        self.assertEqual(self.container.numbers(), [0, 1, 2, 3])
+
+    def test_batches(self):
+        writer = self.start('block', queue_size=8)
+        for i in range(1, 6):
+            writer.add(SampleCrash(i))
+        self.lock.release()
+        writer.close()
+        # The queued crashes were written in a single batch.
+        self.assertEqual(len(self.container.batches), 2)
+        self.assertEqual(self.container.numbers(), [0, 1, 2, 3, 4, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()